@@ -1,12 +1,15 @@
+import json
 import os
 from typing import List
 from loguru import logger
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
+from bot.utils.telegram_scheduler import TelegramSendScheduler
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -21,6 +24,66 @@ class Settings(BaseSettings):
     API_BASE: str
     FORMAT_LOG: str = "{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}"
     LOG_ROTATION: str = "10 MB"
+    PLANFIX_TIMEOUT: float = 30.0  # Таймаут одного запроса к Planfix, сек.
+    PLANFIX_POOL_SIZE: int = 20  # Максимум одновременных соединений с Planfix
+    PLANFIX_PREFETCH_PAGES: int = 2  # Сколько страниц списков Planfix запрашивать наперёд
+    PLANFIX_COALESCE_REDIS: bool = False  # Объединять одинаковые запросы к Planfix между репликами через Redis
+    PLANFIX_PRICE_CACHE_TTL: int = 900  # Время жизни кэша прайс-листа Planfix, сек.
+    PLANFIX_RATE_LIMIT: float = 10.0  # Запросов к Planfix в секунду (0 — без ограничения)
+    PLANFIX_RATE_BURST: int = 20  # Допустимый всплеск запросов к Planfix
+    PLANFIX_RATE_LIMIT_REDIS: bool = False  # Общий лимит запросов к Planfix для всех реплик через Redis
+    PLANFIX_MIN_CONCURRENCY: int = 2  # Нижняя граница адаптивного лимита одновременных запросов
+    PLANFIX_TARGET_LATENCY: float = 5.0  # Ответы медленнее этого считаются перегрузкой Planfix, сек.
+    PLANFIX_MAX_RETRIES: int = 3  # Повторы идемпотентных запросов к Planfix
+    PLANFIX_BREAKER_FAILURE_RATE: float = 0.5  # Доля ошибок/медленных вызовов, размыкающая предохранитель
+    PLANFIX_BREAKER_WINDOW: int = 20  # Сколько последних вызовов эндпоинта учитывает предохранитель
+    PLANFIX_BREAKER_MIN_CALLS: int = 5  # Минимум вызовов в окне для размыкания
+    PLANFIX_BREAKER_SLOW_CALL: float = 10.0  # Вызов дольше этого считается ошибкой, сек.
+    PLANFIX_BREAKER_RESET_TIMEOUT: float = 30.0  # Через сколько пробовать разомкнутый эндпоинт снова, сек.
+    PLANFIX_STALE_CACHE_SIZE: int = 1000  # Сколько последних успешных ответов хранить для stale-if-error
+    PLANFIX_UPLOAD_CONCURRENCY: int = 4  # Сколько файлов одновременно загружать в Planfix
+    PLANFIX_ORDER_LINE_WORKERS: int = 5  # Сколько позиций заказа одновременно передавать в Planfix
+    PLANFIX_OUTBOX_WORKERS: int = 4  # Воркеры очереди записи в Planfix в этой реплике (0 — не разбирать очередь)
+    PLANFIX_OUTBOX_BATCH_SIZE: int = 5  # Сколько записей очереди воркер забирает за раз
+    PLANFIX_OUTBOX_POLL_INTERVAL: float = 2.0  # Период опроса очереди, сек.
+    PLANFIX_OUTBOX_MAX_ATTEMPTS: int = 10  # После стольких попыток операция уходит в dead letters
+    PLANFIX_OUTBOX_LEASE: float = 300.0  # Через сколько секунд незавершённая операция возвращается в очередь
+    PLANFIX_OUTBOX_RETRY_BASE: float = 2.0  # Начальная задержка повтора, сек.
+    PLANFIX_OUTBOX_RETRY_CAP: float = 600.0  # Максимальная задержка повтора, сек.
+    PLANFIX_COMMENT_WINDOW: float = 1.0  # Окно склейки исходящих комментариев одного чата, сек. (0 — не склеивать)
+    PLANFIX_COMMENT_MAX_MESSAGES: int = 20  # Не больше стольких сообщений в одном комментарии
+    PLANFIX_COMMENT_MAX_CHARS: int = 8000  # Не длиннее стольких символов (одно длинное сообщение не режется)
+    USER_CACHE_TTL: float = 300.0  # Время жизни профиля пользователя в кэше, сек. (0 — без кэша)
+    USER_CACHE_SIZE: int = 10000  # Сколько профилей держать в памяти процесса
+    USER_CACHE_REDIS: bool = False  # Общий для реплик слой кэша профилей в Redis
+    FORWARD_WORKERS: int = 4  # Воркеры фоновой пересылки переписки в группу и Planfix
+    FORWARD_QUEUE_SIZE: int = 500  # Размер очереди одного воркера пересылки
+    FORWARD_QUEUE_POLICY: str = "block"  # При переполнении: block, drop_new, drop_old, inline
+    FORWARD_PUT_TIMEOUT: float = 1.0  # Сколько ждать места в очереди при политике block, сек.
+    GROUP_MIRROR_WINDOW: float = 1.5  # Окно сбора сообщений пользователя в одну пересылку в группу, сек. (0 — сразу)
+    GROUP_MIRROR_INDEX_TTL: float = 604800.0  # Сколько помнить, чьё сообщение переслано в группу, сек.
+    GROUP_MIRROR_INDEX_REDIS: bool = True  # Хранить индекс сообщений группы в Redis (переживает перезапуск)
+    TG_GLOBAL_RATE: float = 25.0  # Сообщений в секунду от бота всего (лимит Telegram ~30)
+    TG_GLOBAL_BURST: int = 30
+    TG_PRIVATE_CHAT_RATE: float = 1.0  # Сообщений в секунду в один личный чат
+    TG_PRIVATE_CHAT_BURST: int = 5
+    TG_GROUP_RATE: float = 0.33  # Сообщений в секунду в одну группу (лимит Telegram ~20 в минуту)
+    TG_GROUP_BURST: int = 5
+    TG_MAX_RETRY_AFTER: int = 3  # Сколько раз повторять запрос после 429 RetryAfter
+    TELEGRAM_UPDATE_MODE: str = "polling"  # Приём обновлений: polling или webhook
+    TELEGRAM_WEBHOOK_URL: str = ""  # Публичный адрес FastAPI-приложения для webhook, например https://bot.example.com
+    TELEGRAM_WEBHOOK_PATH: str = "/telegram/webhook"
+    TELEGRAM_WEBHOOK_SECRET: str = ""  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (обязателен для webhook)
+    TELEGRAM_WEBHOOK_CONCURRENCY: int = 50  # Сколько обновлений обрабатывать одновременно в реплике
+    TELEGRAM_UPDATE_DEDUP_TTL: int = 600  # Сколько помнить обработанные update_id, сек.
+    FSM_STORAGE: str = "memory"  # Хранилище состояний FSM: memory или redis
+    FSM_STATE_TTL: int = 86400  # Через сколько секунд без изменений состояние FSM удаляется из Redis (0 — хранить всегда)
+    FSM_REDIS_MAX_CONNECTIONS: int = 20  # Размер пула соединений хранилища FSM с Redis
+    STOCK_SYNC_ENABLED: bool = True  # Эта реплика синхронизирует зеркало остатков
+    STOCK_SYNC_INTERVAL: int = 60  # Период дельта-синхронизации зеркала, сек.
+    STOCK_FULL_SYNC_INTERVAL: int = 3600  # Период полной сверки зеркала, сек.
+    STOCK_ID_SYNC_INTERVAL: int = 300  # Период сверки состава зеркала по id (меньше MAX_STALENESS), сек.
+    STOCK_MIRROR_MAX_STALENESS: int = 600  # Старше — читаем остатки напрямую из Planfix, сек.
     DB_HOST: str = os.environ.get("DB_HOST")
     DB_PORT: str = os.environ.get("DB_PORT")
     DB_NAME: str = os.environ.get("DB_NAME")
@@ -41,7 +104,38 @@ settings = Settings()
 # Инициализируем бота и диспетчер
 bot = Bot(token=settings.BOT_TOKEN,
           default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
+# Все запросы бота к Bot API проходят через планировщик с лимитами Telegram
+telegram_scheduler = TelegramSendScheduler(
+    global_rate=settings.TG_GLOBAL_RATE,
+    global_burst=settings.TG_GLOBAL_BURST,
+    private_rate=settings.TG_PRIVATE_CHAT_RATE,
+    private_burst=settings.TG_PRIVATE_CHAT_BURST,
+    group_rate=settings.TG_GROUP_RATE,
+    group_burst=settings.TG_GROUP_BURST,
+    max_retries=settings.TG_MAX_RETRY_AFTER,
+    mirror_chat_ids=(settings.TARGET_CHAT_ID,),
+)
+bot.session.middleware(telegram_scheduler)
+
+
+def _make_fsm_storage() -> BaseStorage:
+    """Хранилище FSM: в памяти процесса или в Redis, общее для реплик и переживающее перезапуск."""
+    if settings.FSM_STORAGE != "redis":
+        return MemoryStorage()
+    from redis.asyncio import BlockingConnectionPool, Redis
+    from aiogram.fsm.storage.redis import RedisStorage
+    pool = BlockingConnectionPool(host=settings.DB_HOST, port=6379, db=0,
+                                  max_connections=settings.FSM_REDIS_MAX_CONNECTIONS, timeout=5)
+    ttl = settings.FSM_STATE_TTL or None
+    return RedisStorage(
+        Redis(connection_pool=pool),
+        state_ttl=ttl,
+        data_ttl=ttl,
+        json_dumps=lambda data: json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+    )
+
+
+dp = Dispatcher(storage=_make_fsm_storage())
 admins = settings.ADMIN_IDS
 
 log_file_path = os.path.join(os.path.dirname(
@@ -53,6 +147,56 @@ logger.add("stderr", format=settings.FORMAT_LOG, level="DEBUG")
 database_url = settings.DB_URL
 pf_token = settings.PLANFIX_TOKEN
 pf_url_rest = settings.PLANFIX_URL_REST
+pf_timeout = settings.PLANFIX_TIMEOUT
+pf_pool_size = settings.PLANFIX_POOL_SIZE
+pf_prefetch_pages = settings.PLANFIX_PREFETCH_PAGES
+pf_coalesce_redis = settings.PLANFIX_COALESCE_REDIS
+pf_price_cache_ttl = settings.PLANFIX_PRICE_CACHE_TTL
+pf_rate_limit = settings.PLANFIX_RATE_LIMIT
+pf_rate_burst = settings.PLANFIX_RATE_BURST
+pf_rate_limit_redis = settings.PLANFIX_RATE_LIMIT_REDIS
+pf_min_concurrency = settings.PLANFIX_MIN_CONCURRENCY
+pf_target_latency = settings.PLANFIX_TARGET_LATENCY
+pf_max_retries = settings.PLANFIX_MAX_RETRIES
+pf_breaker_failure_rate = settings.PLANFIX_BREAKER_FAILURE_RATE
+pf_breaker_window = settings.PLANFIX_BREAKER_WINDOW
+pf_breaker_min_calls = settings.PLANFIX_BREAKER_MIN_CALLS
+pf_breaker_slow_call = settings.PLANFIX_BREAKER_SLOW_CALL
+pf_breaker_reset_timeout = settings.PLANFIX_BREAKER_RESET_TIMEOUT
+pf_stale_cache_size = settings.PLANFIX_STALE_CACHE_SIZE
+pf_upload_concurrency = settings.PLANFIX_UPLOAD_CONCURRENCY
+pf_order_line_workers = settings.PLANFIX_ORDER_LINE_WORKERS
+pf_outbox_workers = settings.PLANFIX_OUTBOX_WORKERS
+pf_outbox_batch_size = settings.PLANFIX_OUTBOX_BATCH_SIZE
+pf_outbox_poll_interval = settings.PLANFIX_OUTBOX_POLL_INTERVAL
+pf_outbox_max_attempts = settings.PLANFIX_OUTBOX_MAX_ATTEMPTS
+pf_outbox_lease = settings.PLANFIX_OUTBOX_LEASE
+pf_outbox_retry_base = settings.PLANFIX_OUTBOX_RETRY_BASE
+pf_outbox_retry_cap = settings.PLANFIX_OUTBOX_RETRY_CAP
+pf_comment_window = settings.PLANFIX_COMMENT_WINDOW
+pf_comment_max_messages = settings.PLANFIX_COMMENT_MAX_MESSAGES
+pf_comment_max_chars = settings.PLANFIX_COMMENT_MAX_CHARS
+user_cache_ttl = settings.USER_CACHE_TTL
+user_cache_size = settings.USER_CACHE_SIZE
+user_cache_redis = settings.USER_CACHE_REDIS
+forward_workers = settings.FORWARD_WORKERS
+forward_queue_size = settings.FORWARD_QUEUE_SIZE
+forward_queue_policy = settings.FORWARD_QUEUE_POLICY
+forward_put_timeout = settings.FORWARD_PUT_TIMEOUT
+group_mirror_window = settings.GROUP_MIRROR_WINDOW
+group_mirror_index_ttl = settings.GROUP_MIRROR_INDEX_TTL
+group_mirror_index_redis = settings.GROUP_MIRROR_INDEX_REDIS
+telegram_update_mode = settings.TELEGRAM_UPDATE_MODE
+telegram_webhook_url = settings.TELEGRAM_WEBHOOK_URL
+telegram_webhook_path = settings.TELEGRAM_WEBHOOK_PATH
+telegram_webhook_secret = settings.TELEGRAM_WEBHOOK_SECRET
+telegram_webhook_concurrency = settings.TELEGRAM_WEBHOOK_CONCURRENCY
+telegram_update_dedup_ttl = settings.TELEGRAM_UPDATE_DEDUP_TTL
+stock_sync_enabled = settings.STOCK_SYNC_ENABLED
+stock_sync_interval = settings.STOCK_SYNC_INTERVAL
+stock_full_sync_interval = settings.STOCK_FULL_SYNC_INTERVAL
+stock_id_sync_interval = settings.STOCK_ID_SYNC_INTERVAL
+stock_mirror_max_staleness = settings.STOCK_MIRROR_MAX_STALENESS
 n8n_aiagent_webhook = settings.N8N_AIAGENT_WEBHOOK
 target_chat_id = settings.TARGET_CHAT_ID
 db_host = settings.DB_HOST
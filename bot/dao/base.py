@@ -1,21 +1,71 @@
-from typing import List, Any, Dict
+import inspect
+from contextlib import asynccontextmanager
+from typing import List, Any, Dict, Optional, Callable, Tuple
 
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.future import select
-from sqlalchemy import update as sqlalchemy_update, delete as sqlalchemy_delete, func
+from sqlalchemy import update as sqlalchemy_update, delete as sqlalchemy_delete, func, column, values as sql_values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from loguru import logger
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import subqueryload
+from sqlalchemy.ext.asyncio import AsyncSession
 from bot.database import async_session_maker
+from bot.utils.cursor import encode_cursor, decode_cursor
 from bot.stocks.models_order import Order
 
+
+@asynccontextmanager
+async def session_scope(session: Optional[AsyncSession] = None):
+    """
+    Сессия для метода DAO.
+
+    С переданной session (единица работы обновления) метод работает в транзакции вызывающего
+    кода: изменения только flush-атся, commit делает владелец сессии. Без неё открывается
+    своя сессия с транзакцией, которая фиксируется при выходе из блока.
+    """
+    if session is not None:
+        yield session
+        return
+    # Без expire_on_commit возвращённые объекты остаются читаемыми после закрытия сессии
+    async with async_session_maker(expire_on_commit=False) as own_session:
+        async with own_session.begin():
+            yield own_session
+        await run_after_commit(own_session)
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], Any]):
+    """Откладывает callback (например, сброс кэша) до commit единицы работы."""
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+async def commit_unit_of_work(session: AsyncSession):
+    """
+    Фиксирует единицу работы обновления, не дожидаясь конца обработчика. Вызывается перед
+    внешними вызовами (ответы в Telegram, Planfix), чтобы соединение и блокировки строк
+    не удерживались, пока они выполняются. Следующий запрос через session откроет новую транзакцию.
+    """
+    await session.commit()
+    await run_after_commit(session)
+
+
+async def run_after_commit(session: AsyncSession):
+    for callback in session.info.pop("after_commit", []):
+        try:
+            result = callback()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике после commit: {e}")
+
+
 class BaseDAO:
     model = None  # Устанавливается в дочернем классе
 
     @classmethod
-    async def find_one_or_none_by_id(cls, data_id: int):
+    async def find_one_or_none_by_id(cls, data_id: int, session: Optional[AsyncSession] = None):
         logger.info(f"Поиск {cls.model.__name__} с ID: {data_id}")
-        async with async_session_maker() as session:
+        async with session_scope(session) as session:
             try:
                 query = select(cls.model).filter_by(id=data_id)
                 result = await session.execute(query)
@@ -30,9 +80,9 @@ class BaseDAO:
                 raise
 
     @classmethod
-    async def find_one_or_none(cls, **filter_by):
+    async def find_one_or_none(cls, session: Optional[AsyncSession] = None, **filter_by):
         logger.info(f"Поиск одной записи {cls.model.__name__} по фильтрам: {filter_by}")
-        async with async_session_maker() as session:
+        async with session_scope(session) as session:
             try:
                 query = select(cls.model).filter_by(**filter_by)
                 result = await session.execute(query)
@@ -47,9 +97,9 @@ class BaseDAO:
                 raise
 
     @classmethod
-    async def find_all(cls, **filter_by):
+    async def find_all(cls, session: Optional[AsyncSession] = None, **filter_by):
         logger.info(f"Поиск всех записей {cls.model.__name__} по фильтрам: {filter_by}")
-        async with async_session_maker() as session:
+        async with session_scope(session) as session:
             try:
                 query = select(cls.model).filter_by(**filter_by)
                 result = await session.execute(query)
@@ -61,76 +111,66 @@ class BaseDAO:
                 raise
 
     @classmethod
-    async def add(cls, **values):
+    async def add(cls, session: Optional[AsyncSession] = None, **values):
         logger.info(f"Добавление новой записи в {cls.model.__name__}: {values}")
-        async with async_session_maker() as session:
-            async with session.begin():
-                new_instance = cls.model(**values)
-                session.add(new_instance)
-                await session.flush()  # Убедимся, что id доступен после flush
-                instance_id = new_instance.id  # Извлекаем id до завершения транзакции
-                await session.commit()
-                logger.info(f"Запись {cls.model.__name__} успешно добавлена.")
-                return instance_id  # Перемещаем return внутрь блока транзакции
-        
+        async with session_scope(session) as session:
+            new_instance = cls.model(**values)
+            session.add(new_instance)
+            await session.flush()  # Убедимся, что id доступен после flush
+            instance_id = new_instance.id  # Извлекаем id до завершения транзакции
+        logger.info(f"Запись {cls.model.__name__} успешно добавлена.")
+        return instance_id
+
     @classmethod
-    async def add_many(cls, instances: list[dict]):
+    async def add_many(cls, instances: list[dict], session: Optional[AsyncSession] = None):
         logger.info(f"Добавление нескольких записей {cls.model.__name__}. Количество: {len(instances)}")
-        async with async_session_maker() as session:
-            async with session.begin():
-                new_instances = [cls.model(**values) for values in instances]
-                session.add_all(new_instances)
-                await session.flush()  # Убедимся, что id доступны после flush
-                instance_ids = [instance.id for instance in new_instances]  # Извлекаем id до завершения транзакции
-                await session.commit()
-                logger.info(f"Успешно добавлено {len(new_instances)} записей.")
-                return instance_ids  # Перемещаем return внутрь блока транзакции
+        async with session_scope(session) as session:
+            new_instances = [cls.model(**values) for values in instances]
+            session.add_all(new_instances)
+            await session.flush()  # Убедимся, что id доступны после flush
+            instance_ids = [instance.id for instance in new_instances]  # Извлекаем id до завершения транзакции
+        logger.info(f"Успешно добавлено {len(new_instances)} записей.")
+        return instance_ids
 
     @classmethod
-    async def update(cls, filter_by, **values):
+    async def update(cls, filter_by, session: Optional[AsyncSession] = None, **values):
         logger.info(f"Обновление записей {cls.model.__name__} по фильтру: {filter_by} с параметрами: {values}")
-        async with async_session_maker() as session:
-            async with session.begin():
-                query = (
-                    sqlalchemy_update(cls.model)
-                    .where(*[getattr(cls.model, k) == v for k, v in filter_by.items()])
-                    .values(**values)
-                    .execution_options(synchronize_session="fetch")
-                )
-                try:
-                    result = await session.execute(query)
-                    await session.commit()
-                    logger.info(f"Обновлено {result.rowcount} записей.")
-                    return result.rowcount
-                except SQLAlchemyError as e:
-                    await session.rollback()
-                    logger.error(f"Ошибка при обновлении записей: {e}")
-                    raise e
+        query = (
+            sqlalchemy_update(cls.model)
+            .where(*[getattr(cls.model, k) == v for k, v in filter_by.items()])
+            .values(**values)
+            .execution_options(synchronize_session="fetch")
+        )
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(query)
+            logger.info(f"Обновлено {result.rowcount} записей.")
+            return result.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при обновлении записей: {e}")
+            raise e
 
     @classmethod
-    async def delete(cls, delete_all: bool = False, **filter_by):
+    async def delete(cls, delete_all: bool = False, session: Optional[AsyncSession] = None, **filter_by):
         logger.info(f"Удаление записей {cls.model.__name__} по фильтру: {filter_by}")
         if not delete_all and not filter_by:
             logger.error("Нужен хотя бы один фильтр для удаления.")
             raise ValueError("Нужен хотя бы один фильтр для удаления.")
 
-        async with async_session_maker() as session:
-            async with session.begin():
-                query = sqlalchemy_delete(cls.model).filter_by(**filter_by)
-                try:
-                    result = await session.execute(query)
-                    await session.commit()
-                    logger.info(f"Удалено {result.rowcount} записей.")
-                    return result.rowcount
-                except SQLAlchemyError as e:
-                    await session.rollback()
-                    logger.error(f"Ошибка при удалении записей: {e}")
-                    raise e
+        query = sqlalchemy_delete(cls.model).filter_by(**filter_by)
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(query)
+            logger.info(f"Удалено {result.rowcount} записей.")
+            return result.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при удалении записей: {e}")
+            raise e
 
     @classmethod
-    async def count(cls, **filter_by):
+    async def count(cls, session: Optional[AsyncSession] = None, **filter_by):
         logger.info(f"Подсчет количества записей {cls.model.__name__} по фильтру: {filter_by}")
-        async with async_session_maker() as session:
+        async with session_scope(session) as session:
             try:
                 query = select(func.count(cls.model.id)).filter_by(**filter_by)
                 result = await session.execute(query)
@@ -142,26 +182,37 @@ class BaseDAO:
                 raise
 
     @classmethod
-    async def paginate(cls, page: int = 1, page_size: int = 10, **filter_by):
+    async def paginate(cls, cursor: Optional[str] = None, page_size: int = 10, session: Optional[AsyncSession] = None,
+                       **filter_by) -> Tuple[List[Any], Optional[str]]:
+        """
+        Keyset-пагинация по id: страница записей после cursor и курсор следующей страницы
+        (None на последней). Стоимость страницы не зависит от её номера.
+        """
         logger.info(
             f"Пагинация записей {cls.model.__name__} по фильтру: {filter_by}, "
-            f"страница: {page}, "
+            f"курсор: {cursor}, "
             f"размер страницы: {page_size}")
-        async with async_session_maker() as session:
+        after = decode_cursor(cursor)
+        async with session_scope(session) as session:
             try:
                 query = select(cls.model).filter_by(**filter_by)
-                result = await session.execute(query.offset((page - 1) * page_size).limit(page_size))
+                if after:
+                    query = query.where(cls.model.id > after[0])
+                # Лишняя запись показывает, есть ли следующая страница
+                result = await session.execute(query.order_by(cls.model.id).limit(page_size + 1))
                 records = result.scalars().all()
-                logger.info(f"Найдено {len(records)} записей на странице {page}.")
-                return records
+                next_cursor = encode_cursor(records[page_size - 1].id) if len(records) > page_size else None
+                records = records[:page_size]
+                logger.info(f"Найдено {len(records)} записей на странице.")
+                return records, next_cursor
             except SQLAlchemyError as e:
                 logger.error(f"Ошибка при пагинации записей: {e}")
                 raise
 
     @classmethod
-    async def find_by_ids(cls, ids: List[int]) -> List[Any]:
+    async def find_by_ids(cls, ids: List[int], session: Optional[AsyncSession] = None) -> List[Any]:
         logger.info(f"Поиск записей {cls.model.__name__} по списку ID: {ids}")
-        async with async_session_maker() as session:
+        async with session_scope(session) as session:
             try:
                 query = select(cls.model).filter(cls.model.id.in_(ids))
                 result = await session.execute(query)
@@ -172,55 +223,100 @@ class BaseDAO:
                 logger.error(f"Ошибка при поиске записей по списку ID: {e}")
                 raise
 
+    # asyncpg принимает не больше 32767 параметров в одном запросе
+    MAX_QUERY_PARAMS = 32767
+
+    @classmethod
+    def _batches(cls, rows: List[Dict[str, Any]], batch_size: int, insert: bool = False):
+        """
+        Делит строки на пачки с одинаковым набором колонок и не больше MAX_QUERY_PARAMS параметров.
+        В INSERT параметрами становятся и значения по умолчанию, поэтому считаем все колонки таблицы.
+        """
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for columns, group in groups.items():
+            width = len(cls.model.__table__.c) if insert else len(columns)
+            size = max(1, min(batch_size, cls.MAX_QUERY_PARAMS // max(1, width)))
+            for start in range(0, len(group), size):
+                yield list(columns), group[start:start + size]
+
     @classmethod
-    async def upsert(cls, unique_fields: List[str], **values) -> Any:
+    def _upsert_statement(cls, rows: List[Dict[str, Any]], columns: List[str], unique_fields: List[str]):
+        stmt = pg_insert(cls.model).values(rows)
+        set_ = {column: stmt.excluded[column] for column in columns if column not in unique_fields}
+        if "updated_at" in cls.model.__table__.c and "updated_at" not in set_:
+            set_["updated_at"] = func.now()
+        return stmt.on_conflict_do_update(index_elements=unique_fields, set_=set_).returning(cls.model.id)
+
+    @classmethod
+    async def upsert(cls, unique_fields: List[str], session: Optional[AsyncSession] = None, **values) -> Any:
+        """
+        Вставляет запись или обновляет существующую с теми же unique_fields
+        (INSERT … ON CONFLICT DO UPDATE, нужен уникальный индекс по этим полям). Возвращает id.
+        """
         logger.info(f"Upsert для {cls.model.__name__}")
-        filter_dict = {field: values[field] for field in unique_fields if field in values}
-
-        async with async_session_maker() as session:
-            async with session.begin():
-                existing = await cls.find_one_or_none(**filter_dict)
-                if existing:
-                    # Обновляем существующую запись
-                    for key, value in values.items():
-                        setattr(existing, key, value)
-                    await session.commit()
-                    logger.info(f"Обновлена существующая запись {cls.model.__name__}")
-                    return existing.id  # Перемещаем return внутрь блока транзакции
-                else:
-                    # Создаем новую запись
-                    new_instance = cls.model(**values)
-                    session.add(new_instance)
-                    await session.flush()  # Убедимся, что id доступен после flush
-                    instance_id = new_instance.id  # Извлекаем id до завершения транзакции
-                    await session.commit()
-                    logger.info(f"Создана новая запись {cls.model.__name__}")
-                    return instance_id  # Перемещаем return внутрь блока транзакции
+        stmt = cls._upsert_statement([values], list(values), unique_fields)
+        try:
+            async with session_scope(session) as session:
+                record_id = (await session.execute(stmt)).scalar_one()
+            logger.info(f"Upsert записи {cls.model.__name__} с id {record_id}")
+            return record_id
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при upsert записи {cls.model.__name__}: {e}")
+            raise
+
+    @classmethod
+    async def upsert_many(cls, rows: List[Dict[str, Any]], unique_fields: List[str],
+                          session: Optional[AsyncSession] = None, batch_size: int = 1000) -> List[int]:
+        """
+        Многострочный upsert пачками по batch_size строк в одной транзакции.
+        Из строк с одинаковыми unique_fields остаётся последняя. Возвращает id вставленных и обновлённых записей.
+        """
+        if not rows:
+            return []
+        logger.info(f"Upsert {len(rows)} записей {cls.model.__name__}")
+        # Одна команда ON CONFLICT не может обновить строку дважды
+        unique_rows = list({tuple(row.get(field) for field in unique_fields): row for row in rows}.values())
+        ids = []
+        try:
+            async with session_scope(session) as session:
+                for columns, batch in cls._batches(unique_rows, batch_size, insert=True):
+                    result = await session.execute(cls._upsert_statement(batch, columns, unique_fields))
+                    ids.extend(result.scalars().all())
+            logger.info(f"Upsert {len(ids)} записей {cls.model.__name__} выполнен")
+            return ids
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом upsert записей {cls.model.__name__}: {e}")
+            raise
 
     @classmethod
-    async def bulk_update(cls, records: List[Dict[str, Any]]) -> int:
+    async def bulk_update(cls, records: List[Dict[str, Any]], session: Optional[AsyncSession] = None,
+                          batch_size: int = 1000) -> int:
+        """
+        Обновляет записи по id одним UPDATE … FROM (VALUES …) на пачку записей
+        с одинаковым набором полей. Записи без id пропускаются.
+        """
         logger.info(f"Массовое обновление записей {cls.model.__name__}")
-        async with async_session_maker() as session:
-            async with session.begin():
-                try:
-                    updated_count = 0
-                    for record in records:
-                        if 'id' not in record:
-                            continue
-
-                        update_data = {k: v for k, v in record.items() if k != 'id'}
-                        stmt = (
-                            sqlalchemy_update(cls.model)
-                            .filter_by(id=record['id'])
-                            .values(**update_data)
-                        )
-                        result = await session.execute(stmt)
-                        updated_count += result.rowcount
-
-                    await session.commit()
-                    logger.info(f"Обновлено {updated_count} записей")
-                    return updated_count
-                except SQLAlchemyError as e:
-                    await session.rollback()
-                    logger.error(f"Ошибка при массовом обновлении: {e}")
-                    raise
\ No newline at end of file
+        table = cls.model.__table__
+        records = [record for record in records if 'id' in record and len(record) > 1]
+        try:
+            updated_count = 0
+            async with session_scope(session) as session:
+                for columns, batch in cls._batches(records, batch_size):
+                    rows = sql_values(*[column(name, table.c[name].type) for name in columns], name="v").data(
+                        [tuple(record[name] for name in columns) for record in batch]
+                    )
+                    stmt = (
+                        sqlalchemy_update(table)
+                        .where(table.c.id == rows.c.id)
+                        .values({name: rows.c[name] for name in columns if name != 'id'})
+                        .returning(table.c.id)
+                    )
+                    result = await session.execute(stmt)
+                    updated_count += len(result.all())
+            logger.info(f"Обновлено {updated_count} записей")
+            return updated_count
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении: {e}")
+            raise
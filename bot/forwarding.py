@@ -0,0 +1,166 @@
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Optional
+from aiogram import types
+from loguru import logger
+
+from bot.config import (bot, target_chat_id, forward_workers, forward_queue_size, forward_queue_policy,
+                        forward_put_timeout, group_mirror_window, group_mirror_index_ttl,
+                        group_mirror_index_redis)
+from bot.planfix_outbox import enqueue_incoming_comment, enqueue_outgoing_comment
+from bot.users.dao import UserDAO
+from bot.utils.coalescing_buffer import CoalescingBuffer
+from bot.utils.message_index import MessageIndex, MessageOwner
+from bot.utils.planfix_utils import strip_html
+from bot.utils.work_queue import KeyedWorkPool
+
+INCOMING = "incoming"
+OUTGOING = "outgoing"
+
+# forward_messages принимает не больше 100 сообщений
+MAX_FORWARD_BATCH = 100
+
+# Фоновая пересылка переписки в Telegram-группу и чат Planfix.
+# Задачи одного пользователя выполняются по порядку, поэтому история в группе не перемешивается.
+forward_pool = KeyedWorkPool(
+    "forwarding",
+    workers=forward_workers,
+    maxsize=forward_queue_size,
+    policy=forward_queue_policy,
+    put_timeout=forward_put_timeout,
+)
+
+
+@dataclass(slots=True)
+class MirroredMessage:
+    direction: str  # INCOMING или OUTGOING
+    user_id: int
+    username: str
+    from_chat_id: int
+    message_id: int
+    chat_pf_id: Optional[int] = None
+
+
+def _header(direction: str, user_id: int, username: str, count: int) -> str:
+    header = (f"Входящее сообщение от {user_id} (@{username})" if direction == INCOMING
+              else f"Исходящее сообщение для {user_id} (@{username})")
+    return header if count == 1 else f"{header} — {count} шт."
+
+
+class GroupMirror:
+    """
+    Пересылка переписки в группу операторов пачками.
+
+    Сообщения одного пользователя, поступившие в пределах window секунд, пересылаются
+    одним forward_messages под общим заголовком (подряд идущие сообщения одного
+    направления — под одним). Для каждого сообщения в группе в индекс записывается
+    его владелец (telegram_id и chat_pf_id), по которому маршрутизируются ответы операторов.
+    """
+
+    def __init__(self, chat_id: int, window: float, index_ttl: float, redis_client=None):
+        self.chat_id = chat_id
+        self.buffer: CoalescingBuffer[int, MirroredMessage] = CoalescingBuffer(
+            self._forward, window=window, max_items=MAX_FORWARD_BATCH, join=list
+        )
+        self.index = MessageIndex(chat_id, index_ttl, redis_client=redis_client)
+
+    async def add(self, message: MirroredMessage):
+        await self.buffer.add(message.user_id, message)
+
+    async def owner_of(self, group_message_id: int) -> Optional[MessageOwner]:
+        return await self.index.get(group_message_id)
+
+    async def _forward(self, user_id: int, messages: list[MirroredMessage]):
+        # Берём самый свежий chat_pf_id: чат в Planfix мог появиться, пока копились сообщения
+        chat_pf_id = next((m.chat_pf_id for m in reversed(messages) if m.chat_pf_id), None)
+        owner = MessageOwner(user_id, chat_pf_id)
+        for (direction, from_chat_id), run in groupby(messages, key=lambda m: (m.direction, m.from_chat_id)):
+            run = list(run)
+            header_text = _header(direction, user_id, run[0].username, len(run))
+            header = await bot.send_message(chat_id=self.chat_id, text=header_text)
+            forwarded = await bot.forward_messages(
+                chat_id=self.chat_id,
+                from_chat_id=from_chat_id,
+                message_ids=sorted(m.message_id for m in run)
+            )
+            await self.index.set_many([header.message_id] + [m.message_id for m in forwarded], owner)
+            logger.info(f"{header_text} переслано в {self.chat_id}")
+
+    async def flush_all(self):
+        await self.buffer.flush_all()
+
+    def stats(self) -> dict:
+        return {"buffer": self.buffer.stats(), "index": self.index.stats()}
+
+
+def _make_group_mirror() -> GroupMirror:
+    redis_client = None
+    if group_mirror_index_redis:
+        from bot.utils.cache import redis_client
+    return GroupMirror(target_chat_id, window=group_mirror_window, index_ttl=group_mirror_index_ttl,
+                       redis_client=redis_client)
+
+
+group_mirror = _make_group_mirror()
+
+
+async def mirror_incoming_message(event: types.Message, skip_planfix: bool):
+    """Пересылает входящее сообщение пользователя в группу и добавляет его комментарием в Planfix."""
+    user_id = event.from_user.id
+    username = event.from_user.username if event.from_user.username else "None"
+    message_text = event.text
+
+    # Получаем данные пользователя через DAO
+    logger.debug(f"Получение данных пользователя: telegram_id={user_id}")
+    user_data = await UserDAO.get_profile(user_id)
+    chat_pf_id = user_data.chat_pf_id if user_data else None
+
+    # Пересылаем сообщение в группу Telegram
+    logger.debug(f"Пересылка входящего сообщения в Telegram-группу: user_id={user_id}, username={username}")
+    await group_mirror.add(MirroredMessage(INCOMING, user_id, username, event.chat.id, event.message_id, chat_pf_id))
+
+    # Пропускаем проверку chat_pf_id для команды /start и кнопок меню
+    if skip_planfix:
+        logger.debug(f"Команда /start или меню-кнопка, пропускаем проверку chat_pf_id для пользователя {user_id}")
+        return
+
+    if user_data and user_data.chat_pf_id:
+        logger.debug(f"Данные пользователя: chat_pf_id={user_data.chat_pf_id}, contact_pf_id={user_data.contact_pf_id}")
+        success = await enqueue_incoming_comment(
+            chat_pf_id=user_data.chat_pf_id,
+            contact_pf_id=user_data.contact_pf_id,
+            comment=message_text
+        )
+        if not success:
+            logger.error(f"Не удалось поставить комментарий в очередь Planfix для пользователя {user_id}")
+    else:
+        logger.warning(f"У пользователя {user_id} нет chat_pf_id для пользовательского сообщения '{message_text}'")
+
+
+async def mirror_outgoing_message(msg: types.Message):
+    """Добавляет исходящее сообщение бота комментарием в Planfix и пересылает его в группу."""
+    user_id = msg.chat.id
+    username = msg.chat.username if msg.chat.username else "None"
+    message_text = msg.text if msg.text else "Сообщение без текста"
+
+    logger.debug(f"Перехват исходящего сообщения: {message_text} для пользователя {user_id}")
+
+    # Очищаем HTML перед отправкой в Planfix
+    clean_message_text = strip_html(message_text)
+
+    logger.info(f"Обрабатываем исходящее сообщение: {clean_message_text}")
+    user_data = await UserDAO.get_profile(user_id)
+    if user_data and user_data.chat_pf_id:
+        success = await enqueue_outgoing_comment(
+            chat_pf_id=user_data.chat_pf_id,
+            comment=clean_message_text
+        )
+        if not success:
+            logger.error(f"Не удалось поставить исходящий комментарий в очередь Planfix для пользователя {user_id}")
+        else:
+            logger.info(f"Исходящий комментарий поставлен в очередь Planfix для пользователя {user_id}")
+    else:
+        logger.warning(f"У пользователя {user_id} нет chat_pf_id")
+
+    chat_pf_id = user_data.chat_pf_id if user_data else None
+    await group_mirror.add(MirroredMessage(OUTGOING, user_id, username, msg.chat.id, msg.message_id, chat_pf_id))
@@ -7,9 +7,8 @@ from aiogram import F
 from aiogram.types import BotCommand, BotCommandScopeDefault
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
 from loguru import logger
-import re
 
-from bot.config import bot, admins, dp, target_chat_id
+from bot.config import bot, admins, dp, telegram_update_mode, telegram_webhook_url, telegram_webhook_path, telegram_webhook_secret
 from bot.users.router import user_router
 from bot.stocks.router_product import product_router
 from bot.stocks.router_cart import cart_router
@@ -19,12 +18,34 @@ from bot.stocks.router_aiagent import aiagent_router
 from bot.stocks.group_router import group_router
 from bot.stocks.router_web_filter import web_filter_router
 from bot.webhook import app as fastapi_app  # Импортируем FastAPI-приложение
-from bot.planfix import add_incoming_comment_to_chat, add_outgoing_comment_to_chat
-from bot.users.dao import UserDAO
+from bot.planfix_outbox import planfix_outbox
+from bot.forwarding import forward_pool, group_mirror, mirror_incoming_message, mirror_outgoing_message
+from bot.planfix_client import planfix_client
+from bot.stocks.stock_mirror import stock_mirror
+from bot.telegram_updates import update_ingestor
+from bot.database import async_session_maker
+from bot.dao.base import run_after_commit
+
+
+# Middleware единицы работы: одна сессия БД на обновление, доступная обработчикам как session.
+# Соединение берётся из пула только при первом запросе. Обработчик фиксирует записи
+# (commit_unit_of_work) до ответов пользователю и запросов в Planfix, чтобы не держать
+# транзакцию открытой во время внешних вызовов; остальное фиксируется после обработчика
+# или откатывается, если он упал.
+class UnitOfWorkMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data: dict):
+        # Объекты, прочитанные до промежуточного commit, остаются доступны обработчику
+        async with async_session_maker(expire_on_commit=False) as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            await session.commit()
+        await run_after_commit(session)
+        return result
 
-def strip_html(text: str) -> str:
-    clean = re.compile('<.*?>')
-    return re.sub(clean, '', text)
 
 # Middleware для пересылки входящих сообщений (от пользователя к боту)
 class ForwardIncomingMessageMiddleware(BaseMiddleware):
@@ -36,10 +57,6 @@ class ForwardIncomingMessageMiddleware(BaseMiddleware):
 
         try:
             if event.chat.type == "private" and event.text is not None:  # Только для личных чатов с текстом (skip web_app_data forwarding)
-                user_id = event.from_user.id
-                username = event.from_user.username if event.from_user.username else "None"
-                message_text = event.text
-
                 # Список кнопок меню, для которых пропускаем Planfix
                 menu_buttons = [
                     "✨ Поиск с ИИ",
@@ -48,42 +65,13 @@ class ForwardIncomingMessageMiddleware(BaseMiddleware):
                     "🗂 Мои заказы",
                     "Фильтр моделей"
                 ]
+                skip_planfix = event.text.startswith("/start") or event.text in menu_buttons
 
-                is_menu_button = message_text in menu_buttons
-
-                # Пересылаем сообщение в группу Telegram
-                logger.debug(f"Пересылка входящего сообщения в Telegram-группу: user_id={user_id}, username={username}, is_menu={is_menu_button}")
-                user_info = f"Входящее сообщение от {user_id} (@{username})"
-                await bot.send_message(
-                    chat_id=target_chat_id,
-                    text=user_info
-                )
-                await bot.forward_message(
-                    chat_id=target_chat_id,
-                    from_chat_id=event.chat.id,
-                    message_id=event.message_id
+                # Пересылка выполняется в фоне, обработчик её не ждёт
+                await forward_pool.submit(
+                    event.from_user.id,
+                    lambda: mirror_incoming_message(event, skip_planfix=skip_planfix)
                 )
-                logger.info(f"{user_info} переслано в {target_chat_id}")
-
-                # Пропускаем проверку chat_pf_id для команды /start и кнопок меню
-                if message_text.startswith("/start") or is_menu_button:
-                    logger.debug(f"Команда /start или меню-кнопка, пропускаем проверку chat_pf_id для пользователя {user_id}")
-                else:
-                    # Получаем данные пользователя через DAO
-                    logger.debug(f"Получение данных пользователя: telegram_id={user_id}")
-                    user_data = await UserDAO.find_one_or_none(telegram_id=user_id)
-                    if user_data and user_data.chat_pf_id:
-                        logger.debug(f"Данные пользователя: chat_pf_id={user_data.chat_pf_id}, contact_pf_id={user_data.contact_pf_id}")
-                        success = await add_incoming_comment_to_chat(
-                            chat_pf_id=user_data.chat_pf_id,
-                            contact_pf_id=user_data.contact_pf_id,
-                            comment=message_text
-                        )
-                        if not success:
-                            logger.error(f"Не удалось добавить комментарий в Planfix для пользователя {user_id}")
-                            # Не блокируем обработку, логируем
-                    else:
-                        logger.warning(f"У пользователя {user_id} нет chat_pf_id для пользовательского сообщения '{message_text}'")
 
         except Exception as e:
             logger.error(f"Ошибка при пересылке входящего сообщения: {e}")
@@ -110,80 +98,16 @@ class ForwardOutgoingMessageMiddleware(BaseMiddleware):
 
         try:
             if isinstance(result, types.Message):
-                user_id = result.chat.id
-                username = result.chat.username if result.chat.username else "None"
-                message_text = result.text if result.text else "Сообщение без текста"
-
-                logger.debug(f"Перехват исходящего сообщения: {message_text} для пользователя {user_id}")
-
-                # Очищаем HTML перед отправкой в Planfix
-                clean_message_text = strip_html(message_text)
-
-                logger.info(f"Обрабатываем исходящее сообщение: {clean_message_text}")
-                user_data = await UserDAO.find_one_or_none(telegram_id=user_id)
-                if user_data and user_data.chat_pf_id:
-                    success = await add_outgoing_comment_to_chat(
-                        chat_pf_id=user_data.chat_pf_id,
-                        comment=clean_message_text
-                    )
-                    if not success:
-                        logger.error(f"Не удалось добавить исходящий комментарий в Planfix для пользователя {user_id}")
-                    else:
-                        logger.info(f"Исходящий комментарий добавлен в Planfix для пользователя {user_id}")
-                else:
-                    logger.warning(f"У пользователя {user_id} нет chat_pf_id")
-
-                user_info = f"Исходящее сообщение для {user_id} (@{username})"
-                await bot.send_message(
-                    chat_id=target_chat_id,
-                    text=user_info
-                )
-                await bot.forward_message(
-                    chat_id=target_chat_id,
-                    from_chat_id=result.chat.id,
-                    message_id=result.message_id
-                )
-                logger.info(f"{user_info} переслано в {target_chat_id}")
-
+                messages = [result]
             elif isinstance(result, list) and all(isinstance(msg, types.Message) for msg in result):
-                for msg in result:
-                    user_id = msg.chat.id
-                    username = msg.chat.username if msg.chat.username else "None"
-                    message_text = msg.text if msg.text else "Сообщение без текста"
-
-                    logger.debug(f"Перехват исходящего сообщения: {message_text} для пользователя {user_id}")
-
-                    # Очищаем HTML перед отправкой в Planfix
-                    clean_message_text = strip_html(message_text)
-
-                    logger.info(f"Обрабатываем исходящее сообщение: {clean_message_text}")
-                    user_data = await UserDAO.find_one_or_none(telegram_id=user_id)
-                    if user_data and user_data.chat_pf_id:
-                        success = await add_outgoing_comment_to_chat(
-                            chat_pf_id=user_data.chat_pf_id,
-                            comment=clean_message_text
-                        )
-                        if not success:
-                            logger.error(f"Не удалось добавить исходящий комментарий в Planfix для пользователя {user_id}")
-                        else:
-                            logger.info(f"Исходящий комментарий добавлен в Planfix для пользователя {user_id}")
-                    else:
-                        logger.warning(f"У пользователя {user_id} нет chat_pf_id")
-
-                    user_info = f"Исходящее сообщение для {user_id} (@{username})"
-                    await bot.send_message(
-                        chat_id=target_chat_id,
-                        text=user_info
-                    )
-                    await bot.forward_message(
-                        chat_id=target_chat_id,
-                        from_chat_id=msg.chat.id,
-                        message_id=msg.message_id
-                    )
-                    logger.info(f"{user_info} переслано в {target_chat_id}")
-
+                messages = result
             else:
                 logger.warning(f"Результат не является сообщением или списком сообщений: {type(result)}")
+                messages = []
+
+            # Пересылка выполняется в фоне: ответ обработчика уже у пользователя
+            for msg in messages:
+                await forward_pool.submit(msg.chat.id, lambda msg=msg: mirror_outgoing_message(msg))
         except Exception as e:
             logger.error(f"Ошибка при обработке исходящего сообщения: {e}")
 
@@ -211,13 +135,35 @@ async def stop_bot():
             await bot.send_message(admin_id, 'Бот остановлен. За что?😔')
     except:
         pass
+    await stock_mirror.stop()
+    await forward_pool.stop()
+    await group_mirror.flush_all()
+    await planfix_outbox.stop()
+    await planfix_client.close()
     logger.error("Бот остановлен!")
 
 # Функция для запуска бота и FastAPI
 async def run_all():
-    # Запускаем polling для бота
-    logger.info("Starting bot polling...")
-    bot_task = asyncio.create_task(dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types()))
+    if telegram_update_mode == "webhook":
+        if not telegram_webhook_url or not telegram_webhook_secret:
+            raise ValueError("Для TELEGRAM_UPDATE_MODE=webhook нужны TELEGRAM_WEBHOOK_URL и TELEGRAM_WEBHOOK_SECRET")
+        # Обновления приходят в FastAPI-приложение, polling не запускается
+        logger.info("Starting bot in webhook mode...")
+        await dp.emit_startup(bot=bot, **dp.workflow_data)
+        await update_ingestor.start(telegram_webhook_url, telegram_webhook_path)
+        bot_task = None
+    else:
+        # Запускаем polling для бота; webhook, оставшийся от webhook-режима, снимаем
+        logger.info("Starting bot polling...")
+        await bot.delete_webhook(drop_pending_updates=False)
+        bot_task = asyncio.create_task(dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types()))
+
+    # Запускаем синхронизацию зеркала остатков Planfix
+    stock_mirror.start()
+
+    # Запускаем воркеры очереди записи в Planfix и пересылки переписки
+    planfix_outbox.start()
+    forward_pool.start()
 
     # Запускаем FastAPI-сервер
     logger.info("Starting FastAPI server...")
@@ -225,11 +171,18 @@ async def run_all():
     server = uvicorn.Server(config)
     fastapi_task = asyncio.create_task(server.serve())
 
+    if bot_task is None:
+        await fastapi_task
+        await update_ingestor.stop()
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+        return
+
     # Ожидаем завершения обеих задач
     await asyncio.gather(bot_task, fastapi_task)
 
 # Функция для регистрации роутеров и middleware
 def setup_bot():
+    dp.update.outer_middleware(UnitOfWorkMiddleware())
     dp.message.middleware(ForwardIncomingMessageMiddleware())
     dp.message.outer_middleware(ForwardOutgoingMessageMiddleware())
     dp.callback_query.outer_middleware(ForwardOutgoingMessageMiddleware())
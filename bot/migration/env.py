@@ -1,6 +1,8 @@
 from bot.users.models import User
 from bot.stocks.models_cart import Cart
 from bot.stocks.models_order import Order, OrderItem, OrderStatusHistory
+from bot.stocks.models_stock import StockTask, SyncState
+from bot.stocks.models_outbox import PlanfixOutbox
 from bot.database import Base, database_url
 from alembic import context
 from sqlalchemy.ext.asyncio import async_engine_from_config
@@ -0,0 +1,58 @@
+"""add stock_tasks mirror and sync_states
+
+Revision ID: 3f1c9a7d52e4
+Revises: ce6756034b96
+Create Date: 2026-10-18 10:12:41.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d52e4'
+down_revision: Union[str, None] = 'ce6756034b96'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('stock_tasks',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('filter_id', sa.String(), nullable=False),
+    sa.Column('task_pf_id', sa.Integer(), nullable=False),
+    sa.Column('model_pf_id', sa.String(), nullable=True),
+    sa.Column('operation', sa.String(), nullable=True),
+    sa.Column('product_name', sa.String(), nullable=True),
+    sa.Column('device', sa.String(), nullable=True),
+    sa.Column('brand', sa.String(), nullable=True),
+    sa.Column('stock_balance', sa.Integer(), nullable=True),
+    sa.Column('price', sa.Integer(), nullable=True),
+    sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('synced_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('filter_id', 'task_pf_id', name='uq_stock_tasks_filter_task')
+    )
+    op.create_index('ix_stock_tasks_filter_model_operation', 'stock_tasks', ['filter_id', 'model_pf_id', 'operation'], unique=False)
+    op.create_table('sync_states',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('cursor', sa.DateTime(), nullable=True),
+    sa.Column('last_sync_at', sa.DateTime(), nullable=True),
+    sa.Column('last_full_sync_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('sync_states')
+    op.drop_index('ix_stock_tasks_filter_model_operation', table_name='stock_tasks')
+    op.drop_table('stock_tasks')
@@ -0,0 +1,36 @@
+"""denormalize order status
+
+Revision ID: 5e7a3c1d9f20
+Revises: 8b2d4e61a9c3
+Create Date: 2026-10-18 18:21:40.117305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e7a3c1d9f20'
+down_revision: Union[str, None] = '8b2d4e61a9c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_orders_telegram_id'), 'orders', ['telegram_id'], unique=False)
+    # orders.status становится источником текущего статуса: переносим последний статус из истории
+    op.execute("""
+        UPDATE orders SET status = latest.status
+        FROM (
+            SELECT DISTINCT ON (order_id) order_id, status
+            FROM order_status_history
+            ORDER BY order_id, timestamp DESC, id DESC
+        ) AS latest
+        WHERE orders.id = latest.order_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_orders_telegram_id'), table_name='orders')
@@ -0,0 +1,44 @@
+"""add planfix_outbox
+
+Revision ID: 8b2d4e61a9c3
+Revises: 3f1c9a7d52e4
+Create Date: 2026-10-18 14:03:27.551904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2d4e61a9c3'
+down_revision: Union[str, None] = '3f1c9a7d52e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('planfix_outbox',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('ordering_key', sa.String(), nullable=True),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_planfix_outbox_status_available', 'planfix_outbox', ['status', 'available_at'], unique=False)
+    op.create_index('ix_planfix_outbox_ordering_key', 'planfix_outbox', ['ordering_key', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_planfix_outbox_ordering_key', table_name='planfix_outbox')
+    op.drop_index('ix_planfix_outbox_status_available', table_name='planfix_outbox')
+    op.drop_table('planfix_outbox')
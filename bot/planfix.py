@@ -1,9 +1,13 @@
 import asyncio
-import requests
 import sys
 import aiohttp
 import logging
-from bot.config import pf_token, pf_url_rest
+from typing import AsyncIterable, Optional, Union
+from bot.config import pf_upload_concurrency
+from bot.planfix_client import planfix_client, PlanfixError, TASKS, CONTACTS, COMMENTS, DIRECTORY_ENTRIES
+from bot.planfix_cache import price_list_cache, crash_display_cache
+from bot.planfix_schema import STOCK_BALANCE
+from bot.stocks.stock_mirror import stock_mirror
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -11,58 +15,51 @@ sys.stdout.reconfigure(encoding='utf-8')
 logger = logging.getLogger(__name__)
 
 
+####################### LIST PAGINATION ####################################
+
+async def planfix_list(path: str, payload: dict, items_key: str) -> dict:
+    """
+    Собирает все страницы списочного метода Planfix в один ответ того же формата,
+    что и у одиночного запроса. При ошибке возвращает ответ Planfix как есть.
+    Пока Planfix недоступен, отдаёт сохранённые страницы — для ответов пользователю это лучше ошибки.
+    """
+    try:
+        items = [item async for item in planfix_client.paginate(path, payload, items_key, allow_stale=True)]
+    except PlanfixError as e:
+        logger.error(f"Ошибка при постраничном обходе {path}: {e}")
+        return e.response if isinstance(e.response, dict) else {"result": "fail"}
+    return {"result": "success", items_key: items}
+
+
 ####################### STOCK BALANCE ####################################
 
 async def planfix_stock_balance(query=None):
 
-    url = f"{pf_url_rest}/task/list"
+    path = "/task/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 100,
         "filterId": "104384",
         "fields": "id,12116,5542,6640,6282,12140"
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await stock_mirror.task_list("104384")
+    if data is None:
+        data = await planfix_list(path, payload, TASKS)
 
-    all_balance_tasks = data['tasks']
     result = []
     unique_devices = set()  # Создаем множество для уникальных значений device
     unique_brands = set()
 
-    for task in all_balance_tasks:
-        id_product = task['id']
-        stock_balance = 1
-        product_name = None
-        device = None
-        brand = None
-        price = None
-
-        for custom_field in task['customFieldData']:
-            if custom_field['field']['id'] == 12116:
-                stock_balance = int(custom_field['value'])
-            elif custom_field['field']['id'] == 5542:
-                product_name = custom_field['value']['value']
-            elif custom_field['field']['id'] == 6640:
-                device = custom_field['value']['value']
-            elif custom_field['field']['id'] == 6282:
-                brand = custom_field['value']['value']
-            elif custom_field['field']['id'] == 12140:
-                price_value = custom_field['value']
-                if isinstance(price_value, str) and price_value.isdigit():
-                    price = int(price_value)
-
-        if stock_balance is not None and product_name is not None:
+    for record in STOCK_BALANCE.decode_all(data):
+        stock_balance = record.stock_balance if record.stock_balance is not None else 1
+        product_name = record.product_name
+        device = record.device
+        brand = record.brand
+
+        if product_name is not None:
             if query is None or query.lower() in product_name.lower():
-                result.append((id_product, product_name,
-                              stock_balance, price, device, brand))
+                result.append((record.id, product_name,
+                              stock_balance, record.price, device, brand))
 
                 if device:  # Если device не пустое, добавляем его в множество
                     unique_devices.add(device)
@@ -77,11 +74,9 @@ async def planfix_stock_balance(query=None):
 
 async def planfix_stock_balance_filter(model_id: str, operation: str):
 
-    url = f"{pf_url_rest}/task/list"
+    path = "/task/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 100,
         "filterId": "104384",
         "filters": [
             {
@@ -100,13 +95,9 @@ async def planfix_stock_balance_filter(model_id: str, operation: str):
         "fields": "id,5556,12142,6640,6282,6274,5666,12110,5534,5532,5512"
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await stock_mirror.task_list("104384", model_pf_id=model_id, operation=operation)
+    if data is None:
+        data = await planfix_list(path, payload, TASKS)
 
     return data
 
@@ -115,11 +106,9 @@ async def planfix_stock_balance_filter(model_id: str, operation: str):
 
 async def planfix_all_production_filter(model_id: int):
 
-    url = f"{pf_url_rest}/task/list"
+    path = "/task/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 100,
         "filterId": "104400",
         "filters": [
             {
@@ -132,13 +121,9 @@ async def planfix_all_production_filter(model_id: int):
         "fields": "id,5556,12126,5498"
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await stock_mirror.task_list("104400", model_pf_id=model_id)
+    if data is None:
+        data = await planfix_list(path, payload, TASKS)
 
     return data
 
@@ -147,21 +132,13 @@ async def planfix_all_production_filter(model_id: int):
 
 async def planfix_contact(query=None):
 
-    url = f"{pf_url_rest}/contact/list"
+    path = "/contact/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 100,
         "fields": "id,12116,5542,6640,6282,12140"
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_list(path, payload, CONTACTS)
 
 
 # async def main():
@@ -175,19 +152,13 @@ async def planfix_contact(query=None):
 
 async def planfix_production_task_id(task_id: int):
 
-    url = f"{pf_url_rest}/task/{task_id}"
+    path = f"/task/{task_id}"
 
     payload = {
         "fields": "id,5556,12126,5498"
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.get(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.get(path, json=payload)
 
     return data
 
@@ -197,7 +168,7 @@ async def planfix_production_task_id(task_id: int):
 
 async def planfix_create_contact(telegram_id: int, username: str, first_name: str, last_name: str):
 
-    url = f"{pf_url_rest}/contact/"
+    path = "/contact/"
 
     payload = {
         "template": {
@@ -222,13 +193,7 @@ async def planfix_create_contact(telegram_id: int, username: str, first_name: st
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.post(path, json=payload)
 
     return data
 
@@ -238,7 +203,7 @@ async def planfix_create_contact(telegram_id: int, username: str, first_name: st
 
 async def planfix_create_chat(contact_pf_id: int):
 
-    url = f"{pf_url_rest}/task/"
+    path = "/task/"
 
     payload = {
         "template": {
@@ -249,93 +214,73 @@ async def planfix_create_chat(contact_pf_id: int):
         }
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.post(path, json=payload)
 
     return data
 
 
 ####################### ADD INCOMING COMMENT TO CHAT (PLANFIX) ####################################
 
-async def add_incoming_comment_to_chat(chat_pf_id: int, comment: str, contact_pf_id: int):
-
-    url = f"{pf_url_rest}/task/{chat_pf_id}/comments"
+async def find_chat_comment(chat_pf_id: int, comment: str, owner_id: str, depth: int = 20):
+    """
+    Ищет среди последних depth комментариев чата комментарий с тем же текстом и автором.
+    Нужен, чтобы повтор после потерянного ответа Planfix не продублировал комментарий.
+    """
+    data = await planfix_client.post(f"/task/{chat_pf_id}/comments/list", json={
+        "offset": 0,
+        "pageSize": depth,
+        "fields": "id,description,owner",
+        "sortOrder": "Desc"
+    })
+    comments = data.get(COMMENTS) if isinstance(data, dict) else None
+    for item in comments or []:
+        owner = item.get("owner") or {}
+        if (item.get("description") or "").strip() == comment.strip() and owner.get("id") == owner_id:
+            return {"result": "success", "id": item.get("id")}
+    return None
+
+
+async def _add_comment_to_chat(chat_pf_id: int, comment: str, owner_id: str, check_existing: bool = False):
+    async def find_created_comment():
+        return await find_chat_comment(chat_pf_id, comment, owner_id)
+
+    if check_existing:
+        found = await find_created_comment()
+        if found:
+            logger.info(f"Комментарий уже добавлен в чат {chat_pf_id}: {found['id']}")
+            return found
+
+    path = f"/task/{chat_pf_id}/comments"
 
     payload = {
         "description": comment,
           "owner": {
-            "id": f"contact:{contact_pf_id}"
+            "id": owner_id
         }
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.post(path, json=payload, idempotency_guard=find_created_comment)
 
     return data
 
 
-####################### ADD OUTGOING COMMENT TO CHAT (PLANFIX) ####################################
-
-async def add_outgoing_comment_to_chat(chat_pf_id: int, comment: str):
-
-    url = f"{pf_url_rest}/task/{chat_pf_id}/comments"
+async def add_incoming_comment_to_chat(chat_pf_id: int, comment: str, contact_pf_id: int,
+                                       check_existing: bool = False):
+    return await _add_comment_to_chat(chat_pf_id, comment, f"contact:{contact_pf_id}", check_existing)
 
-    payload = {
-        "description": comment,
-          "owner": {
-            "id": "contact:3077"
-        }
-        }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+####################### ADD OUTGOING COMMENT TO CHAT (PLANFIX) ####################################
 
-    return data
+async def add_outgoing_comment_to_chat(chat_pf_id: int, comment: str, check_existing: bool = False):
+    return await _add_comment_to_chat(chat_pf_id, comment, "contact:3077", check_existing)
 
 
 ####################### PRICE RE-GLUING (FILTER) ####################################
 
 async def planfix_price_re_gluing(model_id: int):
 
-    url = f"{pf_url_rest}/directory/1430/entry/list"
-
-    payload = {
-        "offset": 0,
-        "pageSize": 10,
-        "fields": "name,key,3780,3782,3784,3792",   # 3780 (Цена разборки/сборки); 3782 (Цена переклейки); 
-        "filterId": 104410,                                            # 3784 (Цена замены подсветки/тача); 3792 (Цена замены крышки);
-        "filters": [
-            {
-            "type": 6114,
-            "field": 4308, # Совместимость моделей
-            "operator": "equal",
-            "value": model_id
-            }
-        ]
-        }
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    # 3780 (Цена разборки/сборки); 3782 (Цена переклейки); 3784 (Цена замены подсветки/тача); 3792 (Цена замены крышки)
+    data = await price_list_cache.list_by_model(model_id, fields="name,key,3780,3782,3784,3792")
 
     return data
 
@@ -344,11 +289,9 @@ async def planfix_price_re_gluing(model_id: int):
 
 async def planfix_basic_nomenclature_re_gluing(model_id: int, filter_id: int):
 
-    url = f"{pf_url_rest}/directory/1442/entry/list"
+    path = "/directory/1442/entry/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 10,
         "fields": "3884,name,key,3902,3906,3892",   # 3884 (Название); 3902 (Прайс-лист); 3906 (Карточка основной номенклатуры);
         "filterId": filter_id,                      # 3892 (Цвет)
         "filters": [
@@ -361,13 +304,7 @@ async def planfix_basic_nomenclature_re_gluing(model_id: int, filter_id: int):
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_list(path, payload, DIRECTORY_ENTRIES)
 
     return data
 
@@ -376,75 +313,47 @@ async def planfix_basic_nomenclature_re_gluing(model_id: int, filter_id: int):
 
 async def  planfix_price_basic_nomenclature_re_gluing(model_id: int, pricelist_key: int):
 
-    url = f"{pf_url_rest}/directory/1430/entry/{pricelist_key}"
-
-    payload = {
-        "offset": 0,
-        "pageSize": 10,
-        "fields": "name,key,3782,3784",  # 3780 (Цена разборки/сборки); 3782 (Цена переклейки);
-        "filterId": 104410,                         # 3784 (Цена замены подсветки/тача); 
-        "filters": [
-            {
-            "type": 6114,
-            "field": 4308, # Совместимость моделей
-            "operator": "equal",
-            "value": model_id
-            }
-        ]
-        }
+    # 3782 (Цена переклейки); 3784 (Цена замены подсветки/тача)
+    data = await price_list_cache.get_entry(pricelist_key, fields="name,key,3782,3784")
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
+    return data
 
-    response = requests.get(url, json=payload, headers=headers)
-    data = response.json()
 
-    return data
+async def planfix_price_basic_nomenclature_re_gluing_batch(pricelist_keys) -> dict[int, dict]:
+    """
+    Цены переклейки сразу для набора ключей прайс-листа: {ключ: ответ как у
+    planfix_price_basic_nomenclature_re_gluing}. Записи запрашиваются параллельно.
+    """
+    # 3782 (Цена переклейки); 3784 (Цена замены подсветки/тача)
+    return await price_list_cache.get_entries(pricelist_keys, fields="name,key,3782,3784")
 
 
 ####################### PRICE BASIC BACK COVER (FILTER) ####################################
 
 async def planfix_price_basic_back_cover(model_id: int, pricelist_key: int):
 
-    url = f"{pf_url_rest}/directory/1430/entry/{pricelist_key}"
-
-    payload = {
-        "offset": 0,
-        "pageSize": 10,
-        "fields": "name,key,3792",   # 3792 (Цена замены крышки); 3780 (Цена разборки/сборки);
-        "filterId": 104410,                                            
-        "filters": [
-            {
-            "type": 6114,
-            "field": 4308, # Совместимость моделей
-            "operator": "equal",
-            "value": model_id
-            }
-        ]
-        }
+    # 3792 (Цена замены крышки)
+    data = await price_list_cache.get_entry(pricelist_key, fields="name,key,3792")
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
+    return data
 
-    response = requests.get(url, json=payload, headers=headers)
-    data = response.json()
 
-    return data
+async def planfix_price_basic_back_cover_batch(pricelist_keys) -> dict[int, dict]:
+    """
+    Цены замены крышки сразу для набора ключей прайс-листа: {ключ: ответ как у
+    planfix_price_basic_back_cover}. Записи запрашиваются параллельно.
+    """
+    # 3792 (Цена замены крышки)
+    return await price_list_cache.get_entries(pricelist_keys, fields="name,key,3792")
 
 
 ####################### BACK COVER (FILTER) ####################################
 
 async def planfix_back_cover_filter(model_id: str, operation: str):
 
-    url = f"{pf_url_rest}/task/list"
+    path = "/task/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 100,
         "filterId": "104384",
         "filters": [
             {
@@ -457,13 +366,7 @@ async def planfix_back_cover_filter(model_id: str, operation: str):
         "fields": "id,5556,"
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_list(path, payload, TASKS)
 
     return data
 
@@ -472,11 +375,9 @@ async def planfix_back_cover_filter(model_id: str, operation: str):
 
 async def planfix_basic_back_cover_cart(task_id: int, filter_id: int):
 
-    url = f"{pf_url_rest}/directory/1442/entry/list"
+    path = "/directory/1442/entry/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 10,
         "fields": "3884,name,key,3902,3906,3892",   # 3884 (Название); 3902 (Прайс-лист); 3906 (Карточка основной номенклатуры);
         "filterId": filter_id,                      # 3892 (Цвет)
         "filters": [
@@ -489,13 +390,7 @@ async def planfix_basic_back_cover_cart(task_id: int, filter_id: int):
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_list(path, payload, DIRECTORY_ENTRIES)
 
     return data
 
@@ -504,39 +399,48 @@ async def planfix_basic_back_cover_cart(task_id: int, filter_id: int):
 
 async def planfix_price_assembly_basic_back_cover(model_id: int):
 
-    url = f"{pf_url_rest}/directory/1430/entry/list"
+    # 3780 (Цена разборки/сборки)
+    data = await price_list_cache.list_by_model(model_id, fields="name,key,3780")
 
-    payload = {
-        "offset": 0,
-        "pageSize": 10,
-        "fields": "name,key,3780",   # 3780 (Цена разборки/сборки);
-        "filterId": 104410,                                            
-        "filters": [
-            {
-            "type": 6114,
-            "field": 4308, # Совместимость моделей
-            "operator": "equal",
-            "value": model_id
-            }
-        ]
-        }
+    return data
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
 
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+###### ДОБАВЛЕНИЕ ФОТО БИТИКА В ПЛАНФИКС ###############################
+
+async def upload_file_to_planfix(file: Union[bytes, AsyncIterable[bytes]], filename: str,
+                                 content_type: str = "image/jpeg") -> Optional[int]:
+    """
+    Загружает один файл в Planfix и возвращает его fileId.
 
-    return data
+    Args:
+        file (bytes | AsyncIterable[bytes]): Содержимое файла или поток его частей.
+            Поток передаётся в multipart-запрос по мере чтения, не накапливаясь в памяти.
+        filename (str): Имя файла в Planfix.
+        content_type (str): MIME-тип файла.
 
+    Returns:
+        int | None: fileId или None, если загрузка не удалась.
+    """
+    form = aiohttp.FormData()
+    form.add_field("file", file, filename=filename, content_type=content_type)
+    try:
+        data = await planfix_client.upload("/file/", form)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке файла {filename} в Planfix: {e}")
+        return None
+
+    file_id = data.get("id") if isinstance(data, dict) else None
+    if not file_id:
+        logger.error(f"Не удалось получить fileId для файла {filename} после загрузки в Planfix")
+        return None
+    logger.info(f"Файл {filename} успешно загружен в Planfix, fileId: {file_id}")
+    return file_id
 
-###### ДОБАВЛЕНИЕ ФОТО БИТИКА В ПЛАНФИКС ###############################
 
 async def upload_files_to_planfix(photo_files: list[bytes], filename_prefix: str = "photo") -> list[int]:
     """
-    Загружает несколько файлов в Planfix и возвращает список их fileId.
+    Загружает несколько файлов в Planfix параллельно (не более PLANFIX_UPLOAD_CONCURRENCY
+    одновременно) и возвращает список их fileId в исходном порядке.
     
     Args:
         photo_files (list[bytes]): Список байтов файлов фотографий.
@@ -545,33 +449,45 @@ async def upload_files_to_planfix(photo_files: list[bytes], filename_prefix: str
     Returns:
         list[int]: Список fileId загруженных файлов.
     """
-    url_upload = f"{pf_url_rest}/file/"
-    headers = {
-        "Authorization": f"Bearer {pf_token}"
+    semaphore = asyncio.Semaphore(pf_upload_concurrency)
+
+    async def upload(i: int, photo_file: bytes) -> Optional[int]:
+        async with semaphore:
+            return await upload_file_to_planfix(photo_file, filename=f"{filename_prefix}_{i+1}.jpg")
+
+    file_ids = await asyncio.gather(*(upload(i, photo_file) for i, photo_file in enumerate(photo_files)))
+    return [file_id for file_id in file_ids if file_id]
+
+
+async def attach_files_to_chat(chat_pf_id: int, file_ids: list[int], description: str) -> bool:
+    """
+    Прикрепляет загруженные файлы к одному комментарию в задаче Planfix.
+
+    Args:
+        chat_pf_id (int): ID чата/задачи в Planfix.
+        file_ids (list[int]): fileId загруженных файлов.
+        description (str): Текст комментария.
+
+    Returns:
+        bool: True, если комментарий создан.
+    """
+    path = f"/task/{chat_pf_id}/comments"
+    payload = {
+        "description": description,
+        "owner": {
+            "id": "contact:3077"  # Тот же owner, что в add_outgoing_comment_to_chat
+        },
+        "files": [{"id": file_id} for file_id in file_ids]
     }
     
-    file_ids = []
-    for i, photo_file in enumerate(photo_files):
-        filename = f"{filename_prefix}_{i+1}.jpg"
-        files = {
-            "file": (filename, photo_file, "image/jpeg")
-        }
-        
-        try:
-            response = requests.post(url_upload, headers=headers, files=files)
-            response.raise_for_status()
-            data = response.json()
-            file_id = data.get("id")
-            if not file_id:
-                logger.error(f"Не удалось получить fileId для файла {filename} после загрузки в Planfix")
-                continue
-            logger.info(f"Файл {filename} успешно загружен в Planfix, fileId: {file_id}")
-            file_ids.append(file_id)
-        except Exception as e:
-            logger.error(f"Ошибка при загрузке файла {filename} в Planfix: {e}")
-            continue
-
-    return file_ids
+    try:
+        await planfix_client.post(path, json=payload, raise_for_status=True)
+        logger.info(f"{len(file_ids)} фото успешно прикреплены к задаче {chat_pf_id} в Planfix в одном комментарии")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при прикреплении фото к задаче {chat_pf_id} в Planfix: {e}")
+        return False
+
 
 async def upload_photo_to_planfix(chat_pf_id: int, photo_files: list[bytes]) -> bool:
     """
@@ -591,57 +507,14 @@ async def upload_photo_to_planfix(chat_pf_id: int, photo_files: list[bytes]) ->
         return False
 
     # Шаг 2: Создаём один комментарий с несколькими файлами
-    url_comment = f"{pf_url_rest}/task/{chat_pf_id}/comments"
-    payload = {
-        "description": f"Добавлено {len(file_ids)} фото битика",
-        "owner": {
-            "id": "contact:3077"  # Тот же owner, что в add_outgoing_comment_to_chat
-        },
-        "files": [{"id": file_id} for file_id in file_ids]
-    }
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-    
-    try:
-        response = requests.post(url_comment, json=payload, headers=headers)
-        response.raise_for_status()
-        logger.info(f"{len(file_ids)} фото успешно прикреплены к задаче {chat_pf_id} в Planfix в одном комментарии")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка при прикреплении фото к задаче {chat_pf_id} в Planfix: {e}")
-        return False
+    return await attach_files_to_chat(chat_pf_id, file_ids, description=f"Добавлено {len(file_ids)} фото битика")
 
 
 ####################### KEY CRASH DISPLAY PLANFIX (FILTER) ####################################
 
 async def planfix_price_assembly_basic_back_cover(model_id: int):
 
-    url = f"{pf_url_rest}/directory/1432/entry/list"
-
-    payload = {
-        "offset": 0,
-        "pageSize": 10,
-        "fields": "name,key",   # 3780 (Цена разборки/сборки);                                          
-        "filters": [
-            {
-            "type": 6114,
-            "field": 3798, # Совместимость моделей
-            "operator": "equal",
-            "value": model_id
-            }
-        ]
-        }
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await crash_display_cache.list_by_model(model_id, fields="name,key")
 
     return data
 
@@ -650,11 +523,9 @@ async def planfix_price_assembly_basic_back_cover(model_id: int):
 
 async def planfix_stock_balance_spare_parts_filter(model_id: str):
 
-    url = f"{pf_url_rest}/task/list"
+    path = "/task/list"
 
     payload = {
-        "offset": 0,
-        "pageSize": 10,
         "filterId": "104398",       # фильтр задач "All stock balance: spare parts"
         "filters": [
             {
@@ -667,12 +538,8 @@ async def planfix_stock_balance_spare_parts_filter(model_id: str):
         "fields": "id,5512,12126,5718,5722"     # 5512 (Запчасть); 12126 (Price); 5718 (Цена закупки, RUB); 5722 (Св. остаток);
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await stock_mirror.task_list("104398", model_pf_id=model_id)
+    if data is None:
+        data = await planfix_list(path, payload, TASKS)
 
     return data
\ No newline at end of file
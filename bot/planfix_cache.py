@@ -0,0 +1,149 @@
+import asyncio
+from typing import Any, Iterable, Optional
+from loguru import logger
+
+from bot.config import pf_price_cache_ttl
+from bot.planfix_client import planfix_client, PlanfixError, DIRECTORY_ENTRIES
+from bot.utils.ttl_cache import TTLCache
+
+# Все поля цен справочника 1430 «Прайс-лист»:
+# 3780 (Цена разборки/сборки); 3782 (Цена переклейки); 3784 (Цена замены подсветки/тача); 3792 (Цена замены крышки)
+PRICE_LIST_FIELDS = "name,key,3780,3782,3784,3792"
+
+
+def _field_ids(fields: str) -> set[int]:
+    return {int(field) for field in fields.split(",") if field.strip().isdigit()}
+
+
+class DirectoryCache:
+    """
+    Кэш записей справочника Planfix с TTL.
+
+    Записи хранятся целиком (со всеми полями self.fields) по ключу записи, отдельно
+    хранится список ключей записей, совместимых с моделью. При чтении запись
+    обрезается до запрошенных полей, поэтому ответ совпадает с ответом Planfix
+    на тот же запрос. Инвалидация записи затрагивает и списки по моделям:
+    если в списке не хватает записи, он перезапрашивается целиком.
+    """
+
+    def __init__(self, directory_id: int, fields: str, model_field: int, ttl: float,
+                 filter_id: Optional[int] = None):
+        self.directory_id = directory_id
+        self.fields = fields
+        self.model_field = model_field
+        self.filter_id = filter_id
+        self.entries: TTLCache[int, dict] = TTLCache(ttl)
+        self.by_model: TTLCache[str, list[int]] = TTLCache(ttl)
+
+    def _project(self, entry: dict, fields: str) -> dict:
+        field_ids = _field_ids(fields)
+        return {
+            **entry,
+            "customFieldData": [
+                field_data for field_data in entry.get("customFieldData", [])
+                if field_data.get("field", {}).get("id") in field_ids
+            ]
+        }
+
+    def _list_payload(self, filters: list) -> dict:
+        payload = {"fields": self.fields, "filters": filters}
+        if self.filter_id is not None:
+            payload["filterId"] = self.filter_id
+        return payload
+
+    async def get_entry(self, key: Any, fields: Optional[str] = None) -> dict:
+        """
+        Запись справочника по ключу в формате ответа GET /directory/{id}/entry/{key}.
+        """
+        key = int(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            data = await planfix_client.get(f"/directory/{self.directory_id}/entry/{key}", json={"fields": self.fields})
+            if not isinstance(data, dict) or data.get("result") != "success" or "entry" not in data:
+                return data  # Ошибки не кэшируем
+            entry = data["entry"]
+            self.entries.set(key, entry)
+        return {"result": "success", "entry": self._project(entry, fields or self.fields)}
+
+    async def get_entries(self, keys: Iterable[Any], fields: Optional[str] = None) -> dict[int, dict]:
+        """
+        Записи справочника по набору ключей: {ключ: ответ как у get_entry}.
+        Закэшированные записи отдаются сразу, недостающие запрашиваются параллельно.
+        """
+        keys = list(dict.fromkeys(int(key) for key in keys))
+        responses = await asyncio.gather(*(self.get_entry(key, fields=fields) for key in keys), return_exceptions=True)
+        result = {}
+        for key, response in zip(keys, responses):
+            if isinstance(response, Exception):
+                logger.error(f"Ошибка загрузки записи {key} справочника {self.directory_id}: {response}")
+                response = {"result": "fail"}
+            result[key] = response
+        return result
+
+    async def list_by_model(self, model_id: Any, fields: Optional[str] = None) -> dict:
+        """
+        Записи справочника, совместимые с моделью, в формате ответа /directory/{id}/entry/list.
+        """
+        model_key = str(model_id)
+        keys = self.by_model.get(model_key)
+        entries = None
+        if keys is not None:
+            entries = [self.entries.peek(key) for key in keys]
+            if any(entry is None for entry in entries):
+                entries = None
+
+        if entries is None:
+            payload = self._list_payload([{
+                "type": 6114,
+                "field": self.model_field,  # Совместимость моделей
+                "operator": "equal",
+                "value": model_id
+            }])
+            try:
+                entries = [entry async for entry in planfix_client.paginate(
+                    f"/directory/{self.directory_id}/entry/list", payload, DIRECTORY_ENTRIES)]
+            except PlanfixError as e:
+                logger.error(f"Ошибка загрузки справочника {self.directory_id} для модели {model_id}: {e}")
+                return e.response if isinstance(e.response, dict) else {"result": "fail"}
+            for entry in entries:
+                self.entries.set(int(entry["key"]), entry)
+            self.by_model.set(model_key, [int(entry["key"]) for entry in entries])
+
+        fields = fields or self.fields
+        return {"result": "success", DIRECTORY_ENTRIES: [self._project(entry, fields) for entry in entries]}
+
+    def invalidate_entry(self, key: Any) -> bool:
+        """Сбрасывает одну запись; списки моделей с ней перезапросятся при следующем чтении."""
+        return self.entries.invalidate(int(key))
+
+    def invalidate_model(self, model_id: Any) -> bool:
+        return self.by_model.invalidate(str(model_id))
+
+    def clear(self):
+        self.entries.clear()
+        self.by_model.clear()
+
+    async def reload(self) -> int:
+        """
+        Перечитывает весь справочник и заменяет закэшированные записи свежими.
+        Списки совместимости моделей сохраняются и продолжают жить до истечения TTL.
+        """
+        entries = [entry async for entry in planfix_client.paginate(
+            f"/directory/{self.directory_id}/entry/list", self._list_payload([]), DIRECTORY_ENTRIES)]
+        self.entries.clear()
+        for entry in entries:
+            self.entries.set(int(entry["key"]), entry)
+        logger.info(f"Справочник {self.directory_id} перезагружен в кэш: {len(entries)} записей")
+        return len(entries)
+
+    def stats(self) -> dict:
+        return {"entries": self.entries.stats(), "by_model": self.by_model.stats()}
+
+
+# Справочник 1430 «Прайс-лист», фильтр 104410, поле 4308 «Совместимость моделей»
+price_list_cache = DirectoryCache(directory_id=1430, fields=PRICE_LIST_FIELDS, model_field=4308,
+                                  ttl=pf_price_cache_ttl, filter_id=104410)
+
+# Справочник 1432 (ключи битых дисплеев), поле 3798 «Совместимость моделей»
+crash_display_cache = DirectoryCache(directory_id=1432, fields="name,key", model_field=3798,
+                                     ttl=pf_price_cache_ttl)
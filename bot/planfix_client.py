@@ -0,0 +1,394 @@
+import asyncio
+import re
+import time
+import aiohttp
+from collections import deque, OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+from loguru import logger
+
+from bot.config import (
+    pf_token, pf_url_rest, pf_timeout, pf_pool_size, pf_prefetch_pages, pf_coalesce_redis,
+    pf_rate_limit, pf_rate_burst, pf_rate_limit_redis, pf_min_concurrency, pf_target_latency, pf_max_retries,
+    pf_breaker_failure_rate, pf_breaker_window, pf_breaker_min_calls, pf_breaker_slow_call,
+    pf_breaker_reset_timeout, pf_stale_cache_size
+)
+from bot.utils.single_flight import SingleFlight, RedisSingleFlight, make_key
+from bot.utils.rate_limit import TokenBucket, RedisTokenBucket, AIMDLimiter, backoff_delay
+from bot.utils.circuit_breaker import CircuitBreaker
+
+try:
+    # orjson заметно быстрее разбирает большие списки задач; без него работает стандартный json
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Ключ списка записей в ответах списочных методов Planfix
+TASKS = "tasks"
+CONTACTS = "contacts"
+DIRECTORY_ENTRIES = "directoryEntries"
+COMMENTS = "comments"
+
+# Статусы, после которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Числовые id в пути: у /task/1 и /task/2 общий предохранитель
+ID_SEGMENT = re.compile(r"/\d+")
+
+# Статусы, означающие перегрузку Planfix (снижают лимит одновременных запросов)
+OVERLOAD_STATUSES = {429, 503}
+
+
+class PlanfixError(Exception):
+    """Planfix вернул ответ с ошибкой"""
+
+    def __init__(self, message: str, response: Any = None):
+        super().__init__(message)
+        self.response = response
+
+
+class CircuitOpenError(PlanfixError):
+    """Предохранитель эндпоинта разомкнут, запрос к Planfix не выполнялся"""
+
+
+class PlanfixClient:
+    """
+    Общий асинхронный клиент Planfix REST API.
+
+    Держит одну aiohttp-сессию с пулом keep-alive соединений на весь процесс,
+    заголовки авторизации собираются один раз при создании сессии.
+    Одинаковые одновременные запросы чтения (coalesce=True) объединяются в один
+    через single_flight; запросы записи никогда не объединяются.
+
+    Все запросы проходят через общее ведро токенов (rate_limiter) и адаптивный
+    лимит одновременных запросов (concurrency). Идемпотентные запросы повторяются
+    при 429/5xx и сетевых ошибках; запросы записи — только при наличии idempotency_guard.
+
+    Для каждого эндпоинта (путь с заменой числовых id на {id}) ведётся свой
+    предохранитель. Пока он разомкнут или Planfix недоступен, запросы чтения
+    обслуживаются последним успешным ответом с пометкой "stale": True.
+    """
+
+    def __init__(self, base_url: str, token: str, timeout: float = 30.0, pool_size: int = 20,
+                 prefetch_pages: int = 2, single_flight: Optional[SingleFlight] = None,
+                 rate_limiter: Optional[TokenBucket] = None, concurrency: Optional[AIMDLimiter] = None,
+                 max_retries: int = 3, breaker_options: Optional[dict] = None, stale_cache_size: int = 1000):
+        self.base_url = base_url
+        self.breaker_options = breaker_options or {}
+        self.stale_cache_size = stale_cache_size
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._last_good: OrderedDict[str, Any] = OrderedDict()
+        self.single_flight = single_flight or SingleFlight()
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency or AIMDLimiter(min_limit=1, max_limit=pool_size, target_latency=timeout)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.prefetch_pages = prefetch_pages
+        self._headers = {"Authorization": f"Bearer {token}"}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия создаётся лениво, уже внутри работающего event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                headers=self._headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def _breaker(self, method: str, path: str) -> CircuitBreaker:
+        endpoint = f"{method} {ID_SEGMENT.sub('/{id}', path)}"
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, **self.breaker_options)
+        return breaker
+
+    def _remember(self, key: str, body: Any):
+        self._last_good[key] = body
+        self._last_good.move_to_end(key)
+        while len(self._last_good) > self.stale_cache_size:
+            self._last_good.popitem(last=False)
+
+    def _stale(self, key: Optional[str]) -> Any:
+        body = self._last_good.get(key) if key is not None else None
+        if isinstance(body, dict):
+            return {**body, "stale": True}
+        return body
+
+    async def request(self, method: str, path: str, *, json: Any = None, data: Any = None,
+                      timeout: Optional[float] = None, raise_for_status: bool = False,
+                      coalesce: bool = False, idempotent: Optional[bool] = None,
+                      idempotency_guard: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """
+        Выполняет запрос к Planfix и возвращает декодированный JSON-ответ.
+
+        Args:
+            method (str): HTTP-метод.
+            path (str): Путь относительно PLANFIX_URL_REST, например "/task/list".
+            json (Any): Тело запроса в формате JSON.
+            data (Any): Тело запроса в виде формы (для загрузки файлов).
+            timeout (float | None): Таймаут конкретного вызова, сек.
+            raise_for_status (bool): Бросать aiohttp.ClientResponseError на статусах 4xx/5xx.
+            coalesce (bool): Объединять с одинаковыми запросами в полёте (только для чтения).
+                Результат общий для всех ожидающих — его нельзя изменять.
+            idempotent (bool | None): Можно ли повторять запрос. По умолчанию повторяются
+                GET и объединяемые запросы чтения.
+            idempotency_guard (Callable | None): Для запросов записи: вызывается перед каждым
+                повтором и возвращает результат, если запись уже выполнена (тогда повтора
+                не будет), иначе None.
+
+        Returns:
+            Any: Декодированный JSON-ответ Planfix.
+        """
+        if idempotent is None:
+            idempotent = method == "GET" or coalesce
+        # Тело-форму нельзя отправить второй раз, поэтому загрузки файлов не повторяются
+        retryable = data is None and (idempotent or idempotency_guard is not None)
+        breaker = self._breaker(method, path)
+        key = make_key(f"planfix:{method}:{path}", json) if data is None else None
+        stale_key = key if idempotent else None
+
+        async def send():
+            try:
+                status, body = await self._send(method, path, json=json, data=data, timeout=timeout,
+                                                raise_for_status=raise_for_status, retryable=retryable,
+                                                idempotency_guard=None if idempotent else idempotency_guard,
+                                                breaker=breaker)
+            except (CircuitOpenError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                stale = self._stale(stale_key)
+                if stale is None:
+                    raise
+                logger.warning(f"Planfix {method} {path} недоступен ({type(e).__name__}), отдаём сохранённый ответ")
+                return stale
+
+            if stale_key is not None:
+                if status < 400 and not (isinstance(body, dict) and body.get("result") == "fail"):
+                    self._remember(stale_key, body)
+                elif status in RETRYABLE_STATUSES and stale_key in self._last_good:
+                    logger.warning(f"Planfix {method} {path} вернул статус {status}, отдаём сохранённый ответ")
+                    return self._stale(stale_key)
+            return body
+
+        if coalesce and key is not None:
+            return await self.single_flight.do(key, send)
+        return await send()
+
+    async def _send(self, method: str, path: str, *, json: Any = None, data: Any = None,
+                    timeout: Optional[float] = None, raise_for_status: bool = False, retryable: bool = False,
+                    idempotency_guard: Optional[Callable[[], Awaitable[Any]]] = None,
+                    breaker: Optional[CircuitBreaker] = None) -> tuple[int, Any]:
+        attempts = self.max_retries + 1 if retryable else 1
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            if attempt and idempotency_guard is not None:
+                existing = await idempotency_guard()
+                if existing is not None:
+                    logger.info(f"Planfix {method} {path} уже выполнен до повтора, используем существующий результат")
+                    return 200, existing
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(f"Предохранитель {breaker.name} разомкнут",
+                                       response={"result": "fail", "error": "circuit open"})
+            try:
+                status, retry_after, body = await self._attempt(
+                    method, path, json=json, data=data, timeout=timeout,
+                    raise_for_status=raise_for_status, final=last_attempt, breaker=breaker
+                )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"Planfix {method} {path}: {type(e).__name__} {e}, повтор через {delay:.2f} с")
+                await asyncio.sleep(delay)
+                continue
+
+            if status in RETRYABLE_STATUSES and not last_attempt:
+                delay = max(retry_after or 0, backoff_delay(attempt))
+                logger.warning(f"Planfix {method} {path} вернул статус {status}, повтор через {delay:.2f} с")
+                await asyncio.sleep(delay)
+                continue
+            return status, body
+
+    async def _attempt(self, method: str, path: str, *, json: Any = None, data: Any = None,
+                       timeout: Optional[float] = None, raise_for_status: bool = False, final: bool = True,
+                       breaker: Optional[CircuitBreaker] = None) -> tuple[int, Optional[float], Any]:
+        url = f"{self.base_url}{path}"
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        await self.concurrency.acquire()
+        started_at = time.monotonic()
+        latency, overloaded, recorded = None, False, False
+        try:
+            session = self._get_session()
+            async with session.request(method, url, json=json, data=data, **kwargs) as response:
+                latency = time.monotonic() - started_at
+                overloaded = response.status in OVERLOAD_STATUSES
+                if breaker is not None:
+                    if response.status in RETRYABLE_STATUSES:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success(latency)
+                    recorded = True
+                if response.status >= 400:
+                    logger.warning(f"Planfix {method} {path} вернул статус {response.status}")
+                    # Повторяемые статусы поднимаем как ошибку только на последней попытке
+                    if raise_for_status and (final or response.status not in RETRYABLE_STATUSES):
+                        response.raise_for_status()
+                retry_after = None
+                if response.status == 429:
+                    try:
+                        retry_after = float(response.headers.get("Retry-After", ""))
+                    except ValueError:
+                        pass
+                raw = await response.read()
+                try:
+                    body = json_loads(raw)
+                except ValueError:
+                    # Прокси и перегруженный Planfix отвечают HTML-страницей вместо JSON
+                    body = {"result": "fail", "code": response.status,
+                            "error": raw[:500].decode("utf-8", errors="replace")}
+                return response.status, retry_after, body
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            overloaded = isinstance(e, asyncio.TimeoutError)
+            if breaker is not None and not recorded:
+                breaker.record_failure()
+                recorded = True
+            raise
+        finally:
+            if breaker is not None and not recorded:
+                breaker.release()
+            await self.concurrency.release(latency=latency, overloaded=overloaded)
+
+    async def get(self, path: str, json: Any = None, timeout: Optional[float] = None) -> Any:
+        return await self.request("GET", path, json=json, timeout=timeout, coalesce=True)
+
+    async def post(self, path: str, json: Any = None, timeout: Optional[float] = None,
+                   raise_for_status: bool = False, coalesce: bool = False,
+                   idempotency_guard: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        return await self.request("POST", path, json=json, timeout=timeout, raise_for_status=raise_for_status,
+                                  coalesce=coalesce, idempotency_guard=idempotency_guard)
+
+    async def upload(self, path: str, form: aiohttp.FormData, timeout: Optional[float] = None) -> Any:
+        return await self.request("POST", path, data=form, timeout=timeout, raise_for_status=True)
+
+    async def paginate(self, path: str, payload: dict, items_key: str, page_size: int = 100,
+                       prefetch: Optional[int] = None, allow_stale: bool = False) -> AsyncIterator[dict]:
+        """
+        Постранично обходит списочный метод Planfix и отдаёт записи по одной.
+
+        Пока текущая страница обрабатывается, следующие (не более prefetch штук)
+        уже запрашиваются. Если вызывающий код прекращает итерацию раньше,
+        незавершённые запросы отменяются. Для немедленной отмены оборачивайте
+        генератор в contextlib.aclosing.
+
+        Args:
+            path (str): Путь списочного метода, например "/task/list".
+            payload (dict): Тело запроса без offset/pageSize.
+            items_key (str): Ключ списка записей в ответе (TASKS, CONTACTS, DIRECTORY_ENTRIES).
+            page_size (int): Размер страницы (Planfix допускает не более 100).
+            prefetch (int | None): Сколько страниц держать в полёте одновременно.
+            allow_stale (bool): Отдавать записи сохранённых страниц ("stale"), пока Planfix
+                недоступен. Без него такая страница считается ошибкой: синхронизации не должны
+                принимать старые данные за свежие.
+
+        Raises:
+            PlanfixError: Если Planfix вернул ответ с ошибкой или, без allow_stale, сохранённый ответ.
+        """
+        prefetch = max(1, prefetch or self.prefetch_pages)
+        pending: deque[asyncio.Task] = deque()
+        next_offset = payload.get("offset", 0)
+
+        def schedule():
+            nonlocal next_offset
+            page_payload = {**payload, "offset": next_offset, "pageSize": page_size}
+            next_offset += page_size
+            # Списочные методы только читают, поэтому страницы можно объединять
+            pending.append(asyncio.create_task(self.post(path, json=page_payload, coalesce=True)))
+
+        def cancel_pending():
+            for task in pending:
+                if task.done() and not task.cancelled():
+                    task.exception()  # Забираем исключение, чтобы asyncio не ругался на него
+                else:
+                    task.cancel()
+            pending.clear()
+
+        try:
+            schedule()
+            while pending:
+                data = await pending.popleft()
+                if not isinstance(data, dict) or data.get("result", "success") != "success":
+                    raise PlanfixError(f"Ошибка Planfix при обходе {path}: {data}", response=data)
+                if data.get("stale") and not allow_stale:
+                    raise PlanfixError(f"Planfix недоступен, при обходе {path} получен сохранённый ответ",
+                                       response={"result": "fail", "error": "stale"})
+
+                items = data.get(items_key) or []
+                if len(items) < page_size:
+                    # Последняя страница: запросы «наперёд» больше не нужны
+                    cancel_pending()
+                else:
+                    while len(pending) < prefetch:
+                        schedule()
+
+                for item in items:
+                    yield item
+        finally:
+            cancel_pending()
+
+    def stats(self) -> dict:
+        return {
+            "single_flight": dict(self.single_flight.stats),
+            "concurrency": self.concurrency.stats(),
+            "circuit_breakers": {name: breaker.stats() for name, breaker in self._breakers.items()},
+            "stale_responses": len(self._last_good),
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Сессия Planfix закрыта.")
+        self._session = None
+
+
+def _make_single_flight() -> SingleFlight:
+    if pf_coalesce_redis:
+        from bot.utils.cache import redis_client
+        return RedisSingleFlight(redis_client, prefix="planfix:singleflight", lock_ttl=pf_timeout,
+                                 wait_timeout=pf_timeout)
+    return SingleFlight()
+
+
+def _make_rate_limiter() -> Optional[TokenBucket]:
+    if pf_rate_limit <= 0:
+        return None
+    if pf_rate_limit_redis:
+        from bot.utils.cache import redis_client
+        return RedisTokenBucket(redis_client, key="planfix:ratelimit", rate=pf_rate_limit, capacity=pf_rate_burst)
+    return TokenBucket(rate=pf_rate_limit, capacity=pf_rate_burst)
+
+
+planfix_client = PlanfixClient(
+    base_url=pf_url_rest,
+    token=pf_token,
+    timeout=pf_timeout,
+    pool_size=pf_pool_size,
+    prefetch_pages=pf_prefetch_pages,
+    single_flight=_make_single_flight(),
+    rate_limiter=_make_rate_limiter(),
+    concurrency=AIMDLimiter(min_limit=pf_min_concurrency, max_limit=pf_pool_size, target_latency=pf_target_latency),
+    max_retries=pf_max_retries,
+    breaker_options={
+        "failure_rate": pf_breaker_failure_rate,
+        "window": pf_breaker_window,
+        "min_calls": pf_breaker_min_calls,
+        "slow_call_latency": pf_breaker_slow_call,
+        "reset_timeout": pf_breaker_reset_timeout,
+    },
+    stale_cache_size=pf_stale_cache_size
+)
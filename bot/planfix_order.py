@@ -1,17 +1,20 @@
 import asyncio
-import requests
 import sys
 import aiohttp
-from bot.config import pf_token, pf_url_rest
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+from loguru import logger
+from bot.config import pf_order_line_workers
+from bot.planfix_client import planfix_client, TASKS
 
 sys.stdout.reconfigure(encoding='utf-8')
 
 
 ####################### CREATE NEW ORDER (PLANFIX) ####################################
 
-async def planfix_create_order(description: str, order_id: int):
+async def planfix_create_order(description: str, order_id: int, check_existing: bool = False):
 
-    url = f"{pf_url_rest}/task/"
+    path = "/task/"
 
     payload = {
         "template": {
@@ -48,22 +51,66 @@ async def planfix_create_order(description: str, order_id: int):
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    async def find_created_order():
+        # Заказ мог создаться, даже если ответ не дошёл: ищем задачу по id заказа postgres
+        found = await planfix_client.post("/task/list", json={
+            "filters": [
+                {
+                    "type": 107,
+                    "field": 12124, # Курс USD - RUB (id заказа postgres)
+                    "operator": "equal",
+                    "value": order_id
+                }
+            ],
+            "fields": "id",
+            "pageSize": 1
+        }, coalesce=True)
+        tasks = found.get(TASKS) if isinstance(found, dict) else None
+        if tasks:
+            return {"result": "success", "id": tasks[0]["id"]}
+        return None
+
+    if check_existing:
+        found = await find_created_order()
+        if found:
+            logger.info(f"Заказ #{order_id} уже создан в Planfix: {found['id']}")
+            return found
+
+    data = await planfix_client.post(path, json=payload, idempotency_guard=find_created_order)
 
     return data
 
 
+####################### FIND ORDER LINE (PLANFIX) ####################################
+
+async def find_created_order_line(order_item_id: int):
+    """
+    Ищет позицию заказа, уже созданную в Planfix, по id OrderItem в postgres.
+    Позиция могла создаться, даже если ответ не дошёл: повтор не должен её дублировать.
+    """
+    found = await planfix_client.post("/task/list", json={
+        "filters": [
+            {
+                "type": 107,
+                "field": 12114, # Бронирование для проброски поля prodaction_id (id OrderItem postgres)
+                "operator": "equal",
+                "value": order_item_id
+            }
+        ],
+        "fields": "id",
+        "pageSize": 1
+    }, coalesce=True)
+    tasks = found.get(TASKS) if isinstance(found, dict) else None
+    if tasks:
+        return {"result": "success", "id": tasks[0]["id"]}
+    return None
+
+
 ####################### CREATE RE-GLUING - 1 (PLANFIX) ####################################
 
 async def planfix_create_order_re_gluing_1(order_pf_id: int, re_gluing_pf_id: int, price: int, order_item_id: int):
 
-    url = f"{pf_url_rest}/task/{order_pf_id}"
+    path = f"/task/{order_pf_id}"
 
     payload = {
         "template": {
@@ -99,13 +146,8 @@ async def planfix_create_order_re_gluing_1(order_pf_id: int, re_gluing_pf_id: in
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.post(path, json=payload,
+                                     idempotency_guard=lambda: find_created_order_line(order_item_id))
 
     return data
 
@@ -114,7 +156,7 @@ async def planfix_create_order_re_gluing_1(order_pf_id: int, re_gluing_pf_id: in
 
 async def planfix_create_order_prodaction_4(order_pf_id: int, prodaction_pf_id: int, price: int, order_item_id: int):
 
-    url = f"{pf_url_rest}/task/{order_pf_id}"
+    path = f"/task/{order_pf_id}"
 
     payload = {
         "template": {
@@ -150,13 +192,8 @@ async def planfix_create_order_prodaction_4(order_pf_id: int, prodaction_pf_id:
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.post(path, json=payload,
+                                     idempotency_guard=lambda: find_created_order_line(order_item_id))
 
     return data
 
@@ -165,7 +202,7 @@ async def planfix_create_order_prodaction_4(order_pf_id: int, prodaction_pf_id:
 
 async def planfix_create_order_spare_parts_5(order_pf_id: int, spare_parts_pf_id: int, price: int, quantity: int, order_item_id: int):
 
-    url = f"{pf_url_rest}/task/{order_pf_id}"
+    path = f"/task/{order_pf_id}"
 
     payload = {
         "template": {
@@ -207,13 +244,8 @@ async def planfix_create_order_spare_parts_5(order_pf_id: int, spare_parts_pf_id
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.post(path, json=payload,
+                                     idempotency_guard=lambda: find_created_order_line(order_item_id))
 
     return data
 
@@ -222,7 +254,7 @@ async def planfix_create_order_spare_parts_5(order_pf_id: int, spare_parts_pf_id
 
 async def planfix_create_order_back_cover_6(order_pf_id: int, back_cover_pf_id: int, price: int, order_item_id: int):
 
-    url = f"{pf_url_rest}/task/{order_pf_id}"
+    path = f"/task/{order_pf_id}"
 
     payload = {
         "template": {
@@ -266,13 +298,8 @@ async def planfix_create_order_back_cover_6(order_pf_id: int, back_cover_pf_id:
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    data = await planfix_client.post(path, json=payload,
+                                     idempotency_guard=lambda: find_created_order_line(order_item_id))
 
     return data
 
@@ -287,7 +314,7 @@ async def planfix_create_order_crash_display_7(order_pf_id: int,
                                                order_item_id: int
                                                ):
 
-    url = f"{pf_url_rest}/task/{order_pf_id}"
+    path = f"/task/{order_pf_id}"
 
     payload = {
         "template": {
@@ -337,12 +364,113 @@ async def planfix_create_order_crash_display_7(order_pf_id: int,
         ]
         }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {pf_token}"
-    }
+    data = await planfix_client.post(path, json=payload,
+                                     idempotency_guard=lambda: find_created_order_line(order_item_id))
 
-    response = requests.post(url, json=payload, headers=headers)
-    data = response.json()
+    return data
 
-    return data
\ No newline at end of file
+####################### ORDER LINES: REGISTRY AND FAN-OUT ####################################
+
+@dataclass(slots=True)
+class OrderLine:
+    """Позиция заказа для передачи в Planfix"""
+    operation_id: int
+    pf_id: int  # ID продукции/номенклатуры в Planfix (task_id из корзины)
+    price: int
+    quantity: int
+    order_item_id: int  # ID OrderItem в postgres
+    touch_or_backlight: int  # 1 — оригинальная подсветка/тач, 2 — повреждённая
+    product_name: str = ""
+
+
+OrderLineHandler = Callable[[int, OrderLine], Awaitable[Any]]
+
+# Обработчики позиций заказа по ID операции (bot.operations)
+ORDER_LINE_HANDLERS: dict[int, OrderLineHandler] = {}
+
+
+def order_line_handler(*operation_ids: int):
+    def register(handler: OrderLineHandler) -> OrderLineHandler:
+        for operation_id in operation_ids:
+            ORDER_LINE_HANDLERS[operation_id] = handler
+        return handler
+    return register
+
+
+@order_line_handler(1, 2)
+async def _create_re_gluing_line(order_pf_id: int, line: OrderLine):
+    return await planfix_create_order_re_gluing_1(
+        order_pf_id=order_pf_id, re_gluing_pf_id=line.pf_id, price=line.price, order_item_id=line.order_item_id
+    )
+
+
+@order_line_handler(4)
+async def _create_prodaction_line(order_pf_id: int, line: OrderLine):
+    return await planfix_create_order_prodaction_4(
+        order_pf_id=order_pf_id, prodaction_pf_id=line.pf_id, price=line.price, order_item_id=line.order_item_id
+    )
+
+
+@order_line_handler(5)
+async def _create_spare_parts_line(order_pf_id: int, line: OrderLine):
+    return await planfix_create_order_spare_parts_5(
+        order_pf_id=order_pf_id, spare_parts_pf_id=line.pf_id, price=line.price,
+        quantity=line.quantity, order_item_id=line.order_item_id
+    )
+
+
+@order_line_handler(6)
+async def _create_back_cover_line(order_pf_id: int, line: OrderLine):
+    return await planfix_create_order_back_cover_6(
+        order_pf_id=order_pf_id, back_cover_pf_id=line.pf_id, price=line.price, order_item_id=line.order_item_id
+    )
+
+
+@order_line_handler(7)
+async def _create_crash_display_line(order_pf_id: int, line: OrderLine):
+    return await planfix_create_order_crash_display_7(
+        order_pf_id=order_pf_id, crash_display_pf_id=line.pf_id, price=line.price, quantity=line.quantity,
+        touch_or_backlight=line.touch_or_backlight, order_item_id=line.order_item_id
+    )
+
+
+async def planfix_create_order_lines(order_pf_id: int, lines: list[OrderLine],
+                                     workers: int = pf_order_line_workers,
+                                     check_existing: bool = False) -> list[dict]:
+    """
+    Передаёт позиции заказа в Planfix параллельно, не более workers одновременно.
+    С check_existing позиция сначала ищется в Planfix (find_created_order_line) и
+    создаётся, только если её там ещё нет — для повторной передачи заказа.
+
+    Returns:
+        list[dict]: Для каждой позиции в исходном порядке {"line", "ok", "data"}; при ошибке
+        вместо "data" — "error". Ошибка одной позиции не прерывает остальные.
+        Позиции операций без шаблона в Planfix (например, 3 — разборка/сборка) пропускаются:
+        {"line", "ok": True, "skipped": True}.
+    """
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def create(line: OrderLine) -> dict:
+        handler = ORDER_LINE_HANDLERS.get(line.operation_id)
+        if handler is None:
+            logger.warning(f"Позиция {line.order_item_id} (операция {line.operation_id}) не передаётся "
+                           f"в заказ Planfix {order_pf_id}: нет обработчика")
+            return {"line": line, "ok": True, "skipped": True}
+        async with semaphore:
+            try:
+                data = await find_created_order_line(line.order_item_id) if check_existing else None
+                if data:
+                    logger.info(f"Позиция {line.order_item_id} уже есть в заказе Planfix {order_pf_id}")
+                else:
+                    data = await handler(order_pf_id, line)
+            except Exception as e:
+                logger.error(f"Ошибка добавления позиции {line.order_item_id} в заказ {order_pf_id}: {e}")
+                return {"line": line, "ok": False, "error": str(e)}
+        ok = isinstance(data, dict) and data.get("result", "success") == "success"
+        if ok:
+            logger.info(f"Позиция {line.order_item_id} добавлена в заказ Planfix {order_pf_id}: {data}")
+        else:
+            logger.error(f"Planfix не принял позицию {line.order_item_id} заказа {order_pf_id}: {data}")
+        return {"line": line, "ok": ok, "data": data} if ok else {"line": line, "ok": False, "error": str(data)}
+
+    return list(await asyncio.gather(*(create(line) for line in lines)))
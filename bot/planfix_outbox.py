@@ -0,0 +1,351 @@
+import asyncio
+from dataclasses import asdict
+from typing import Any, Awaitable, Callable, Optional
+from loguru import logger
+
+from bot.config import (bot, pf_outbox_workers, pf_outbox_batch_size, pf_outbox_poll_interval,
+                        pf_outbox_max_attempts, pf_outbox_lease, pf_outbox_retry_base, pf_outbox_retry_cap,
+                        pf_comment_window, pf_comment_max_messages, pf_comment_max_chars)
+from bot.operations import OPERATION_NAMES
+from bot.planfix import add_incoming_comment_to_chat, add_outgoing_comment_to_chat, attach_files_to_chat
+from bot import planfix_order as pf_order
+from bot.dao.base import after_commit
+from bot.stocks.dao import OutboxDAO, OrderDAO
+from bot.users.dao import UserDAO
+from bot.utils.coalescing_buffer import CoalescingBuffer
+from bot.utils.rate_limit import backoff_delay
+from bot.utils.telegram_files import transfer_files_to_planfix
+
+# Виды операций в очереди
+INCOMING_COMMENT = "incoming_comment"
+OUTGOING_COMMENT = "outgoing_comment"
+CHAT_PHOTOS = "chat_photos"
+ORDER = "order"
+
+
+class OutboxError(Exception):
+    """Операция не выполнена и должна быть повторена."""
+
+
+class OutboxPermanentError(OutboxError):
+    """Операция не может быть выполнена: повтор не поможет, сразу в dead letters."""
+
+
+class OutboxHandler:
+    def __init__(self, run: Callable[[dict], Awaitable[Any]],
+                 on_dead: Optional[Callable[[dict, str], Awaitable[Any]]] = None):
+        self.run = run
+        self.on_dead = on_dead
+
+
+# Обработчики операций очереди по виду операции.
+# Обработчик может менять payload: при повторе он получит сохранённый прогресс.
+# payload["attempt"] — номер текущей попытки (с 1).
+OUTBOX_HANDLERS: dict[str, OutboxHandler] = {}
+
+
+def outbox_handler(kind: str, on_dead: Optional[Callable[[dict, str], Awaitable[Any]]] = None):
+    def register(run: Callable[[dict], Awaitable[Any]]):
+        OUTBOX_HANDLERS[kind] = OutboxHandler(run, on_dead)
+        return run
+    return register
+
+
+def chat_key(chat_pf_id: Any) -> str:
+    return f"chat:{chat_pf_id}"
+
+
+def _ensure_success(data: Any, what: str):
+    if not isinstance(data, dict) or data.get("result", "success") != "success":
+        raise OutboxError(f"{what}: {data}")
+
+
+def _is_retry(payload: dict) -> bool:
+    """Была ли уже попытка: её запись в Planfix могла пройти, даже если ответ не дошёл."""
+    return payload.get("attempt", 1) > 1
+
+
+####################### HANDLERS ####################################
+
+@outbox_handler(INCOMING_COMMENT)
+async def _add_incoming_comment(payload: dict):
+    data = await add_incoming_comment_to_chat(
+        chat_pf_id=payload["chat_pf_id"], contact_pf_id=payload["contact_pf_id"], comment=payload["comment"],
+        check_existing=_is_retry(payload)
+    )
+    _ensure_success(data, "Planfix не принял входящий комментарий")
+
+
+@outbox_handler(OUTGOING_COMMENT)
+async def _add_outgoing_comment(payload: dict):
+    data = await add_outgoing_comment_to_chat(chat_pf_id=payload["chat_pf_id"], comment=payload["comment"],
+                                              check_existing=_is_retry(payload))
+    _ensure_success(data, "Planfix не принял исходящий комментарий")
+
+
+@outbox_handler(CHAT_PHOTOS)
+async def _attach_chat_photos(payload: dict):
+    # Уже загруженные в Planfix фото при повторе не загружаются заново
+    pending = payload.get("pending_file_ids", payload["file_ids"])
+    if pending:
+        uploaded = await transfer_files_to_planfix(bot, pending)
+        payload["uploaded_pf_ids"] = payload.get("uploaded_pf_ids", []) + [pf_id for pf_id in uploaded if pf_id]
+        payload["pending_file_ids"] = [file_id for file_id, pf_id in zip(pending, uploaded) if not pf_id]
+        if payload["pending_file_ids"]:
+            raise OutboxError(f"Не загружено {len(payload['pending_file_ids'])} фото из Telegram в Planfix")
+    pf_ids = payload.get("uploaded_pf_ids", [])
+    if not await attach_files_to_chat(payload["chat_pf_id"], pf_ids, description=f"Добавлено {len(pf_ids)} фото битика"):
+        raise OutboxError(f"Не удалось прикрепить фото к чату {payload['chat_pf_id']}")
+
+
+def _order_summary(payload: dict) -> str:
+    done = set(payload.get("done_item_ids", []))
+    skipped = set(payload.get("skipped_item_ids", []))
+
+    def mark(order_item_id: int) -> str:
+        return "✅" if order_item_id in done else "➖" if order_item_id in skipped else "❌"
+
+    lines = [
+        f"{mark(line['order_item_id'])} "
+        f"{OPERATION_NAMES.get(line['operation_id'], 'Неизвестная операция')}: {line['product_name']}"
+        for line in payload["lines"]
+    ]
+    return (
+        f"Заказ в Планфиксе создан: {payload.get('order_pf_id')}\n"
+        f"Позиции переданы: {len(done)} из {len(payload['lines']) - len(skipped)}\n"
+        + "\n".join(lines)
+    )
+
+
+async def _notify_order(payload: dict, text: str):
+    """Сообщает пользователю итог передачи заказа и дублирует его в чат Planfix."""
+    telegram_id = payload.get("telegram_id")
+    if not telegram_id:
+        return
+    try:
+        await bot.send_message(chat_id=telegram_id, text=text)
+    except Exception as e:
+        logger.error(f"Не удалось отправить итог заказа #{payload['order_id']} пользователю {telegram_id}: {e}")
+    user_data = await UserDAO.get_profile(telegram_id)
+    if user_data and user_data.chat_pf_id:
+        await enqueue_outgoing_comment(user_data.chat_pf_id, text)
+
+
+async def _order_dead(payload: dict, error: str):
+    if payload.get("order_pf_id"):
+        text = _order_summary(payload)
+    else:
+        text = f"Заказ #{payload['order_id']} сохранён, но не передан в Планфикс. Менеджер свяжется с вами."
+    await _notify_order(payload, text)
+
+
+@outbox_handler(ORDER, on_dead=_order_dead)
+async def _create_order(payload: dict):
+    order_id = payload["order_id"]
+    if not payload.get("order_pf_id"):
+        # Предыдущая попытка могла создать заказ, не успев сохранить order_pf_id
+        data_order = await pf_order.planfix_create_order(description=payload["description"], order_id=order_id,
+                                                         check_existing=_is_retry(payload))
+        _ensure_success(data_order, f"Planfix не создал заказ #{order_id}")
+        payload["order_pf_id"] = data_order["id"]
+        await OrderDAO.update({"id": order_id}, order_pf_id=payload["order_pf_id"])
+        logger.info(f"Заказ #{order_id} обновлён с order_pf_id={payload['order_pf_id']}")
+
+    done = payload.setdefault("done_item_ids", [])
+    skipped = payload.setdefault("skipped_item_ids", [])
+    lines = [pf_order.OrderLine(**line) for line in payload["lines"]
+             if line["order_item_id"] not in done and line["order_item_id"] not in skipped]
+    results = await pf_order.planfix_create_order_lines(payload["order_pf_id"], lines,
+                                                        check_existing=_is_retry(payload))
+    skipped.extend(result["line"].order_item_id for result in results if result.get("skipped"))
+    done.extend(result["line"].order_item_id for result in results if result["ok"] and not result.get("skipped"))
+    failed = [result for result in results if not result["ok"]]
+    if failed:
+        raise OutboxError(f"Заказ #{order_id}: не переданы позиции {[result['line'].order_item_id for result in failed]}")
+    await _notify_order(payload, _order_summary(payload))
+
+
+####################### ENQUEUE ####################################
+
+async def _enqueue(kind: str, payload: dict, ordering_key: Optional[str] = None, session=None) -> Optional[int]:
+    try:
+        record_id = await OutboxDAO.enqueue(kind, payload, ordering_key=ordering_key, session=session)
+    except Exception as e:
+        logger.error(f"Не удалось поставить операцию {kind} в очередь Planfix: {e}")
+        if session is not None:
+            raise
+        return None
+    if session is not None:
+        # Запись станет видна воркерам только после commit единицы работы
+        after_commit(session, planfix_outbox.wake)
+    else:
+        planfix_outbox.wake()
+    return record_id
+
+
+async def enqueue_incoming_comment(chat_pf_id: int, contact_pf_id: int, comment: str) -> Optional[int]:
+    # Накопленные ответы бота должны попасть в чат раньше следующего сообщения пользователя
+    await outgoing_comments.flush(chat_pf_id)
+    return await _enqueue(INCOMING_COMMENT, {"chat_pf_id": chat_pf_id, "contact_pf_id": contact_pf_id,
+                                             "comment": comment}, ordering_key=chat_key(chat_pf_id))
+
+
+async def _enqueue_outgoing_now(chat_pf_id: int, comment: str) -> Optional[int]:
+    record_id = await _enqueue(OUTGOING_COMMENT, {"chat_pf_id": chat_pf_id, "comment": comment},
+                               ordering_key=chat_key(chat_pf_id))
+    if record_id is None:
+        logger.error(f"Исходящий комментарий для чата {chat_pf_id} потерян: {comment[:100]}")
+    return record_id
+
+
+# Исходящие комментарии одного чата, появившиеся в пределах окна, уходят в Planfix одним комментарием
+outgoing_comments = CoalescingBuffer(
+    _enqueue_outgoing_now,
+    window=pf_comment_window,
+    max_items=pf_comment_max_messages,
+    max_chars=pf_comment_max_chars,
+)
+
+
+async def enqueue_outgoing_comment(chat_pf_id: int, comment: str) -> bool:
+    """Добавляет исходящий комментарий в буфер чата; в очередь он попадёт при сбросе буфера."""
+    try:
+        await outgoing_comments.add(chat_pf_id, comment)
+    except Exception as e:
+        logger.error(f"Не удалось поставить исходящий комментарий для чата {chat_pf_id} в очередь: {e}")
+        return False
+    return True
+
+
+async def enqueue_chat_photos(chat_pf_id: int, telegram_file_ids: list[str]) -> Optional[int]:
+    return await _enqueue(CHAT_PHOTOS, {"chat_pf_id": chat_pf_id, "file_ids": telegram_file_ids},
+                          ordering_key=chat_key(chat_pf_id))
+
+
+async def enqueue_order(order_id: int, description: str, lines: list["pf_order.OrderLine"],
+                        telegram_id: Optional[int] = None, session=None) -> Optional[int]:
+    payload = {"order_id": order_id, "description": description, "telegram_id": telegram_id,
+               "lines": [asdict(line) for line in lines]}
+    return await _enqueue(ORDER, payload, ordering_key=f"order:{order_id}", session=session)
+
+
+####################### WORKERS ####################################
+
+class PlanfixOutboxWorkers:
+    """
+    Фоновые воркеры, выполняющие операции записи в Planfix из очереди planfix_outbox.
+
+    Неудачная операция повторяется с экспоненциальной задержкой; после max_attempts
+    попыток запись остаётся в таблице со статусом dead (dead letter) до ручного повтора.
+    Между репликами записи делятся через SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+
+    def __init__(self, workers: int, batch_size: int, poll_interval: float, max_attempts: int,
+                 lease: float, retry_base: float, retry_cap: float):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.processed = 0
+        self.retried = 0
+        self.dead = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def wake(self):
+        """Будит воркеры после постановки операции в очередь, не дожидаясь опроса."""
+        self._wakeup.set()
+
+    async def process(self, record):
+        handler = OUTBOX_HANDLERS.get(record.kind)
+        payload = dict(record.payload)
+        payload["attempt"] = record.attempts
+        try:
+            if handler is None:
+                raise OutboxPermanentError(f"Нет обработчика для операции {record.kind}")
+            await handler.run(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, OutboxPermanentError) or record.attempts >= self.max_attempts:
+                self.dead += 1
+                logger.error(f"Операция {record.kind} #{record.id} перенесена в dead letters "
+                             f"после {record.attempts} попыток: {error}")
+                await OutboxDAO.bury(record.id, error, payload=payload)
+                if handler is not None and handler.on_dead is not None:
+                    try:
+                        await handler.on_dead(payload, error)
+                    except Exception as hook_error:
+                        logger.error(f"Ошибка обработки dead letter #{record.id}: {hook_error}")
+                return
+            delay = max(1.0, backoff_delay(record.attempts - 1, base=self.retry_base, cap=self.retry_cap))
+            self.retried += 1
+            logger.warning(f"Операция {record.kind} #{record.id} не выполнена (попытка {record.attempts}), "
+                           f"повтор через {delay:.1f} с: {error}")
+            await OutboxDAO.retry(record.id, error, delay, payload=payload)
+            return
+        self.processed += 1
+        await OutboxDAO.complete(record.id)
+
+    async def _worker(self, number: int):
+        while True:
+            try:
+                records = await OutboxDAO.claim(self.batch_size, self.lease)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Воркер очереди Planfix {number}: не удалось прочитать очередь: {e}")
+                records = []
+            if not records:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for record in records:
+                try:
+                    await self.process(record)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Запись вернётся в очередь по истечении аренды
+                    logger.error(f"Воркер очереди Planfix {number}: ошибка обработки записи #{record.id}: {e}")
+
+    def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        self._tasks = [asyncio.create_task(self._worker(number)) for number in range(self.workers)]
+        logger.info(f"Очередь записи в Planfix: запущено воркеров — {self.workers}.")
+
+    async def stop(self):
+        await outgoing_comments.flush_all()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def stats(self) -> dict:
+        return {
+            "queue": await OutboxDAO.depth(),
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead": self.dead,
+            "outgoing_comments": outgoing_comments.stats(),
+        }
+
+
+planfix_outbox = PlanfixOutboxWorkers(
+    workers=pf_outbox_workers,
+    batch_size=pf_outbox_batch_size,
+    poll_interval=pf_outbox_poll_interval,
+    max_attempts=pf_outbox_max_attempts,
+    lease=pf_outbox_lease,
+    retry_base=pf_outbox_retry_base,
+    retry_cap=pf_outbox_retry_cap,
+)
@@ -0,0 +1,193 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, NamedTuple, Optional
+
+# Ключ списка задач в ответах Planfix (дублирует bot.planfix_client.TASKS, чтобы схема не зависела от клиента)
+TASKS = "tasks"
+
+
+####################### CONVERTERS ####################################
+
+def value(field_data: dict) -> Any:
+    """Значение поля как есть."""
+    return field_data.get("value")
+
+
+def ref_value(field_data: dict) -> Any:
+    """Название из поля-ссылки ({"id": ..., "value": ...}) или само значение."""
+    raw = field_data.get("value")
+    return raw.get("value") if isinstance(raw, dict) else raw
+
+
+def ref_id(field_data: dict) -> Any:
+    """Идентификатор из поля-ссылки."""
+    raw = field_data.get("value")
+    return raw.get("id") if isinstance(raw, dict) else None
+
+
+def number(field_data: dict) -> Optional[int]:
+    """Целое число из числового или строкового значения."""
+    try:
+        return int(float(field_data.get("value")))
+    except (TypeError, ValueError):
+        return None
+
+
+def string_value(field_data: dict) -> Optional[str]:
+    """Отформатированное Planfix значение (stringValue) или строка из value."""
+    raw = field_data.get("value")
+    return field_data.get("stringValue") or (str(raw) if raw is not None else None)
+
+
+####################### SCHEMA ####################################
+
+class Field(NamedTuple):
+    attr: str  # Атрибут записи
+    id: Optional[int] = None  # ID поля Planfix
+    name: Optional[str] = None  # Название поля Planfix (для полей без постоянного ID)
+    convert: Callable[[dict], Any] = value
+
+
+class Schema:
+    """
+    Декларативное описание полей customFieldData и собранный по нему декодер.
+
+    Поля сопоставляются по ID, а если ID не задан или не совпал — по названию.
+    decode проходит customFieldData один раз и собирает запись record_type;
+    пустые значения пропускаются, при повторе поля побеждает последнее значение.
+    """
+
+    def __init__(self, record_type: type, *fields: Field, id_key: str = "id"):
+        self.record_type = record_type
+        self.id_key = id_key
+        self._by_id: dict[int, list[Field]] = {}
+        self._by_name: dict[str, list[Field]] = {}
+        for field in fields:
+            if field.id is not None:
+                self._by_id.setdefault(field.id, []).append(field)
+            if field.name is not None:
+                self._by_name.setdefault(field.name, []).append(field)
+
+    def decode(self, item: dict):
+        values = {}
+        by_id, by_name = self._by_id, self._by_name
+        for field_data in item.get("customFieldData") or ():
+            meta = field_data.get("field") or {}
+            fields = by_id.get(meta.get("id")) or by_name.get(meta.get("name"))
+            if not fields:
+                continue
+            for field in fields:
+                converted = field.convert(field_data)
+                if converted is not None:
+                    values[field.attr] = converted
+        return self.record_type(item.get(self.id_key), **values)
+
+    def decode_all(self, data: Any, items_key: str = TASKS) -> list:
+        """Записи из ответа списочного метода Planfix; для ответа с ошибкой — пустой список."""
+        if not isinstance(data, dict):
+            return []
+        return [self.decode(item) for item in data.get(items_key) or ()]
+
+    def decode_one(self, data: Any, item_key: str = "task"):
+        """Запись из ответа на запрос одной задачи/записи или None."""
+        if not isinstance(data, dict) or not isinstance(data.get(item_key), dict):
+            return None
+        return self.decode(data[item_key])
+
+
+def first(records: Iterable, attr: str) -> Any:
+    """Первое непустое значение атрибута среди записей."""
+    for record in records:
+        found = getattr(record, attr)
+        if found is not None:
+            return found
+    return None
+
+
+####################### RECORDS ####################################
+
+@dataclass(slots=True)
+class StockBalanceRecord:
+    """Задача фильтра 104384 (All stock balance)"""
+    id: int
+    stock_balance: Optional[int] = None
+    product_name: Optional[str] = None
+    device: Optional[str] = None
+    brand: Optional[str] = None
+    price: Optional[int] = None
+
+
+@dataclass(slots=True)
+class ProductionRecord:
+    """Задача готовой продукции (фильтр 104400, /task/{id})"""
+    id: int
+    model: Optional[str] = None
+    price: Optional[int] = None
+    description: Optional[str] = None
+
+
+@dataclass(slots=True)
+class SparePartRecord:
+    """Задача фильтра 104398 (All stock balance: spare parts)"""
+    id: int
+    price: Optional[int] = None
+    name: Optional[str] = None
+    part_id: Optional[int] = None
+    balance: Optional[int] = None
+
+
+@dataclass(slots=True)
+class PriceBalanceRecord:
+    """Цена и приход задачи остатков в виде строк Planfix"""
+    id: int
+    price: Optional[str] = None
+    balance: Optional[str] = None
+
+
+@dataclass(slots=True)
+class PriceListRecord:
+    """Запись справочника 1430 «Прайс-лист»"""
+    key: int
+    assembly_price: Optional[int] = None
+    re_gluing_price: Optional[int] = None
+    touch_price: Optional[int] = None
+    back_cover_price: Optional[int] = None
+
+
+STOCK_BALANCE = Schema(
+    StockBalanceRecord,
+    Field("stock_balance", 12116, convert=number),
+    Field("product_name", 5542, convert=ref_value),
+    Field("device", 6640, convert=ref_value),
+    Field("brand", 6282, convert=ref_value),
+    Field("price", 12140, convert=number),
+)
+
+PRODUCTION = Schema(
+    ProductionRecord,
+    Field("model", 5556, "Модель", convert=ref_value),
+    Field("price", 12126, "Price", convert=number),
+    Field("description", 5498, "Комментарии"),
+)
+
+SPARE_PARTS = Schema(
+    SparePartRecord,
+    Field("price", 5718, convert=number),  # Цена закупки, RUB
+    Field("name", 5512, convert=ref_value),  # Запчасть
+    Field("part_id", 5512, convert=ref_id),
+    Field("balance", 5722, convert=number),  # Св. остаток
+)
+
+PRICE_BALANCE = Schema(
+    PriceBalanceRecord,
+    Field("price", name="Цена, RUB", convert=string_value),
+    Field("balance", name="Приход", convert=string_value),
+)
+
+PRICE_LIST = Schema(
+    PriceListRecord,
+    Field("assembly_price", 3780, convert=number),  # Цена разборки/сборки
+    Field("re_gluing_price", 3782, convert=number),  # Цена переклейки
+    Field("touch_price", 3784, convert=number),  # Цена замены подсветки/тача
+    Field("back_cover_price", 3792, convert=number),  # Цена замены крышки
+    id_key="key",
+)
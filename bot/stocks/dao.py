@@ -1,12 +1,18 @@
-from typing import List, Tuple  # Добавляем List и Tuple
+from datetime import datetime, timedelta
+from typing import Any, List, Optional, Tuple  # Добавляем List и Tuple
 from sqlalchemy.sql import func  # Добавляем func для SQLAlchemy
-from bot.dao.base import BaseDAO
+from bot.dao.base import BaseDAO, session_scope
+from bot.utils.cursor import encode_cursor, decode_cursor
 from bot.stocks.models_cart import Cart, Model
 from bot.stocks.models_order import Order, OrderItem, OrderStatusHistory, OrderStatus
+from bot.stocks.models_stock import StockTask, SyncState
+from bot.stocks.models_outbox import PlanfixOutbox, OUTBOX_PENDING, OUTBOX_PROCESSING, OUTBOX_DEAD
 from bot.database import async_session_maker
 from sqlalchemy.future import select
-from sqlalchemy import update as sqlalchemy_update
-from sqlalchemy.orm import selectinload
+from sqlalchemy import update as sqlalchemy_update, delete as sqlalchemy_delete, exists, insert, literal, true, cast, BigInteger, Float, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload, joinedload, aliased
 from sqlalchemy.exc import SQLAlchemyError
 from loguru import logger
 
@@ -19,21 +25,93 @@ class OrderDAO(BaseDAO):
     model = Order
 
     @classmethod
-    async def find_all(cls, **filter_by):
+    async def find_all(cls, session: Optional[AsyncSession] = None, **filter_by):
         logger.info(f"Поиск всех заказов пользователя по фильтру: {filter_by}")
-        async with async_session_maker() as session:
+        async with session_scope(session) as session:
             try:
-                # Используем selectinload для предзагрузки связанных товаров
+                # Заказы вместе с товарами одним запросом; текущий статус хранится в orders.status
                 query = select(cls.model).options(
-                    selectinload(cls.model.items)).filter_by(**filter_by)
+                    joinedload(cls.model.items)).filter_by(**filter_by).order_by(cls.model.id)
                 result = await session.execute(query)
-                records = result.scalars().all()
+                records = result.unique().scalars().all()
                 logger.info(f"Найдено {len(records)} заказов.")
                 return records
             except SQLAlchemyError as e:
                 logger.error(f"Ошибка при поиске заказов: {e}")
                 raise
 
+    # Поля позиции корзины, переносимые в позицию заказа
+    CART_ITEM_FIELDS = ("product_id", "product_name", "quantity", "price", "task_id", "operation",
+                        "touch_or_backlight", "photo_file_ids", "assembly_required")
+
+    @classmethod
+    async def create_from_cart(cls, telegram_id: int, session: Optional[AsyncSession] = None) -> Optional[dict]:
+        """
+        Создаёт заказ из корзины пользователя одним запросом: сумма считается в SQL,
+        заказ, позиции и начальный статус вставляются цепочкой INSERT … RETURNING в CTE.
+
+        Возвращает {"order_id", "total_amount", "status", "items"}, где items — строки позиций
+        (id и поля корзины) в порядке корзины, или None, если корзина пуста.
+        """
+        logger.info(f"Создание заказа из корзины пользователя {telegram_id}")
+        status = OrderStatus.PENDING.value
+        cart = (
+            select(Cart.id.label("cart_id"), *[getattr(Cart, field) for field in cls.CART_ITEM_FIELDS])
+            .where(Cart.telegram_id == telegram_id)
+            .cte("cart")
+        )
+        new_order = (
+            insert(Order)
+            .from_select(
+                ["telegram_id", "status", "total_amount"],
+                select(cast(literal(telegram_id), BigInteger), literal(status),
+                       func.coalesce(func.sum(cart.c.price * cart.c.quantity), 0))
+                .select_from(cart)
+                .having(func.count() > 0)
+            )
+            .returning(Order.id, Order.total_amount)
+            .cte("new_order")
+        )
+        items = (
+            insert(OrderItem)
+            .from_select(
+                ["order_id", *cls.CART_ITEM_FIELDS],
+                select(new_order.c.id, *[cart.c[field] for field in cls.CART_ITEM_FIELDS])
+                .select_from(cart.join(new_order, true()))
+                .order_by(cart.c.cart_id)
+            )
+            .returning(OrderItem.id, *[getattr(OrderItem, field) for field in cls.CART_ITEM_FIELDS])
+            .cte("items")
+        )
+        history = (
+            insert(OrderStatusHistory)
+            .from_select(
+                ["order_id", "status", "timestamp", "comment"],
+                select(new_order.c.id, literal(status), func.timezone("UTC", func.now()), literal("Order created"))
+            )
+            .returning(OrderStatusHistory.status)
+            .cte("history")
+        )
+        query = (
+            select(new_order.c.id.label("order_id"), new_order.c.total_amount, history.c.status.label("order_status"),
+                   items.c.id, *[items.c[field] for field in cls.CART_ITEM_FIELDS])
+            .select_from(new_order.join(history, true()).join(items, true()))
+            .order_by(items.c.id)
+        )
+        try:
+            async with session_scope(session) as session:
+                rows = (await session.execute(query)).all()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при создании заказа из корзины пользователя {telegram_id}: {e}")
+            raise
+        if not rows:
+            logger.info(f"Корзина пользователя {telegram_id} пуста, заказ не создан")
+            return None
+        order = {"order_id": rows[0].order_id, "total_amount": rows[0].total_amount,
+                 "status": rows[0].order_status, "items": rows}
+        logger.info(f"Создан заказ #{order['order_id']} из {len(rows)} позиций на сумму {order['total_amount']}")
+        return order
+
 
 class OrderItemDAO(BaseDAO):
     model = OrderItem
@@ -43,22 +121,29 @@ class OrderStatusHistoryDAO(BaseDAO):
     model = OrderStatusHistory
 
     @classmethod
-    async def add(cls, **values):
+    async def add(cls, session: Optional[AsyncSession] = None, **values):
+        """
+        Добавляет запись в историю статусов и в той же транзакции переносит статус
+        в orders.status, откуда его читают списки заказов.
+        """
         logger.info(f"Добавление новой записи в {cls.model.__name__}: {values}")
-        async with async_session_maker() as session:
-            async with session.begin():
-                new_instance = cls.model(**values)
-                session.add(new_instance)
-                await session.flush()  # Убедимся, что status доступен после flush
-                instance_status = new_instance.status  # Теперь status — это строка
-                await session.commit()
-                logger.info(f"Запись {cls.model.__name__} успешно добавлена.")
-                return {"status": instance_status}
+        async with session_scope(session) as session:
+            new_instance = cls.model(**values)
+            session.add(new_instance)
+            await session.flush()  # Убедимся, что status доступен после flush
+            instance_status = new_instance.status  # Теперь status — это строка
+            await session.execute(
+                sqlalchemy_update(Order)
+                .where(Order.id == new_instance.order_id)
+                .values(status=instance_status)
+            )
+        logger.info(f"Запись {cls.model.__name__} успешно добавлена.")
+        return {"status": instance_status}
 
     @classmethod
-    async def find_all(cls, **filter_by):
+    async def find_all(cls, session: Optional[AsyncSession] = None, **filter_by):
         logger.info(f"Поиск всех записей {cls.model.__name__} по фильтрам: {filter_by}")
-        async with async_session_maker() as session:
+        async with session_scope(session) as session:
             try:
                 query = select(cls.model).filter_by(**filter_by)
                 result = await session.execute(query)
@@ -74,35 +159,228 @@ class ModelDAO(BaseDAO):
     model = Model
 
     @classmethod
-    async def search_models(cls, query: str = "", offset: int = 0, limit: int = 50) -> List[Tuple[int, str, str, str]]:
+    async def search_models(cls, query: str = "", cursor: Optional[str] = None,
+                            limit: int = 50) -> Tuple[List[Tuple[int, str, str, str]], Optional[str]]:
         """
         Полнотекстовый поиск моделей по model_name, model_engineer и model_id.
         Если query пустой, возвращает все модели постранично.
+
+        Пагинация keyset: cursor хранит (ранг, id) или id последней модели предыдущей страницы.
+        Возвращает модели и курсор следующей страницы (None на последней).
         """
-        logger.info(f"Полнотекстовый поиск моделей по запросу: '{query}', offset: {offset}, limit: {limit}")
+        logger.info(f"Полнотекстовый поиск моделей по запросу: '{query}', курсор: {cursor}, limit: {limit}")
+        after = decode_cursor(cursor)
+        columns = (Model.id, Model.model_name, Model.model_engineer, Model.model_id)
         async with async_session_maker() as session:
             try:
                 if query:
                     # Полнотекстовый поиск
+                    ts_query = func.plainto_tsquery("english", query)
+                    rank = func.ts_rank(Model.search_vector, ts_query)
                     stmt = (
-                        select(Model.id, Model.model_name, Model.model_engineer, Model.model_id)
-                        .where(Model.search_vector.op("@@")(func.plainto_tsquery("english", query)))
-                        .order_by(func.ts_rank(Model.search_vector, func.plainto_tsquery("english", query)).desc())
-                        .offset(offset)
-                        .limit(limit)
+                        select(*columns, rank.label("rank"))
+                        .where(Model.search_vector.op("@@")(ts_query))
+                        .order_by(rank.desc(), Model.id)
                     )
+                    if after and len(after) == 2:
+                        after_rank = literal(after[0], Float)
+                        stmt = stmt.where(or_(rank < after_rank, and_(rank == after_rank, Model.id > after[1])))
                 else:
                     # Подгрузка всех моделей постранично
-                    stmt = (
-                        select(Model.id, Model.model_name, Model.model_engineer, Model.model_id)
-                        .order_by(Model.id)
-                        .offset(offset)
-                        .limit(limit)
-                    )
-                result = await session.execute(stmt)
+                    stmt = select(*columns).order_by(Model.id)
+                    if after:
+                        stmt = stmt.where(Model.id > after[0])
+                # Лишняя запись показывает, есть ли следующая страница
+                result = await session.execute(stmt.limit(limit + 1))
                 records = result.all()
+                next_cursor = None
+                if len(records) > limit:
+                    last = records[limit - 1]
+                    next_cursor = encode_cursor(last.rank, last.id) if query else encode_cursor(last.id)
+                records = records[:limit]
                 logger.info(f"Найдено {len(records)} моделей по запросу: '{query}'")
-                return [(r.id, r.model_name or "", r.model_engineer or "", r.model_id or "") for r in records]
+                return [(r.id, r.model_name or "", r.model_engineer or "", r.model_id or "") for r in records], next_cursor
             except SQLAlchemyError as e:
                 logger.error(f"Ошибка при поиске моделей: {e}")
-                raise
\ No newline at end of file
+                raise
+
+
+class StockTaskDAO(BaseDAO):
+    model = StockTask
+
+    @classmethod
+    async def find_by_filter(cls, filter_id: str, model_pf_id: str | None = None, operation: str | None = None):
+        logger.info(f"Поиск задач зеркала: filter_id={filter_id}, model_pf_id={model_pf_id}, operation={operation}")
+        async with async_session_maker() as session:
+            try:
+                query = select(cls.model).where(cls.model.filter_id == filter_id)
+                if model_pf_id is not None:
+                    query = query.where(cls.model.model_pf_id == str(model_pf_id))
+                if operation is not None:
+                    query = query.where(cls.model.operation == str(operation))
+                result = await session.execute(query.order_by(cls.model.task_pf_id))
+                records = result.scalars().all()
+                logger.info(f"Найдено {len(records)} задач в зеркале.")
+                return records
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при чтении зеркала остатков: {e}")
+                raise
+
+    @classmethod
+    async def upsert_tasks(cls, rows: List[dict]) -> int:
+        """
+        Вставляет или обновляет задачи зеркала по ключу (filter_id, task_pf_id).
+        """
+        if not rows:
+            return 0
+        logger.info(f"Upsert {len(rows)} задач в зеркало остатков")
+        return len(await cls.upsert_many(rows, ['filter_id', 'task_pf_id']))
+
+    @classmethod
+    async def delete_missing(cls, filter_id: str, keep_task_ids: List[int]) -> int:
+        """
+        Удаляет из зеркала задачи фильтра, которых больше нет в Planfix.
+        """
+        async with async_session_maker() as session:
+            async with session.begin():
+                query = sqlalchemy_delete(cls.model).where(cls.model.filter_id == filter_id)
+                if keep_task_ids:
+                    query = query.where(cls.model.task_pf_id.not_in(keep_task_ids))
+                result = await session.execute(query)
+                logger.info(f"Удалено {result.rowcount} устаревших задач зеркала (filter_id={filter_id}).")
+                return result.rowcount
+
+
+class SyncStateDAO(BaseDAO):
+    model = SyncState
+
+    @classmethod
+    async def save_state(cls, name: str, **values):
+        async with async_session_maker() as session:
+            async with session.begin():
+                stmt = pg_insert(cls.model).values(name=name, **values)
+                stmt = stmt.on_conflict_do_update(index_elements=['name'], set_=values)
+                await session.execute(stmt)
+
+
+class OutboxDAO(BaseDAO):
+    model = PlanfixOutbox
+
+    @classmethod
+    async def enqueue(cls, kind: str, payload: dict, ordering_key: Optional[str] = None,
+                      session: Optional[AsyncSession] = None) -> Optional[int]:
+        """
+        Ставит операцию записи в очередь.
+        С переданной session запись добавляется в транзакцию вызывающего кода (без commit),
+        так что операция попадёт в очередь только вместе с его изменениями.
+        """
+        instance = cls.model(kind=kind, payload=payload, ordering_key=ordering_key,
+                             status=OUTBOX_PENDING, attempts=0, available_at=datetime.utcnow())
+        async with session_scope(session) as session:
+            session.add(instance)
+            await session.flush()
+            record_id = instance.id
+        logger.debug(f"Операция {kind} поставлена в очередь Planfix: id={record_id}, key={ordering_key}")
+        return record_id
+
+    @classmethod
+    async def claim(cls, limit: int, lease: float) -> List[PlanfixOutbox]:
+        """
+        Забирает до limit готовых к выполнению записей и арендует их на lease секунд.
+
+        Запись выдаётся, только если перед ней нет незавершённых записей с тем же ordering_key,
+        поэтому операции одного чата выполняются строго по порядку, в том числе при повторах.
+        Записи с истёкшей арендой (воркер упал) возвращаются в очередь.
+        """
+        now = datetime.utcnow()
+        model = cls.model
+        earlier = aliased(model)
+        async with async_session_maker() as session:
+            async with session.begin():
+                await session.execute(
+                    sqlalchemy_update(model)
+                    .where(model.status == OUTBOX_PROCESSING, model.locked_until < now)
+                    .values(status=OUTBOX_PENDING)
+                )
+                ready = (
+                    select(model.id)
+                    .where(
+                        model.status == OUTBOX_PENDING,
+                        model.available_at <= now,
+                        ~exists().where(
+                            earlier.ordering_key == model.ordering_key,
+                            earlier.id < model.id,
+                            earlier.status.in_((OUTBOX_PENDING, OUTBOX_PROCESSING)),
+                        ),
+                    )
+                    .order_by(model.id)
+                    .limit(limit)
+                    .with_for_update(skip_locked=True)
+                )
+                result = await session.execute(
+                    sqlalchemy_update(model)
+                    .where(model.id.in_(ready.scalar_subquery()))
+                    .values(status=OUTBOX_PROCESSING, attempts=model.attempts + 1,
+                            locked_until=now + timedelta(seconds=lease))
+                    .returning(model)
+                    .execution_options(synchronize_session=False)
+                )
+                records = result.scalars().all()
+                # Отсоединяем записи до commit, чтобы их атрибуты не истекли
+                session.expunge_all()
+        return sorted(records, key=lambda record: record.id)
+
+    @classmethod
+    async def complete(cls, record_id: int):
+        """Операция выполнена: запись удаляется из очереди."""
+        async with async_session_maker() as session:
+            async with session.begin():
+                await session.execute(sqlalchemy_delete(cls.model).where(cls.model.id == record_id))
+
+    @classmethod
+    async def retry(cls, record_id: int, error: str, delay: float, payload: Optional[dict] = None):
+        """Возвращает запись в очередь через delay секунд, сохраняя прогресс в payload."""
+        values = {"status": OUTBOX_PENDING, "locked_until": None, "last_error": error,
+                  "available_at": datetime.utcnow() + timedelta(seconds=delay)}
+        if payload is not None:
+            values["payload"] = payload
+        await cls.update({"id": record_id}, **values)
+
+    @classmethod
+    async def bury(cls, record_id: int, error: str, payload: Optional[dict] = None):
+        """Переносит запись в dead letters: воркеры её больше не берут."""
+        values = {"status": OUTBOX_DEAD, "locked_until": None, "last_error": error}
+        if payload is not None:
+            values["payload"] = payload
+        await cls.update({"id": record_id}, **values)
+
+    @classmethod
+    async def requeue_dead(cls, record_id: Optional[int] = None) -> int:
+        """Возвращает dead letters (одну или все) в очередь с обнулённым счётчиком попыток."""
+        query = sqlalchemy_update(cls.model).where(cls.model.status == OUTBOX_DEAD)
+        if record_id is not None:
+            query = query.where(cls.model.id == record_id)
+        async with async_session_maker() as session:
+            async with session.begin():
+                result = await session.execute(
+                    query.values(status=OUTBOX_PENDING, attempts=0, available_at=datetime.utcnow())
+                )
+                return result.rowcount
+
+    @classmethod
+    async def depth(cls) -> dict[str, Any]:
+        """Глубина очереди по статусам и возраст самой старой записи каждого статуса, сек."""
+        async with async_session_maker() as session:
+            rows = (await session.execute(
+                select(
+                    cls.model.status,
+                    func.count(cls.model.id),
+                    # created_at проставляет Postgres (now()), поэтому возраст считаем по его часам
+                    func.extract('epoch', func.now() - func.min(cls.model.created_at)),
+                ).group_by(cls.model.status)
+            )).all()
+        depth = {status: {"count": 0, "oldest_age_seconds": None}
+                 for status in (OUTBOX_PENDING, OUTBOX_PROCESSING, OUTBOX_DEAD)}
+        for status, count, oldest_age in rows:
+            depth[status] = {"count": count, "oldest_age_seconds": float(oldest_age) if oldest_age is not None else None}
+        return depth
@@ -1,9 +1,9 @@
 from aiogram import Router, types
 from loguru import logger
-import re
 
 from bot.config import bot, target_chat_id
-from bot.planfix import add_outgoing_comment_to_chat
+from bot.forwarding import group_mirror
+from bot.planfix_outbox import enqueue_outgoing_comment
 from bot.users.dao import UserDAO
 
 group_router = Router()
@@ -20,51 +20,21 @@ async def handle_group_reply(message: types.Message):
         logger.debug(f"Сообщение в группе {message.chat.id} проигнорировано, так как target_chat_id={target_chat_id}")
         return
 
-    # Проверяем, что это ответ на другое сообщение или цитирование
-    if not message.reply_to_message and not message.quote:
-        logger.debug("Сообщение в группе не является ответом и не содержит цитирования")
+    # Проверяем, что это ответ на другое сообщение (цитирование тоже приходит как ответ)
+    if not message.reply_to_message:
+        logger.debug("Сообщение в группе не является ответом")
         return
 
-    # Пытаемся получить user_id
-    user_id = None
-    target_message = None
-
-    # Если это ответ (Reply)
-    if message.reply_to_message:
-        target_message = message.reply_to_message
-        logger.debug("Сообщение является ответом (Reply)")
-
-    # Если это цитирование
-    elif message.quote:
-        target_message = message  # Мы не можем найти оригинальное сообщение, используем само сообщение с цитатой
-        logger.debug("Сообщение содержит цитирование")
-
-    if not target_message:
-        logger.debug("Не удалось найти целевое сообщение")
-        return
-
-    # Пытаемся получить user_id из forward_from
-    if target_message.forward_from:
-        user_id = target_message.forward_from.id
-        logger.debug(f"Извлечён user_id из forward_from: {user_id}")
-    else:
-        # Если forward_from отсутствует, пытаемся извлечь user_id из текста сообщения
-        if target_message.text:
-            # Ищем user_id в формате "Входящее сообщение от {user_id}" или "Исходящее сообщение для {user_id}"
-            match = re.search(r"(?:Входящее сообщение от|Исходящее сообщение для) (\d+)", target_message.text)
-            if match:
-                user_id = int(match.group(1))
-                logger.debug(f"Извлечён user_id из текста сообщения: {user_id}")
-            else:
-                logger.debug("Не удалось извлечь user_id из текста сообщения")
-                return
-        else:
-            logger.debug("Сообщение, на которое отвечают, не содержит текста")
-            return
-
-    if not user_id:
-        logger.debug("Не удалось определить user_id")
+    # Владельца сообщения находим по индексу пересылки — одно обращение по ключу
+    owner = await group_mirror.owner_of(message.reply_to_message.message_id)
+    if not owner:
+        logger.debug(f"Сообщение {message.reply_to_message.message_id} не найдено в индексе пересылки")
+        # Ответы на сообщения операторов — обычная переписка в группе, о них не сообщаем
+        if message.reply_to_message.from_user and message.reply_to_message.from_user.id == bot.id:
+            await message.answer("Ошибка: не удалось определить пользователя — сообщение устарело "
+                                 "или не было переслано ботом. Ответ не отправлен.")
         return
+    user_id = owner.telegram_id
 
     # Извлекаем только текст ответа (без цитирования)
     reply_text = message.text if message.text else "Сообщение без текста"
@@ -83,11 +53,15 @@ async def handle_group_reply(message: types.Message):
         logger.error(f"Не удалось отправить ответ пользователю {user_id}: {e}")
         await message.answer(f"Ошибка: не удалось отправить ответ пользователю {user_id}.")
 
-    # Добавляем комментарий в Planfix (только сам ответ)
-    user_data = await UserDAO.find_one_or_none(telegram_id=user_id)
-    if user_data and user_data.chat_pf_id:
-        success = await add_outgoing_comment_to_chat(
-            chat_pf_id=user_data.chat_pf_id,
+    # Добавляем комментарий в Planfix (только сам ответ).
+    # Чат мог появиться после пересылки сообщения — тогда берём его из профиля
+    chat_pf_id = owner.chat_pf_id
+    if not chat_pf_id:
+        user_data = await UserDAO.get_profile(user_id)
+        chat_pf_id = user_data.chat_pf_id if user_data else None
+    if chat_pf_id:
+        success = await enqueue_outgoing_comment(
+            chat_pf_id=chat_pf_id,
             comment=reply_text
         )
         if success:
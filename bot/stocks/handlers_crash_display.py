@@ -4,7 +4,8 @@ from aiogram import types
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.filters import Command
 from loguru import logger
-from bot.planfix import planfix_stock_balance_filter, upload_photo_to_planfix, planfix_price_assembly_basic_back_cover, add_outgoing_comment_to_chat
+from bot.planfix import planfix_stock_balance_filter, planfix_price_assembly_basic_back_cover
+from bot.planfix_outbox import enqueue_outgoing_comment, enqueue_chat_photos
 from bot.utils.planfix_utils import extract_price_from_data
 from bot.stocks.keyboards import inline_kb_cart as in_kb
 from bot.stocks.dao import CartDAO
@@ -41,7 +42,7 @@ async def handle_crash_display_common(callback: CallbackQuery, state: FSMContext
 
     # Получаем chat_pf_id для отправки в Planfix
     telegram_id = callback.from_user.id
-    data_chat_pf_id = await UserDAO.find_one_or_none(telegram_id=telegram_id)
+    data_chat_pf_id = await UserDAO.get_profile(telegram_id)
     if not data_chat_pf_id or not data_chat_pf_id.chat_pf_id:
         logger.warning(f"У пользователя {telegram_id} отсутствует chat_pf_id")
         await callback.message.answer("Ошибка: у вас нет активного чата в Planfix. Пожалуйста, перезапустите бота с помощью /start.")
@@ -73,12 +74,12 @@ async def handle_crash_display_common(callback: CallbackQuery, state: FSMContext
 
         # Отправляем сообщение в Planfix
         clean_message_text = strip_html(message_text)
-        success = await add_outgoing_comment_to_chat(chat_pf_id=chat_pf_id, comment=clean_message_text)
+        success = await enqueue_outgoing_comment(chat_pf_id=chat_pf_id, comment=clean_message_text)
         if not success:
             logger.error(f"Не удалось отправить сообщение в Planfix для пользователя {telegram_id}")
             await callback.message.answer("Ошибка: не удалось отправить сообщение в Planfix.")
         else:
-            logger.info(f"Сообщение успешно отправлено в Planfix для пользователя {telegram_id}")
+            logger.info(f"Сообщение поставлено в очередь Planfix для пользователя {telegram_id}")
         
         await callback.answer()
 
@@ -106,12 +107,12 @@ async def handle_crash_display_common(callback: CallbackQuery, state: FSMContext
 
         # Отправляем сообщение в Planfix
         clean_message_text = strip_html(message_text)
-        success = await add_outgoing_comment_to_chat(chat_pf_id=chat_pf_id, comment=clean_message_text)
+        success = await enqueue_outgoing_comment(chat_pf_id=chat_pf_id, comment=clean_message_text)
         if not success:
             logger.error(f"Не удалось отправить сообщение в Planfix для пользователя {telegram_id}")
             await callback.message.answer("Ошибка: не удалось отправить сообщение в Planfix.")
         else:
-            logger.info(f"Сообщение успешно отправлено в Planfix для пользователя {telegram_id}")
+            logger.info(f"Сообщение поставлено в очередь Planfix для пользователя {telegram_id}")
     
         await callback.answer()
 
@@ -156,8 +157,6 @@ async def process_quantity(message: types.Message, state: FSMContext):
     await state.set_state(CrashDisplayOrder.waiting_for_photo)
 
 async def process_photo(message: types.Message, state: FSMContext):
-    from bot.config import bot
-    
     if not message.photo:
         await message.answer("Пожалуйста, отправьте фото:")
         return
@@ -184,7 +183,7 @@ async def process_photo(message: types.Message, state: FSMContext):
     telegram_id = state_data.get('telegram_id')
     quantity = state_data.get('quantity')
 
-    data_chat_pf_id = await UserDAO.find_one_or_none(telegram_id=telegram_id)
+    data_chat_pf_id = await UserDAO.get_profile(telegram_id)
     if not data_chat_pf_id or not data_chat_pf_id.chat_pf_id:
         logger.warning(f"У пользователя {telegram_id} отсутствует chat_pf_id")
         await message.answer("Ошибка: у вас нет активного чата в Planfix. Пожалуйста, перезапустите бота с помощью /start.")
@@ -192,35 +191,9 @@ async def process_photo(message: types.Message, state: FSMContext):
         return
     chat_pf_id = data_chat_pf_id.chat_pf_id
 
-    photo_files = []
-    photo_file_ids = []
-    failed_photos = 0
-
-    for msg in messages:
-        if msg.photo:
-            photo = msg.photo[-1]
-            try:
-                from io import BytesIO
-                buffer = BytesIO()
-                await bot.download(file=photo.file_id, destination=buffer)
-                photo_bytes = buffer.getvalue()
-                logger.info(f"Фото успешно скачано из Telegram, размер: {len(photo_bytes)} байт")
-                photo_files.append(photo_bytes)
-                photo_file_ids.append(photo.file_id)
-            except Exception as e:
-                logger.error(f"Ошибка при скачиванием фото из Telegram: {e}")
-                failed_photos += 1
-                continue
-
-    if not photo_files:
-        await message.answer("Не удалось скачать ни одно фото. Пожалуйста, попробуйте снова.")
-        return
-
-    if failed_photos > 0:
-        await message.answer(f"Не удалось скачать {failed_photos} фото. Загружено только {len(photo_files)} фото.")
-
-    success = await upload_photo_to_planfix(chat_pf_id=chat_pf_id, photo_files=photo_files)
-    if not success:
+    # Фото передаются из Telegram в Planfix фоновым воркером очереди, пользователь их не ждёт
+    photo_file_ids = [msg.photo[-1].file_id for msg in messages if msg.photo]
+    if not await enqueue_chat_photos(chat_pf_id=chat_pf_id, telegram_file_ids=photo_file_ids):
         await message.answer("Ошибка при загрузке фото в Planfix. Пожалуйста, попробуйте снова.")
         return
 
@@ -260,12 +233,12 @@ async def process_photo(message: types.Message, state: FSMContext):
 
         # Отправляем сообщение в Planfix
         clean_message_text = strip_html(message_text)
-        success = await add_outgoing_comment_to_chat(chat_pf_id=chat_pf_id, comment=clean_message_text)
+        success = await enqueue_outgoing_comment(chat_pf_id=chat_pf_id, comment=clean_message_text)
         if not success:
             logger.error(f"Не удалось отправить сообщение в Planfix для пользователя {telegram_id}")
             await message.answer("Ошибка: не удалось отправить сообщение в Planfix.")
         else:
-            logger.info(f"Сообщение успешно отправлено в Planfix для пользователя {telegram_id}")
+            logger.info(f"Сообщение поставлено в очередь Planfix для пользователя {telegram_id}")
 
     else:
         message_text = (
@@ -281,11 +254,11 @@ async def process_photo(message: types.Message, state: FSMContext):
 
         # Отправляем сообщение в Planfix
         clean_message_text = strip_html(message_text)
-        success = await add_outgoing_comment_to_chat(chat_pf_id=chat_pf_id, comment=clean_message_text)
+        success = await enqueue_outgoing_comment(chat_pf_id=chat_pf_id, comment=clean_message_text)
         if not success:
             logger.error(f"Не удалось отправить сообщение в Planfix для пользователя {telegram_id}")
             await message.answer("Ошибка: не удалось отправить сообщение в Planfix.")
         else:
-            logger.info(f"Сообщение успешно отправлено в Planfix для пользователя {telegram_id}")
+            logger.info(f"Сообщение поставлено в очередь Planfix для пользователя {telegram_id}")
 
     await state.clear()
\ No newline at end of file
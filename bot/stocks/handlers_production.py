@@ -3,6 +3,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram import types
 from loguru import logger
 from bot.planfix import planfix_all_production_filter, planfix_production_task_id
+from bot.planfix_schema import PRODUCTION
 from bot.stocks.keyboards import inline_kb_cart as in_kb
 from bot.stocks.dao import CartDAO
 from bot.users.keyboards import inline_kb as user_kb
@@ -22,21 +23,11 @@ async def handle_production_common(callback: CallbackQuery, state: FSMContext, o
             return result
         
         messages = []
-        for task in data_production["tasks"]:
-            task_id = task["id"]
-            model = "Неизвестно"
-            price = "Не указана"
-            description = "Описание отсутствует"
-            
-            for field in task.get("customFieldData", []):
-                field_name = field["field"].get("name", "")
-                if field_name == "Модель":
-                    model = field["value"].get("value", "Неизвестно")
-                elif field_name == "Price":
-                    price = field.get("value", "Не указана")
-                    formatted_price = f"{int(price):,}".replace(",", " ")
-                elif field_name == "Комментарии":
-                    description = field.get("value", "Описание отсутствует")
+        for record in PRODUCTION.decode_all(data_production):
+            task_id = record.id
+            model = record.model or "Неизвестно"
+            formatted_price = f"{record.price:,}".replace(",", " ") if record.price is not None else "Не указана"
+            description = record.description or "Описание отсутствует"
             
             message_text = (
                 f"🔹 <b>Дисплей (восстановленный)</b>\n"
@@ -77,13 +68,8 @@ async def add_to_cart(callback_query: types.CallbackQuery, prefix: str):
         telegram_id = callback_query.from_user.id
 
         data_product = await planfix_production_task_id(task_id=task_id)
-        custom_fields = data_product.get("task", {}).get("customFieldData", [])
-
-        price = 0
-        for field in custom_fields:
-            field_id = field.get("field", {}).get("id")
-            if field_id == 12126:
-                price = field.get("value") or 0
+        record = PRODUCTION.decode_one(data_product)
+        price = record.price if record and record.price else 0
 
         await CartDAO.add(
             telegram_id=telegram_id,
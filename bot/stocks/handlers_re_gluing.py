@@ -2,7 +2,8 @@ from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram import types
 from loguru import logger
-from bot.planfix import planfix_price_basic_nomenclature_re_gluing, planfix_basic_nomenclature_re_gluing, planfix_stock_balance
+from bot.planfix import planfix_price_basic_nomenclature_re_gluing_batch, planfix_basic_nomenclature_re_gluing, planfix_stock_balance
+from bot.utils.planfix_utils import extract_pricelist_keys
 from bot.stocks.keyboards import inline_kb_cart as in_kb
 from bot.stocks.dao import CartDAO
 
@@ -21,6 +22,11 @@ async def handle_re_gluing_common(callback: CallbackQuery, state: FSMContext):
 
         # await callback.message.answer(f'{data_basic_nomenclature_re_gluing}')
 
+        # Цены всех записей запрашиваем одним параллельным пакетом, а не по одной в цикле
+        prices = await planfix_price_basic_nomenclature_re_gluing_batch(
+            extract_pricelist_keys(data_basic_nomenclature_re_gluing['directoryEntries'])
+        )
+
         messages = []
         
         for entry in data_basic_nomenclature_re_gluing['directoryEntries']:
@@ -36,7 +42,7 @@ async def handle_re_gluing_common(callback: CallbackQuery, state: FSMContext):
             
             if pricelist_key is not None and pricelist_key != 0 and name_model:
                 messages.append(f"ID: {pricelist_key}, name_model: {name_model}")
-                data_pricelist = await planfix_price_basic_nomenclature_re_gluing(model_id=model_id, pricelist_key=pricelist_key)
+                data_pricelist = prices.get(int(pricelist_key), {"result": "fail"})
 
                 if data_pricelist.get('result') == 'success' and 'entry' in data_pricelist:
                     for field_data in data_pricelist['entry']['customFieldData']:
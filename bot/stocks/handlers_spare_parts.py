@@ -4,8 +4,10 @@ from aiogram import types
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.filters import Command
 from loguru import logger
-from bot.planfix import planfix_stock_balance_spare_parts_filter, add_outgoing_comment_to_chat
+from bot.planfix import planfix_stock_balance_spare_parts_filter
+from bot.planfix_outbox import enqueue_outgoing_comment
 from bot.utils.planfix_utils import strip_html
+from bot.planfix_schema import SPARE_PARTS
 from bot.stocks.keyboards import inline_kb_cart as in_kb
 from bot.stocks.dao import CartDAO
 from bot.users.dao import UserDAO
@@ -30,27 +32,11 @@ async def handle_spare_parts_common(callback: CallbackQuery, state: FSMContext):
             await callback.answer()
             return
 
-        for task in data_spare_parts['tasks']:
-            price = None
-            spare_part_name = None
-            spare_part_id = None
-            balance = None
-
-            for field_data in task['customFieldData']:
-                if 'value' not in field_data or field_data['value'] is None:
-                    logger.warning(f"Отсутствует или пустое 'value' в field_data: {field_data}")
-                    continue
-
-                field_id = field_data['field']['id']
-                value = field_data['value']
-
-                if field_id == 5718:  # Цена закупки, RUB
-                    price = value
-                elif field_id == 5512:  # Запчасть
-                    spare_part_name = value.get('value') if isinstance(value, dict) else value
-                    spare_part_id = value.get('id') if isinstance(value, dict) else None
-                elif field_id == 5722:  # Св. остаток
-                    balance = value
+        for record in SPARE_PARTS.decode_all(data_spare_parts):
+            price = record.price
+            spare_part_name = record.name
+            spare_part_id = record.part_id
+            balance = record.balance
 
             if price and spare_part_name and spare_part_id and balance:
                 price_formatted = f"{int(price):,}".replace(",", " ")
@@ -70,7 +56,7 @@ async def handle_spare_parts_common(callback: CallbackQuery, state: FSMContext):
 
                 # Получаем chat_pf_id для отправки в Planfix
                 telegram_id = callback.from_user.id
-                data_chat_pf_id = await UserDAO.find_one_or_none(telegram_id=telegram_id)
+                data_chat_pf_id = await UserDAO.get_profile(telegram_id)
                 if not data_chat_pf_id or not data_chat_pf_id.chat_pf_id:
                     logger.warning(f"У пользователя {telegram_id} отсутствует chat_pf_id")
                     await callback.message.answer("Ошибка: у вас нет активного чата в Planfix. Пожалуйста, перезапустите бота с помощью /start.")
@@ -92,12 +78,12 @@ async def handle_spare_parts_common(callback: CallbackQuery, state: FSMContext):
 
                 # Отправляем сообщение в Planfix
                 clean_message_text = strip_html(spare_part_formatted)
-                success = await add_outgoing_comment_to_chat(chat_pf_id=chat_pf_id, comment=clean_message_text)
+                success = await enqueue_outgoing_comment(chat_pf_id=chat_pf_id, comment=clean_message_text)
                 if not success:
                     logger.error(f"Не удалось отправить сообщение в Planfix для пользователя {telegram_id}")
                     await callback.message.answer("Ошибка: не удалось отправить сообщение в Planfix.")
                 else:
-                    logger.info(f"Сообщение успешно отправлено в Planfix для пользователя {telegram_id}")
+                    logger.info(f"Сообщение поставлено в очередь Planfix для пользователя {telegram_id}")
 
         await callback.answer()
 
@@ -120,16 +106,10 @@ async def add_spare_parts_search_ai_cart(callback_query: types.CallbackQuery, pr
         data_spare_parts = await planfix_stock_balance_spare_parts_filter(model_id=model_id)
         balance = None
         found_spare_part_id = None
-        for task in data_spare_parts.get('tasks', []):
-            for field_data in task['customFieldData']:
-                if field_data['field']['id'] == 5512 and isinstance(field_data['value'], dict):
-                    if field_data['value'].get('id') == spare_part_id:
-                        found_spare_part_id = field_data['value']['id']
-                        for other_field in task['customFieldData']:
-                            if other_field['field']['id'] == 5722:  # Св. остаток
-                                balance = int(other_field['value'])
-                        break
-            if found_spare_part_id:
+        for record in SPARE_PARTS.decode_all(data_spare_parts):
+            if record.part_id == spare_part_id:
+                found_spare_part_id = record.part_id
+                balance = record.balance
                 break
 
         if balance is None or balance <= 0:
@@ -183,7 +163,7 @@ async def process_quantity_spare_parts(message: types.Message, state: FSMContext
         telegram_id = state_data.get('telegram_id')
 
         # Получаем chat_pf_id для отправки в Planfix
-        data_chat_pf_id = await UserDAO.find_one_or_none(telegram_id=telegram_id)
+        data_chat_pf_id = await UserDAO.get_profile(telegram_id)
         if not data_chat_pf_id or not data_chat_pf_id.chat_pf_id:
             logger.warning(f"У пользователя {telegram_id} отсутствует chat_pf_id")
             await message.answer("Ошибка: у вас нет активного чата в Planfix. Пожалуйста, перезапустите бота с помощью /start.")
@@ -221,12 +201,12 @@ async def process_quantity_spare_parts(message: types.Message, state: FSMContext
 
         # Отправляем сообщение в Planfix
         clean_message_text = strip_html(message_text)
-        success = await add_outgoing_comment_to_chat(chat_pf_id=chat_pf_id, comment=clean_message_text)
+        success = await enqueue_outgoing_comment(chat_pf_id=chat_pf_id, comment=clean_message_text)
         if not success:
             logger.error(f"Не удалось отправить сообщение в Planfix для пользователя {telegram_id}")
             await message.answer("Ошибка: не удалось отправить сообщение в Planfix.")
         else:
-            logger.info(f"Сообщение успешно отправлено в Planfix для пользователя {telegram_id}")
+            logger.info(f"Сообщение поставлено в очередь Planfix для пользователя {telegram_id}")
 
         await state.clear()
 
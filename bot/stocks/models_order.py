@@ -25,8 +25,9 @@ class Order(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
     telegram_id: Mapped[int] = mapped_column(
-        ForeignKey('users.telegram_id', ondelete='CASCADE'), nullable=False
+        ForeignKey('users.telegram_id', ondelete='CASCADE'), nullable=False, index=True
     )
+    # Текущий статус; меняется вместе с записью в order_status_history (OrderStatusHistoryDAO.add)
     status: Mapped[str] = mapped_column(
         String, default=OrderStatus.PENDING.value  # Используем String вместо SQLEnum
     )
@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import Optional, Any
+from sqlalchemy import String, Integer, DateTime, Text, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+from bot.database import Base
+
+# Статусы записи очереди
+OUTBOX_PENDING = "pending"
+OUTBOX_PROCESSING = "processing"
+OUTBOX_DEAD = "dead"
+
+
+class PlanfixOutbox(Base):
+    """Очередь операций записи в Planfix (transactional outbox)"""
+    __tablename__ = 'planfix_outbox'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String, nullable=False)  # Тип операции (см. bot.planfix_outbox)
+    ordering_key: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # Записи с одним ключом выполняются по порядку
+    payload: Mapped[dict[str, Any]] = mapped_column(JSONB, nullable=False)
+    status: Mapped[str] = mapped_column(String, default=OUTBOX_PENDING, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    available_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)  # Не раньше
+    locked_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # Аренда воркера
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('ix_planfix_outbox_status_available', 'status', 'available_at'),
+        Index('ix_planfix_outbox_ordering_key', 'ordering_key', 'id'),
+    )
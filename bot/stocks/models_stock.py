@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Optional, Any
+from sqlalchemy import String, Integer, DateTime, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+from bot.database import Base
+
+
+class StockTask(Base):
+    """Локальное зеркало задач остатков Planfix (фильтры 104384, 104400, 104398)"""
+    __tablename__ = 'stock_tasks'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    filter_id: Mapped[str] = mapped_column(String, nullable=False)  # ID фильтра Planfix
+    task_pf_id: Mapped[int] = mapped_column(Integer, nullable=False)  # ID задачи в Planfix
+    model_pf_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # 5556 (Модель)
+    operation: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # 12142 (Операция)
+    product_name: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # 5542 / 5512
+    device: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # 6640 (Устройство)
+    brand: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # 6282 (Бренд)
+    stock_balance: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 12116 / 5722
+    price: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 12140 / 12126 / 5718
+    data: Mapped[dict[str, Any]] = mapped_column(JSONB, nullable=False)  # Задача в формате ответа Planfix
+    synced_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('filter_id', 'task_pf_id', name='uq_stock_tasks_filter_task'),
+        Index('ix_stock_tasks_filter_model_operation', 'filter_id', 'model_pf_id', 'operation'),
+    )
+
+
+class SyncState(Base):
+    """Курсор и время последней синхронизации зеркала"""
+    __tablename__ = 'sync_states'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    cursor: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # changed-since курсор
+    last_sync_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_full_sync_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
@@ -8,9 +8,12 @@ from bot.planfix import (
     planfix_basic_back_cover_cart, 
     planfix_price_basic_back_cover, 
     planfix_price_assembly_basic_back_cover,
-    planfix_price_basic_nomenclature_re_gluing, 
+    planfix_price_basic_nomenclature_re_gluing_batch, 
     planfix_basic_nomenclature_re_gluing
 )
+from bot.utils.planfix_utils import extract_pricelist_keys
+from bot.planfix_client import DIRECTORY_ENTRIES
+from bot.planfix_schema import PRICE_LIST, PRODUCTION
 from bot.stocks.keyboards import inline_kb_cart as kb
 from bot.users.keyboards import inline_kb as user_kb
 from bot.stocks.dao import CartDAO
@@ -62,6 +65,11 @@ async def handle_re_gluing_common(callback: CallbackQuery, state: FSMContext):
 
         data_basic_nomenclature_re_gluing = await planfix_basic_nomenclature_re_gluing(model_id=model_id, filter_id=104412)
 
+        # Цены всех записей запрашиваем одним параллельным пакетом, а не по одной в цикле
+        prices = await planfix_price_basic_nomenclature_re_gluing_batch(
+            extract_pricelist_keys(data_basic_nomenclature_re_gluing['directoryEntries'])
+        )
+
         messages = []
         
         for entry in data_basic_nomenclature_re_gluing['directoryEntries']:
@@ -77,7 +85,7 @@ async def handle_re_gluing_common(callback: CallbackQuery, state: FSMContext):
             
             if pricelist_key is not None and pricelist_key != 0 and name_model:
                 messages.append(f"ID: {pricelist_key}, name_model: {name_model}")
-                data_pricelist = await planfix_price_basic_nomenclature_re_gluing(model_id=model_id, pricelist_key=pricelist_key)
+                data_pricelist = prices.get(int(pricelist_key), {"result": "fail"})
 
                 if data_pricelist.get('result') == 'success' and 'entry' in data_pricelist:
                     for field_data in data_pricelist['entry']['customFieldData']:
@@ -153,6 +161,11 @@ async def handle_web_re_gluing(callback: CallbackQuery, state: FSMContext):
 
         data_basic_nomenclature_re_gluing = await planfix_basic_nomenclature_re_gluing(model_id=model_id, filter_id=104412)
 
+        # Цены всех записей запрашиваем одним параллельным пакетом, а не по одной в цикле
+        prices = await planfix_price_basic_nomenclature_re_gluing_batch(
+            extract_pricelist_keys(data_basic_nomenclature_re_gluing['directoryEntries'])
+        )
+
         messages = []
         
         for entry in data_basic_nomenclature_re_gluing['directoryEntries']:
@@ -168,7 +181,7 @@ async def handle_web_re_gluing(callback: CallbackQuery, state: FSMContext):
             
             if pricelist_key is not None and pricelist_key != 0 and name_model:
                 messages.append(f"ID: {pricelist_key}, name_model: {name_model}")
-                data_pricelist = await planfix_price_basic_nomenclature_re_gluing(model_id=model_id, pricelist_key=pricelist_key)
+                data_pricelist = prices.get(int(pricelist_key), {"result": "fail"})
 
                 if data_pricelist.get('result') == 'success' and 'entry' in data_pricelist:
                     for field_data in data_pricelist['entry']['customFieldData']:
@@ -379,13 +392,9 @@ async def add_to_cart(callback: CallbackQuery, state: FSMContext):
         price_assembly = None
         try:
             if data_price_assembly.get("result") == "success":
-                entries = data_price_assembly.get("directoryEntries", [])
-                if entries and "customFieldData" in entries[0]:
-                    custom_fields = entries[0]["customFieldData"]
-                    for field in custom_fields:
-                        if field.get("field", {}).get("id") == 3780:  # Поле "Цена разборки/сборки"
-                            price_assembly = field.get("value")
-                            break
+                records = PRICE_LIST.decode_all(data_price_assembly, DIRECTORY_ENTRIES)
+                if records:
+                    price_assembly = records[0].assembly_price  # Цена разборки/сборки
             if price_assembly is None:
                 logger.warning(f"Цена разборки/сборки не найдена в ответе: {data_price_assembly}")
                 price_assembly = 0  # Значение по умолчанию, если цена не найдена
@@ -600,13 +609,9 @@ async def send_product_cart(message: Message):
                 data_price_assembly = await planfix_price_assembly_basic_back_cover(model_id=product_id)
                 try:
                     if data_price_assembly.get("result") == "success":
-                        entries = data_price_assembly.get("directoryEntries", [])
-                        if entries and "customFieldData" in entries[0]:
-                            custom_fields = entries[0]["customFieldData"]
-                            for field in custom_fields:
-                                if field.get("field", {}).get("id") == 3780:  # Поле "Цена разборки/сборки"
-                                    price_assembly = field.get("value")
-                                    break
+                        records = PRICE_LIST.decode_all(data_price_assembly, DIRECTORY_ENTRIES)
+                        if records:
+                            price_assembly = records[0].assembly_price  # Цена разборки/сборки
                     if price_assembly is None:
                         logger.warning(f"Цена разборки/сборки не найдена в ответе: {data_price_assembly}")
                         price_assembly = 0
@@ -617,16 +622,9 @@ async def send_product_cart(message: Message):
             # Логика для операции 4: получаем данные из Planfix
             if operation == 4:
                 product_cart_data = await planfix_production_task_id(task_id=task_id)
-                custom_fields = product_cart_data.get("task", {}).get("customFieldData", [])
-
-                price = 0
-                comment = ""
-                for field in custom_fields:
-                    field_id = field.get("field", {}).get("id")
-                    if field_id == 12126:  # ID поля Price
-                        price = field.get("value") or 0
-                    elif field_id == 5498:  # ID поля Комментарии
-                        comment = field.get("value", "")
+                record = PRODUCTION.decode_one(product_cart_data)
+                price = (record.price if record else None) or 0
+                comment = (record.description if record else None) or ""
 
                 formatted_price = f"{price:,.0f}".replace(',', ' ')
                 await CartDAO.update(filter_by={"id": prod_cart_id}, price=price)
@@ -818,16 +816,9 @@ async def delete_product_aiagent_cart(callback_query: types.CallbackQuery):
             quantity = product.quantity
 
             product_cart_data = await planfix_production_task_id(task_id=task_id)
-            custom_fields = product_cart_data.get("task", {}).get("customFieldData", [])
-
-            price = 0
-            comment = ""
-            for field in custom_fields:
-                field_id = field.get("field", {}).get("id")
-                if field_id == 12126:  # ID поля Price
-                    price = field.get("value") or 0
-                elif field_id == 5498:  # ID поля Комментарии
-                    comment = field.get("value", "")
+            record = PRODUCTION.decode_one(product_cart_data)
+            price = (record.price if record else None) or 0
+            comment = (record.description if record else None) or ""
 
             total_price += price * quantity
             formatted_price = f"{price:,.0f}".replace(',', ' ')
@@ -1,3 +1,4 @@
+from typing import Optional
 from aiogram import Router, F, types
 
 from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent, Message
@@ -12,25 +13,30 @@ from bot import planfix_order as pf_order
 from bot.users.keyboards import inline_kb as kb
 from bot.stocks.keyboards import inline_kb_cart as in_kb
 from bot.users.keyboards import markup_kb
-from bot.stocks.dao import CartDAO, OrderDAO, OrderItemDAO, OrderStatusHistoryDAO
+from bot.stocks.dao import CartDAO, OrderDAO
 from bot.users.dao import UserDAO
 from bot.stocks.models_order import OrderStatus
 import re
 from loguru import logger
 from sqlalchemy import inspect
 from bot.database import async_session_maker
+from sqlalchemy.ext.asyncio import AsyncSession
 from bot.operations import OPERATION_NAMES
+from bot.planfix_outbox import enqueue_order
+from bot.dao.base import commit_unit_of_work
 
 order_router = Router()
 
 @order_router.message(F.text == '🗂 Мои заказы')
-async def send_orders(message: Message):
+async def send_orders(message: Message, session: AsyncSession):
     telegram_id = message.from_user.id
     messages = []  # Список для хранения отправленных сообщений
 
     try:
-        my_orders = await OrderDAO.find_all(telegram_id=telegram_id)
- 
+        my_orders = await OrderDAO.find_all(session=session, telegram_id=telegram_id)
+        # Дальше только ответы пользователю: транзакция чтения больше не нужна
+        await commit_unit_of_work(session)
+
         if not my_orders:
             result = await message.answer("У вас нет заказов.")
             messages.append(result)
@@ -39,11 +45,7 @@ async def send_orders(message: Message):
         logger.info(f"Получено {len(my_orders)} заказов для telegram_id={telegram_id}")
 
         for order in my_orders:
-            status_history = await OrderStatusHistoryDAO.find_all(order_id=order.id)
-            if status_history:
-                last_status = sorted(status_history, key=lambda x: x.timestamp, reverse=True)[0].status
-            else:
-                last_status = "Неизвестно"
+            last_status = order.status or "Неизвестно"
 
             order_total_amount = order.total_amount
             order_items = order.items
@@ -86,12 +88,19 @@ class OrderStates(StatesGroup):
     confirm_phone = State()      # Состояние подтверждения номера телефона
 
 # Вспомогательная функция для создания заказа и синхронизации с Планфиксом
-async def create_order_and_sync_with_planfix(telegram_id: int, phone_number: str, message_obj, state: FSMContext):
+async def create_order_and_sync_with_planfix(telegram_id: int, phone_number: str, message_obj, state: FSMContext,
+                                             session: Optional[AsyncSession] = None):
     messages = []  # Список для хранения отправленных сообщений
+    # Заказ, его позиции, статус и операция в очереди Planfix записываются вместе:
+    # при ошибке откатывается только эта часть единицы работы
+    savepoint = await session.begin_nested() if session is not None else None
     try:
-        # Получаем items корзины
-        cart_items = await CartDAO.find_all(telegram_id=telegram_id)
-        if not cart_items:
+        # Заказ, позиции и начальный статус создаются одним запросом
+        order = await OrderDAO.create_from_cart(telegram_id, session=session)
+        if order is None:
+            if savepoint is not None:
+                await savepoint.commit()
+                await commit_unit_of_work(session)
             error_message = await message_obj.answer(
                 "Ваша корзина пуста!",
                 reply_markup=markup_kb.back_keyboard(user_id=telegram_id)
@@ -99,48 +108,10 @@ async def create_order_and_sync_with_planfix(telegram_id: int, phone_number: str
             await state.clear()
             return [error_message]
 
-        # Создаем заказ и получаем только его id
-        order_id = await OrderDAO.add(
-            telegram_id=telegram_id,
-            total_amount=0
-        )
-
-        # Добавляем items заказа и сохраняем их идентификаторы
-        total_amount = 0
-        order_item_ids = []  # Список для хранения id добавленных OrderItem
-        for cart_item in cart_items:
-            order_item_id = await OrderItemDAO.add(
-                order_id=order_id,
-                product_id=cart_item.product_id,
-                product_name=cart_item.product_name,
-                quantity=cart_item.quantity,
-                price=cart_item.price,
-                task_id=cart_item.task_id,
-                operation=cart_item.operation,
-                touch_or_backlight=cart_item.touch_or_backlight,
-                photo_file_ids=cart_item.photo_file_ids,
-                assembly_required=cart_item.assembly_required
-            )
-            order_item_ids.append(order_item_id)  # Сохраняем уникальный id элемента
-            total_amount += cart_item.price * cart_item.quantity
-
-        # Обновляем общую сумму заказа
-        await OrderDAO.update(
-            {"id": order_id},
-            total_amount=total_amount
-        )
-
-        # Добавляем начальный статус
-        status_record = await OrderStatusHistoryDAO.add(
-            order_id=order_id,
-            status=OrderStatus.PENDING.value,
-            comment="Order created"
-        )
-        status = status_record["status"]
-
-        # Получаем данные о заказе и его элементах
-        order = await OrderDAO.find_one_or_none(id=order_id)
-        order_items = await OrderItemDAO.find_all(order_id=order_id)
+        order_id = order["order_id"]
+        total_amount = order["total_amount"]
+        status = order["status"]
+        order_items = order["items"]
 
         # # Очищаем корзину
         # await CartDAO.delete(telegram_id=telegram_id, delete_all=True)
@@ -174,7 +145,7 @@ async def create_order_and_sync_with_planfix(telegram_id: int, phone_number: str
                 )
             elif operation_id == 4:
                 # Предполагаем, что комментарий сохранен в cart_items
-                comment = getattr(cart_items[idx], 'comment', 'Тестирование')
+                comment = getattr(item, 'comment', 'Тестирование')
                 item_text = (
                     f"   🔹 {item.product_name}\n"
                     f"   💰 Цена: {item.price} руб.\n"
@@ -233,96 +204,40 @@ async def create_order_and_sync_with_planfix(telegram_id: int, phone_number: str
             f"📞 Номер телефона: {phone_number}\n"
             f"📝 Состав заказа:\n{items_text}"
         )
-        logger.info(f"Отправка сообщения пользователю: {message_text}")
-        order_message = await message_obj.answer(
-            message_text,
-            reply_markup=markup_kb.back_keyboard(user_id=telegram_id)
-        )
-        messages.append(order_message)
-        logger.info("Сообщение успешно отправлено пользователю")
-
-        # Интеграция с Планфиксом
-        logger.info("Начало интеграции с Планфиксом")
-
-        # Создаем общий заказ в Планфиксе
-        data_order = await pf_order.planfix_create_order(description=description, order_id=order_id)
-        order_pf_id = data_order['id']
-        logger.info(f"Создан заказ в Планфиксе: {order_pf_id}")
-        planfix_message = await message_obj.answer(f"Заказ в Планфиксе создан: {order_pf_id}")
-        messages.append(planfix_message)
-
-        # Обновляем заказ с order_pf_id
-        await OrderDAO.update(
-            {"id": order_id},
-            order_pf_id=order_pf_id
-        )
-        logger.info(f"Заказ #{order_id} обновлён с order_pf_id={order_pf_id}")
-
-        # Добавляем продукцию в Планфикс с разбивкой по операциям
-        for operation_name, items in grouped_items.items():
-            operation_id = None
-            for idx, _ in items:
-                item_operation_id = int(order_items[idx].operation) if isinstance(order_items[idx].operation, (int, str)) and str(order_items[idx].operation).isdigit() else 0
-                operation_id = item_operation_id
-                cart_item = cart_items[idx]
-                prodaction_pf_id = cart_item.task_id
-                order_item_id = order_item_ids[idx]  # Уникальный id из OrderItem
-                price = cart_item.price
-                quantity = cart_item.quantity
-                touch_or_backlight = cart_item.touch_or_backlight
-
-                touch_or_backlight = bool(touch_or_backlight)
-                touch_or_backlight = 1 if touch_or_backlight is False else 2
-
-                # Выбираем функцию для добавления продукции
-                if operation_id == 1 or operation_id == 2:
-                    data_prodaction = await pf_order.planfix_create_order_re_gluing_1(
-                        order_pf_id=order_pf_id,
-                        re_gluing_pf_id=prodaction_pf_id,
-                        price=price,
-                        order_item_id=order_item_id,
-                        touch_or_backlight=touch_or_backlight
-                    )
-                elif operation_id == 4:
-                    data_prodaction = await pf_order.planfix_create_order_prodaction_4(
-                        order_pf_id=order_pf_id,
-                        prodaction_pf_id=prodaction_pf_id,
-                        price=price,
-                        order_item_id=order_item_id
-                    )
-                elif operation_id == 5:
-                    data_prodaction = await pf_order.planfix_create_order_spare_parts_5(
-                        order_pf_id=order_pf_id,
-                        spare_parts_pf_id=prodaction_pf_id,
-                        price=price,
-                        quantity=quantity,
-                        order_item_id=order_item_id
-                    )
-                elif operation_id == 6:
-                    data_prodaction = await pf_order.planfix_create_order_back_cover_6(
-                        order_pf_id=order_pf_id,
-                        back_cover_pf_id=prodaction_pf_id,
-                        price=price,
-                        order_item_id=order_item_id
-                    )
-                elif operation_id == 7:
-                    data_prodaction = await pf_order.planfix_create_order_crash_display_7(
-                        order_pf_id=order_pf_id,
-                        crash_display_pf_id=prodaction_pf_id,
-                        price=price,
-                        quantity=quantity,
-                        touch_or_backlight=touch_or_backlight,
-                        order_item_id=order_item_id
-                    )
-                else:
-                    data_prodaction = {'id': f'unknown_operation_prodaction_{operation_id}'}
-
-                logger.info(f"Продукция добавлена в Планфикс (операция {operation_name}): {data_prodaction}")
-                product_message = await message_obj.answer(f"Продукция добавлена в Планфикс (операция {operation_name}): {data_prodaction}")
-                messages.append(product_message)
+
+        # Интеграция с Планфиксом: заказ и его позиции передаёт воркер очереди,
+        # итоговое сообщение по позициям он отправит пользователю сам
+        lines = []
+        for item in order_items:
+            lines.append(pf_order.OrderLine(
+                operation_id=int(item.operation) if str(item.operation).isdigit() else 0,
+                pf_id=item.task_id,
+                price=item.price,
+                quantity=item.quantity,
+                order_item_id=item.id,  # Уникальный id из OrderItem
+                touch_or_backlight=2 if item.touch_or_backlight else 1,
+                product_name=item.product_name or "",
+            ))
+        outbox_id = await enqueue_order(order_id=order_id, description=description, lines=lines, telegram_id=telegram_id,
+                                        session=session)
+        if outbox_id is None:
+            raise RuntimeError(f"Заказ #{order_id} не поставлен в очередь Planfix")
+        logger.info(f"Заказ #{order_id} поставлен в очередь Planfix (запись {outbox_id})")
+        if savepoint is not None:
+            await savepoint.commit()
+            await commit_unit_of_work(session)
 
     except Exception as e:
         logger.error(f"Ошибка при создании заказа или интеграции с Планфиксом для telegram_id={telegram_id}: {e}")
+        if savepoint is not None and savepoint.is_active:
+            await savepoint.rollback()
+        if session is not None:
+            # Остальные изменения обновления (например, новый телефон) сохраняются до ответа
+            try:
+                await commit_unit_of_work(session)
+            except Exception as commit_error:
+                logger.error(f"Не удалось зафиксировать изменения для telegram_id={telegram_id}: {commit_error}")
+                await session.rollback()
         error_message = await message_obj.answer(
             "Произошла ошибка при создании заказа или синхронизации с Планфиксом. Пожалуйста, попробуйте снова.",
             reply_markup=markup_kb.back_keyboard(user_id=telegram_id)
@@ -330,6 +245,17 @@ async def create_order_and_sync_with_planfix(telegram_id: int, phone_number: str
         await state.clear()
         return [error_message]
 
+    # Подтверждаем заказ только после того, как он сохранён вместе с записью очереди Planfix
+    logger.info(f"Отправка сообщения пользователю: {message_text}")
+    order_message = await message_obj.answer(
+        message_text,
+        reply_markup=markup_kb.back_keyboard(user_id=telegram_id)
+    )
+    messages.append(order_message)
+    logger.info("Сообщение успешно отправлено пользователю")
+    planfix_message = await message_obj.answer("Заказ передаётся в Планфикс, мы сообщим, когда он будет создан.")
+    messages.append(planfix_message)
+
     # Сбрасываем состояние после успешной обработки
     logger.info("Сброс состояния FSM")
     await state.clear()
@@ -355,7 +281,7 @@ async def request_phone_before_order(callback_query: types.CallbackQuery, state:
         return result
 
     # Проверяем, есть ли номер телефона в базе данных
-    user_info = await UserDAO.find_one_or_none(telegram_id=telegram_id)
+    user_info = await UserDAO.get_profile(telegram_id)
     if user_info and user_info.phone_number:
         # Если номер телефона есть, спрашиваем пользователя, подтверждает ли он его использование
         phone_number = user_info.phone_number
@@ -387,7 +313,7 @@ async def request_phone_before_order(callback_query: types.CallbackQuery, state:
 
 # Обработчик подтверждения номера телефона
 @order_router.callback_query(F.data.startswith('confirm_phone'), OrderStates.confirm_phone)
-async def process_phone_confirmation(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_phone_confirmation(callback_query: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     logger.info(f"Вызван process_phone_confirmation для callback_data={callback_query.data}")
     confirmation = callback_query.data.split('_')[-1]  # "yes" или "no"
 
@@ -402,7 +328,8 @@ async def process_phone_confirmation(callback_query: types.CallbackQuery, state:
             telegram_id=telegram_id,
             phone_number=phone_number,
             message_obj=callback_query.message,
-            state=state
+            state=state,
+            session=session
         )
         await callback_query.answer()
         return result
@@ -420,7 +347,7 @@ async def process_phone_confirmation(callback_query: types.CallbackQuery, state:
 
 # Обработчик получения текстового сообщения с номером телефона
 @order_router.message(OrderStates.waiting_for_phone)
-async def process_manual_phone_input(message: types.Message, state: FSMContext):
+async def process_manual_phone_input(message: types.Message, state: FSMContext, session: AsyncSession):
     phone_number = message.text.strip()
 
     # Проверяем формат номера телефона с помощью регулярного выражения
@@ -435,15 +362,17 @@ async def process_manual_phone_input(message: types.Message, state: FSMContext):
 
     try:
         # Проверяем, есть ли пользователь в базе
-        user_info = await UserDAO.find_one_or_none(telegram_id=telegram_id)
+        user_info = await UserDAO.get_profile(telegram_id)
 
         if user_info:
             await UserDAO.update(
                 {"telegram_id": telegram_id},
+                session=session,
                 phone_number=phone_number
             )
         else:
             await UserDAO.add(
+                session=session,
                 telegram_id=telegram_id,
                 username=message.from_user.username,
                 first_name=message.from_user.first_name,
@@ -456,7 +385,8 @@ async def process_manual_phone_input(message: types.Message, state: FSMContext):
             telegram_id=telegram_id,
             phone_number=phone_number,
             message_obj=message,
-            state=state
+            state=state,
+            session=session
         )
         return result
 
@@ -60,20 +60,23 @@ async def send_search_button(message: Message):
 @search_router.inline_query()
 async def inline_query_handler(inline_query: InlineQuery, state: FSMContext):
     query_text = inline_query.query.strip()
-    offset = int(inline_query.offset) if inline_query.offset else 0
+    # offset инлайн-запроса — курсор keyset-пагинации, выданный в next_offset предыдущей страницы
+    cursor = inline_query.offset or ""
 
     # Поиск через ModelDAO
     if query_text == "":
         # Подгрузка всех моделей постранично
-        models = await ModelDAO.search_models(query="", offset=offset, limit=RESULTS_PER_PAGE)
+        models, next_cursor = await ModelDAO.search_models(query="", cursor=cursor, limit=RESULTS_PER_PAGE)
         logger.info(f"ModelDAO (пустой запрос): Найдено моделей: {len(models)}")
     else:
         # Полнотекстовый поиск с кэшированием
-        models = await get_cached_search_results(query_text)
-        if models is None:
-            models = await ModelDAO.search_models(query=query_text, offset=offset, limit=RESULTS_PER_PAGE)
+        cached = await get_cached_search_results(query_text, cursor)
+        if cached is None:
+            models, next_cursor = await ModelDAO.search_models(query=query_text, cursor=cursor, limit=RESULTS_PER_PAGE)
             if models:
-                await cache_search_results(query_text, models)
+                await cache_search_results(query_text, models, cursor=cursor, next_cursor=next_cursor)
+        else:
+            models, next_cursor = cached
         logger.info(f"ModelDAO (поиск): Найдено моделей: {len(models)}")
 
     if not models:
@@ -85,7 +88,7 @@ async def inline_query_handler(inline_query: InlineQuery, state: FSMContext):
     # Формат для ModelDAO (model_id_int, model_name, model_engineer, model_id)
     results = [
         InlineQueryResultArticle(
-            id=str(offset + index),
+            id=str(model_id_int),
             title=model_name or model_id or "Без названия",
             description=f"Инженер: {model_engineer or 'не указан'} | ID: {model_id or 'не указан'}",
             input_message_content=InputTextMessageContent(
@@ -94,16 +97,16 @@ async def inline_query_handler(inline_query: InlineQuery, state: FSMContext):
                              f"ID: {model_id or 'не указан'}"
             )
         )
-        for index, (model_id_int, model_name, model_engineer, model_id) in enumerate(models)
+        for model_id_int, model_name, model_engineer, model_id in models
     ]
 
-    # Сохраняем model_id в состояние FSM
-    for _, model_name, _, model_id in models:
-        if model_id:  # Сохраняем только если model_id не None
-            await state.update_data({model_name or model_id: model_id})
+    # Сохраняем model_id в состояние FSM одной записью на страницу
+    model_ids = {model_name or model_id: model_id for _, model_name, _, model_id in models if model_id}
+    if model_ids:
+        await state.update_data(model_ids)
 
     # Поддерживаем пагинацию
-    next_offset = str(offset + RESULTS_PER_PAGE) if len(models) == RESULTS_PER_PAGE else ""
+    next_offset = next_cursor or ""
 
     await inline_query.answer(results, cache_time=1, next_offset=next_offset)
 
@@ -0,0 +1,276 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Optional
+from loguru import logger
+
+from bot.config import (stock_sync_enabled, stock_sync_interval, stock_full_sync_interval, stock_id_sync_interval,
+                        stock_mirror_max_staleness)
+from bot.planfix_client import planfix_client, PlanfixError, TASKS
+from bot.stocks.dao import StockTaskDAO, SyncStateDAO
+
+# Зеркалируемые фильтры Planfix и поля, которые по ним запрашиваются.
+# Набор полей — объединение полей всех функций bot/planfix.py, работающих с фильтром.
+MIRRORED_FILTERS = {
+    "104384": "id,5556,12142,12116,5542,6640,6282,12140,6274,5666,12110,5534,5532,5512",  # All stock balance
+    "104400": "id,5556,12126,5498",  # All production
+    "104398": "id,5556,5512,12126,5718,5722",  # All stock balance: spare parts
+}
+
+PAGE_SIZE = 100
+
+# Фильтр Planfix по дате последнего изменения задачи (для дельта-синхронизации)
+CHANGED_SINCE_FILTER_TYPE = 12
+
+# Planfix фильтрует по дате с точностью до дня, поэтому дельта берётся с запасом
+CURSOR_OVERLAP = timedelta(days=1)
+
+
+def _ref_id(value: Any) -> Optional[str]:
+    if isinstance(value, dict):
+        value = value.get('id')
+    return str(value) if value not in (None, '') else None
+
+
+def _ref_name(value: Any) -> Optional[str]:
+    if isinstance(value, dict):
+        return value.get('value')
+    return value
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def task_to_row(filter_id: str, task: dict) -> dict:
+    """
+    Переводит задачу Planfix в строку таблицы stock_tasks.
+    """
+    row = {
+        "filter_id": filter_id,
+        "task_pf_id": task['id'],
+        "model_pf_id": None,
+        "operation": None,
+        "product_name": None,
+        "device": None,
+        "brand": None,
+        "stock_balance": None,
+        "price": None,
+        "data": task,
+        "synced_at": datetime.utcnow(),
+    }
+    for custom_field in task.get('customFieldData', []):
+        field_id = custom_field.get('field', {}).get('id')
+        value = custom_field.get('value')
+        if value is None:
+            continue
+        if field_id == 5556:  # Модель
+            row["model_pf_id"] = _ref_id(value)
+        elif field_id == 12142:  # Операция
+            row["operation"] = _ref_id(value)
+        elif field_id in (5542, 5512):  # Наименование / Запчасть
+            row["product_name"] = row["product_name"] or _ref_name(value)
+        elif field_id == 6640:  # Устройство
+            row["device"] = _ref_name(value)
+        elif field_id == 6282:  # Бренд
+            row["brand"] = _ref_name(value)
+        elif field_id in (12116, 5722):  # Остаток / Св. остаток
+            row["stock_balance"] = _to_int(value)
+        elif field_id in (12140, 12126, 5718):  # Цена
+            row["price"] = row["price"] if row["price"] is not None else _to_int(value)
+    return row
+
+
+class StockMirror:
+    """
+    Фоновая синхронизация задач остатков Planfix в локальную таблицу stock_tasks.
+
+    Каждые STOCK_SYNC_INTERVAL секунд забираются задачи, изменённые после курсора.
+    Дельта не видит задач, выбывших из фильтра, поэтому раз в STOCK_ID_SYNC_INTERVAL
+    состав фильтра сверяется по id, а раз в STOCK_FULL_SYNC_INTERVAL выполняется полная
+    сверка всех полей. Возраст зеркала (last_sync_at) отсчитывается от последней сверки
+    состава; зеркало считается свежим, пока он не больше STOCK_MIRROR_MAX_STALENESS, а
+    полная сверка не старше STOCK_FULL_SYNC_INTERVAL + STOCK_MIRROR_MAX_STALENESS.
+    Если синхронизация в процессе отключена (STOCK_SYNC_ENABLED=false), состояние
+    зеркала периодически перечитывается из sync_states, которое ведёт другая реплика.
+    """
+
+    def __init__(self, sync_enabled: bool, sync_interval: int, full_sync_interval: int, id_sync_interval: int,
+                 max_staleness: int):
+        self.sync_enabled = sync_enabled
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.id_sync_interval = id_sync_interval
+        self.max_staleness = max_staleness
+        self._cursor: dict[str, datetime] = {}
+        self._last_sync: dict[str, datetime] = {}
+        self._last_full_sync: dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _state_name(filter_id: str) -> str:
+        return f"stock_tasks:{filter_id}"
+
+    def staleness(self, filter_id: str) -> Optional[float]:
+        """
+        Возвращает возраст зеркала фильтра в секундах или None, если синхронизации ещё не было.
+        """
+        last_sync = self._last_sync.get(filter_id)
+        if last_sync is None or filter_id not in self._last_full_sync:
+            return None
+        return (datetime.utcnow() - last_sync).total_seconds()
+
+    def is_fresh(self, filter_id: str) -> bool:
+        staleness = self.staleness(filter_id)
+        if staleness is None or staleness > self.max_staleness:
+            return False
+        # Если полная сверка давно не проходит, дельтам одним не доверяем
+        full_age = (datetime.utcnow() - self._last_full_sync[filter_id]).total_seconds()
+        return full_age <= self.full_sync_interval + self.max_staleness
+
+    def status(self) -> dict:
+        return {
+            filter_id: {
+                "staleness_seconds": self.staleness(filter_id),
+                "fresh": self.is_fresh(filter_id),
+                "last_sync_at": self._last_sync.get(filter_id),
+                "last_full_sync_at": self._last_full_sync.get(filter_id),
+            }
+            for filter_id in MIRRORED_FILTERS
+        }
+
+    async def task_list(self, filter_id: str, model_pf_id: Any = None, operation: Any = None) -> Optional[dict]:
+        """
+        Возвращает задачи фильтра из зеркала в формате ответа Planfix /task/list.
+        Возвращает None, если зеркало устарело и нужно идти в Planfix напрямую.
+        """
+        if not self.is_fresh(filter_id):
+            logger.debug(f"Зеркало фильтра {filter_id} устарело (staleness={self.staleness(filter_id)}), запрос в Planfix")
+            return None
+        try:
+            records = await StockTaskDAO.find_by_filter(filter_id, model_pf_id=model_pf_id, operation=operation)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать зеркало фильтра {filter_id}: {e}")
+            return None
+        return {"result": "success", "tasks": [record.data for record in records]}
+
+    async def _fetch(self, filter_id: str, changed_since: Optional[datetime] = None,
+                     fields: Optional[str] = None) -> list[dict]:
+        filters = []
+        if changed_since is not None:
+            filters.append({
+                "type": CHANGED_SINCE_FILTER_TYPE,
+                "operator": "gt",
+                "value": {"dateType": "otherDate", "dateValue": changed_since.strftime("%d-%m-%Y")}
+            })
+
+        payload = {
+            "filterId": filter_id,
+            "filters": filters,
+            "fields": fields or MIRRORED_FILTERS[filter_id]
+        }
+        return [task async for task in planfix_client.paginate("/task/list", payload, TASKS, page_size=PAGE_SIZE)]
+
+    async def sync_filter(self, filter_id: str, full: bool = False, reconcile: bool = True):
+        started_at = datetime.utcnow()
+        cursor = None if full else self._cursor.get(filter_id)
+        changed_since = cursor - CURSOR_OVERLAP if cursor else None
+
+        tasks = await self._fetch(filter_id, changed_since=changed_since)
+        # Задача может попасть на две страницы, если список сдвинулся во время обхода
+        tasks = list({task['id']: task for task in tasks}.values())
+        await StockTaskDAO.upsert_tasks([task_to_row(filter_id, task) for task in tasks])
+
+        current_ids = None
+        if changed_since is None:
+            current_ids = [task['id'] for task in tasks]
+        elif reconcile:
+            # Дельта не возвращает задачи, выбывшие из фильтра: сверяем состав по id
+            current_ids = [task['id'] for task in await self._fetch(filter_id, fields="id")]
+            # Задачи дельты в фильтре есть: если их нет в списке, он неполный, удалять по нему нельзя
+            not_listed = {task['id'] for task in tasks} - set(current_ids)
+            if not_listed:
+                raise PlanfixError(f"Список id фильтра {filter_id} неполный: нет {len(not_listed)} задач дельты")
+        if current_ids is not None:
+            await StockTaskDAO.delete_missing(filter_id, current_ids)
+
+        state = {"cursor": started_at}
+        if current_ids is not None:
+            state["last_sync_at"] = started_at
+        if changed_since is None:
+            state["last_full_sync_at"] = started_at
+        await SyncStateDAO.save_state(self._state_name(filter_id), **state)
+
+        self._cursor[filter_id] = started_at
+        if current_ids is not None:
+            self._last_sync[filter_id] = started_at
+        if changed_since is None:
+            self._last_full_sync[filter_id] = started_at
+        mode = "полная" if changed_since is None else "дельта со сверкой id" if reconcile else "дельта"
+        logger.info(f"Синхронизация зеркала {filter_id} ({mode}): {len(tasks)} задач за "
+                    f"{(datetime.utcnow() - started_at).total_seconds():.2f} с")
+
+    @staticmethod
+    def _due(last: Optional[datetime], interval: int) -> bool:
+        return last is None or (datetime.utcnow() - last).total_seconds() >= interval
+
+    async def load_state(self):
+        for filter_id in MIRRORED_FILTERS:
+            state = await SyncStateDAO.find_one_or_none(name=self._state_name(filter_id))
+            if state is None:
+                continue
+            if state.cursor:
+                self._cursor[filter_id] = state.cursor
+            if state.last_sync_at:
+                self._last_sync[filter_id] = state.last_sync_at
+            if state.last_full_sync_at:
+                self._last_full_sync[filter_id] = state.last_full_sync_at
+
+    async def run(self):
+        try:
+            await self.load_state()
+        except Exception as e:
+            logger.error(f"Не удалось загрузить состояние зеркала остатков: {e}")
+
+        while True:
+            if self.sync_enabled:
+                for filter_id in MIRRORED_FILTERS:
+                    full = self._due(self._last_full_sync.get(filter_id), self.full_sync_interval)
+                    reconcile = self._due(self._last_sync.get(filter_id), self.id_sync_interval)
+                    try:
+                        await self.sync_filter(filter_id, full=full, reconcile=reconcile)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Ошибка синхронизации зеркала фильтра {filter_id}: {e}")
+            else:
+                try:
+                    await self.load_state()
+                except Exception as e:
+                    logger.error(f"Не удалось обновить состояние зеркала остатков: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            logger.info("Синхронизация зеркала остатков Planfix запущена.")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+stock_mirror = StockMirror(
+    sync_enabled=stock_sync_enabled,
+    sync_interval=stock_sync_interval,
+    full_sync_interval=stock_full_sync_interval,
+    id_sync_interval=stock_id_sync_interval,
+    max_staleness=stock_mirror_max_staleness
+)
@@ -0,0 +1,114 @@
+import asyncio
+import hmac
+from typing import Optional
+from aiogram import Bot, Dispatcher, types
+from loguru import logger
+
+from bot.config import bot, dp, telegram_webhook_secret, telegram_webhook_concurrency, telegram_update_dedup_ttl
+from bot.utils.ttl_cache import TTLCache
+
+
+class UpdateIngestor:
+    """
+    Приём обновлений Telegram через webhook.
+
+    Каждое обновление обрабатывается диспетчером в отдельной задаче, одновременно —
+    не больше concurrency; когда все слоты заняты, запрос Telegram ждёт свободного,
+    и доставка новых обновлений притормаживает. Повторно доставленные update_id
+    отбрасываются: в памяти процесса и, если передан redis_client, во всех репликах.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, secret: str, concurrency: int, dedup_ttl: float,
+                 redis_client=None, prefix: str = "tg_update"):
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self.concurrency = max(1, concurrency)
+        self.dedup_ttl = dedup_ttl
+        self.redis = redis_client
+        self.prefix = prefix
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._seen: TTLCache[int, bool] = TTLCache(dedup_ttl, maxsize=100000)
+        self._tasks: set[asyncio.Task] = set()
+        self.received = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.in_progress = 0
+
+    def check_secret(self, token: Optional[str]) -> bool:
+        return bool(self.secret) and hmac.compare_digest(token or "", self.secret)
+
+    async def _is_duplicate(self, update_id: int) -> bool:
+        if self._seen.peek(update_id):
+            return True
+        self._seen.set(update_id, True)
+        if self.redis is None:
+            return False
+        try:
+            # SET NX: первая реплика, получившая обновление, забирает его себе
+            first = await self.redis.set(f"{self.prefix}:{update_id}", 1, nx=True, ex=int(self.dedup_ttl))
+            return not first
+        except Exception as e:
+            logger.error(f"Дедупликация обновлений в Redis недоступна: {e}")
+            return False
+
+    async def feed(self, data: dict):
+        """Принимает тело запроса от Telegram и ставит обновление в обработку."""
+        update = types.Update.model_validate(data, context={"bot": self.bot})
+        self.received += 1
+        if await self._is_duplicate(update.update_id):
+            self.duplicates += 1
+            logger.debug(f"Обновление {update.update_id} уже обработано, пропускаем")
+            return
+        await self._slots.acquire()
+        self.in_progress += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, update: types.Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self.in_progress -= 1
+            self._slots.release()
+
+    async def start(self, base_url: str, path: str):
+        await self.bot.set_webhook(
+            url=base_url.rstrip("/") + path,
+            secret_token=self.secret,
+            allowed_updates=self.dp.resolve_used_update_types(),
+            max_connections=min(self.concurrency, 100),
+        )
+        logger.info(f"Webhook Telegram установлен: {base_url.rstrip('/')}{path}")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Дожидается обрабатываемых обновлений. Webhook не снимается: его используют другие реплики."""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Прервано {len(pending)} необработанных обновлений Telegram")
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "in_progress": self.in_progress,
+            "concurrency": self.concurrency,
+        }
+
+
+def _make_update_ingestor() -> UpdateIngestor:
+    from bot.utils.cache import redis_client
+    return UpdateIngestor(bot, dp, secret=telegram_webhook_secret, concurrency=telegram_webhook_concurrency,
+                          dedup_ttl=telegram_update_dedup_ttl, redis_client=redis_client)
+
+
+update_ingestor = _make_update_ingestor()
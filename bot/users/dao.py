@@ -1,6 +1,103 @@
-from bot.dao.base import BaseDAO
+from typing import Any, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from bot.config import user_cache_ttl, user_cache_size, user_cache_redis
+from bot.dao.base import BaseDAO, after_commit
+from bot.database import async_session_maker
 from bot.users.models import User
+from bot.users.profile_cache import ProfileCache, UserProfile
+
+
+def _make_profile_cache() -> ProfileCache:
+    redis_client = None
+    if user_cache_redis:
+        from bot.utils.cache import redis_client
+    return ProfileCache(ttl=user_cache_ttl, maxsize=user_cache_size, redis_client=redis_client)
 
 
 class UserDAO(BaseDAO):
     model = User
+    profiles = _make_profile_cache()
+
+    @classmethod
+    async def get_profile(cls, telegram_id: Any) -> Optional[UserProfile]:
+        """
+        Профиль пользователя по telegram_id из кэша или из БД (None, если пользователя нет).
+        """
+        async def load() -> Optional[UserProfile]:
+            async with async_session_maker() as session:
+                result = await session.execute(select(cls.model).filter_by(telegram_id=telegram_id))
+                user = result.scalar_one_or_none()
+                return UserProfile.from_user(user) if user else None
+
+        return await cls.profiles.get(telegram_id, load)
+
+    @classmethod
+    async def _invalidate(cls, filter_by: dict, values: dict, session: Optional[AsyncSession] = None):
+        telegram_ids = {filter_by.get("telegram_id"), values.get("telegram_id")} - {None}
+
+        async def invalidate():
+            if "telegram_id" not in filter_by:
+                # Не знаем, каких пользователей коснулось изменение
+                await cls.profiles.clear()
+                return
+            for telegram_id in telegram_ids:
+                await cls.profiles.invalidate(telegram_id)
+
+        await invalidate()
+        if session is not None:
+            # До commit другие запросы ещё читают старую строку и могли снова положить её в кэш
+            after_commit(session, invalidate)
+
+    @classmethod
+    async def add(cls, session: Optional[AsyncSession] = None, **values):
+        try:
+            return await super().add(session=session, **values)
+        finally:
+            await cls._invalidate({"telegram_id": values.get("telegram_id")}, values, session)
+
+    @classmethod
+    async def add_many(cls, instances: list[dict], session: Optional[AsyncSession] = None):
+        try:
+            return await super().add_many(instances, session=session)
+        finally:
+            for values in instances:
+                await cls._invalidate({"telegram_id": values.get("telegram_id")}, values, session)
+
+    @classmethod
+    async def update(cls, filter_by, session: Optional[AsyncSession] = None, **values):
+        try:
+            return await super().update(filter_by, session=session, **values)
+        finally:
+            await cls._invalidate(filter_by, values, session)
+
+    @classmethod
+    async def upsert(cls, unique_fields: list[str], session: Optional[AsyncSession] = None, **values):
+        try:
+            return await super().upsert(unique_fields, session=session, **values)
+        finally:
+            await cls._invalidate({"telegram_id": values.get("telegram_id")}, values, session)
+
+    @classmethod
+    async def upsert_many(cls, rows: list[dict], unique_fields: list[str], session: Optional[AsyncSession] = None,
+                          batch_size: int = 1000) -> list[int]:
+        try:
+            return await super().upsert_many(rows, unique_fields, session=session, batch_size=batch_size)
+        finally:
+            for values in rows:
+                await cls._invalidate({"telegram_id": values.get("telegram_id")}, values, session)
+
+    @classmethod
+    async def delete(cls, delete_all: bool = False, session: Optional[AsyncSession] = None, **filter_by):
+        try:
+            return await super().delete(delete_all, session=session, **filter_by)
+        finally:
+            await cls._invalidate(filter_by, {}, session)
+
+    @classmethod
+    async def bulk_update(cls, records: list[dict[str, Any]], session: Optional[AsyncSession] = None,
+                          batch_size: int = 1000) -> int:
+        try:
+            return await super().bulk_update(records, session=session, batch_size=batch_size)
+        finally:
+            await cls._invalidate({}, {}, session)
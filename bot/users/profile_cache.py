@@ -0,0 +1,115 @@
+import itertools
+import json
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Optional
+from loguru import logger
+
+from bot.utils.ttl_cache import TTLCache
+
+
+@dataclass(slots=True)
+class UserProfile:
+    """Профиль пользователя для горячих путей: пересылки, комментариев в Planfix, заказов"""
+    id: int
+    telegram_id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    phone_number: Optional[str] = None
+    contact_pf_id: Optional[int] = None
+    chat_pf_id: Optional[int] = None
+
+    @classmethod
+    def from_user(cls, user) -> "UserProfile":
+        return cls(**{name: getattr(user, name) for name in cls.__slots__})
+
+
+class ProfileCache:
+    """
+    Кэш профилей пользователей по telegram_id: LRU с TTL в памяти процесса
+    и, если передан redis_client, общий для реплик слой в Redis.
+
+    Отсутствующие пользователи не кэшируются. Инвалидация присваивает ключу новое поколение,
+    поэтому профиль, прочитанный из БД до изменения, не попадёт в кэш после него.
+    Поколения нужны только загрузкам, идущим во время инвалидации, и хранятся ttl секунд.
+    Локальные кэши других реплик Redis не инвалидирует — они устаревают не дольше ttl.
+    """
+
+    def __init__(self, ttl: float, maxsize: int, redis_client=None, prefix: str = "user_profile"):
+        self.ttl = ttl
+        self.local: TTLCache[str, UserProfile] = TTLCache(ttl, maxsize=maxsize)
+        self.redis = redis_client
+        self.prefix = prefix
+        self._generations: TTLCache[str, int] = TTLCache(max(ttl, 1), maxsize=maxsize)
+        self._next_generation = itertools.count(1)
+        self._epoch = 0  # Увеличивается при полной очистке
+        self.redis_hits = 0
+        self.loads = 0
+
+    @staticmethod
+    def _key(telegram_id: Any) -> str:
+        return str(telegram_id)
+
+    def _generation(self, key: str) -> tuple[int, int]:
+        return self._epoch, self._generations.peek(key) or 0
+
+    async def get(self, telegram_id: Any, load: Callable[[], Awaitable[Optional[UserProfile]]]) -> Optional[UserProfile]:
+        key = self._key(telegram_id)
+        if self.ttl <= 0:
+            return await load()
+        profile = self.local.get(key)
+        if profile is not None:
+            return profile
+
+        generation = self._generation(key)
+        if self.redis is not None:
+            try:
+                cached = await self.redis.get(f"{self.prefix}:{key}")
+            except Exception as e:
+                logger.error(f"Кэш профилей в Redis недоступен: {e}")
+                cached = None
+            if cached:
+                self.redis_hits += 1
+                profile = UserProfile(**json.loads(cached))
+                if self._generation(key) == generation:
+                    self.local.set(key, profile)
+                return profile
+
+        self.loads += 1
+        profile = await load()
+        if profile is not None and self._generation(key) == generation:
+            self.local.set(key, profile)
+            if self.redis is not None:
+                try:
+                    await self.redis.setex(f"{self.prefix}:{key}", int(self.ttl), json.dumps(asdict(profile)))
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить профиль {key} в Redis: {e}")
+        return profile
+
+    async def invalidate(self, telegram_id: Any):
+        key = self._key(telegram_id)
+        self._generations.set(key, next(self._next_generation))
+        self.local.invalidate(key)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(f"{self.prefix}:{key}")
+            except Exception as e:
+                logger.error(f"Не удалось удалить профиль {key} из Redis: {e}")
+
+    async def clear(self):
+        """Сбрасывает все профили (изменение без telegram_id в фильтре)."""
+        self._epoch += 1
+        self._generations.clear()
+        self.local.clear()
+        if self.redis is not None:
+            try:
+                keys = [key async for key in self.redis.scan_iter(match=f"{self.prefix}:*")]
+                if keys:
+                    await self.redis.delete(*keys)
+            except Exception as e:
+                logger.error(f"Не удалось очистить кэш профилей в Redis: {e}")
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        stats.update({"redis": self.redis is not None, "redis_hits": self.redis_hits, "db_loads": self.loads})
+        return stats
@@ -12,7 +12,7 @@ user_router = Router()
 async def cmd_start(message: Message, command: CommandObject):
     try:
         user_id = message.from_user.id
-        user_info = await UserDAO.find_one_or_none(telegram_id=user_id)
+        user_info = await UserDAO.get_profile(user_id)
 
         # Если пользователь уже есть в базе, проверяем наличие chat_pf_id
         if user_info:
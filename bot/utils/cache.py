@@ -1,5 +1,5 @@
 import json
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import redis.asyncio as redis
 from loguru import logger
 from bot.config import db_host
@@ -8,27 +8,29 @@ redis_client = redis.Redis(
     host=db_host, port=6379, db=0, decode_responses=True
 )
 
-async def cache_search_results(query: str, results: List[Tuple[int, str, str, str]], ttl: int = 3600):
+async def cache_search_results(query: str, results: List[Tuple[int, str, str, str]], ttl: int = 3600,
+                               cursor: str = "", next_cursor: Optional[str] = None):
     """
-    Кэшировать результаты поиска в Redis.
+    Кэшировать страницу результатов поиска (после cursor) и курсор следующей страницы в Redis.
     """
-    cache_key = f"search:{query.lower()}"
+    cache_key = f"search:{query.lower()}:{cursor}"
     try:
-        await redis_client.setex(cache_key, ttl, json.dumps(results))
+        await redis_client.setex(cache_key, ttl, json.dumps([results, next_cursor]))
         logger.info(f"Результаты поиска для '{query}' закэшированы")
     except Exception as e:
         logger.error(f"Ошибка при кэшировании результатов для '{query}': {e}")
 
-async def get_cached_search_results(query: str) -> List[Tuple[int, str, str, str]] | None:
+async def get_cached_search_results(query: str, cursor: str = "") -> Tuple[List[Tuple[int, str, str, str]], Optional[str]] | None:
     """
-    Получить результаты поиска из кэша.
+    Получить страницу результатов поиска и курсор следующей страницы из кэша.
     """
-    cache_key = f"search:{query.lower()}"
+    cache_key = f"search:{query.lower()}:{cursor}"
     try:
         cached = await redis_client.get(cache_key)
         if cached:
             logger.info(f"Результаты поиска для '{query}' найдены в кэше")
-            return json.loads(cached)
+            results, next_cursor = json.loads(cached)
+            return results, next_cursor
         return None
     except Exception as e:
         logger.error(f"Ошибка при получении кэша для '{query}': {e}")
@@ -0,0 +1,90 @@
+import time
+from collections import deque
+from typing import Optional
+from loguru import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для одного эндпоинта внешнего API.
+
+    В закрытом состоянии учитывает исходы последних window вызовов; если доля ошибок
+    и медленных (дольше slow_call_latency) вызовов достигает failure_rate при не менее
+    чем min_calls вызовах, размыкается. В разомкнутом состоянии вызовы сразу отклоняются.
+    Через reset_timeout пропускается один пробный вызов (half-open): успех замыкает
+    предохранитель, ошибка снова размыкает его.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, window: int = 20, min_calls: int = 5,
+                 slow_call_latency: float = 10.0, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_latency = slow_call_latency
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._outcomes: deque[bool] = deque(maxlen=window)  # True — ошибка или медленный вызов
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened_count = 0
+        self.rejected_count = 0
+
+    def allow(self) -> bool:
+        """Можно ли выполнять вызов сейчас."""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+            logger.info(f"Предохранитель {self.name}: пробный вызов (half-open)")
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected_count += 1
+        return False
+
+    def record_success(self, latency: Optional[float] = None):
+        if latency is not None and latency > self.slow_call_latency:
+            self.record_failure()
+            return
+        if self.state == HALF_OPEN:
+            logger.info(f"Предохранитель {self.name} замкнут: Planfix снова отвечает")
+            self.state = CLOSED
+            self._outcomes.clear()
+        self._probe_in_flight = False
+        self._outcomes.append(False)
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(True)
+        if self.state == CLOSED and len(self._outcomes) >= self.min_calls \
+                and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+            self._open()
+
+    def release(self):
+        """Вызов отменён без исхода: освобождает слот пробного вызова."""
+        self._probe_in_flight = False
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened_count += 1
+        self._outcomes.clear()
+        logger.warning(f"Предохранитель {self.name} разомкнут на {self.reset_timeout} с")
+
+    def stats(self) -> dict:
+        failures = sum(self._outcomes)
+        return {
+            "state": self.state,
+            "failure_rate": round(failures / len(self._outcomes), 4) if self._outcomes else 0.0,
+            "calls_in_window": len(self._outcomes),
+            "opened_count": self.opened_count,
+            "rejected_count": self.rejected_count,
+        }
@@ -0,0 +1,100 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+from loguru import logger
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class CoalescingBuffer(Generic[K, T]):
+    """
+    Склеивает тексты, поступившие по одному ключу в течение window секунд, в один.
+
+    Окно отсчитывается от первого текста в буфере, поэтому задержка не превышает window.
+    Буфер сбрасывается раньше, если в нём max_items текстов или склеенный текст
+    превысил бы max_chars. Сбросы одного ключа выполняются строго по очереди,
+    так что склеенные тексты уходят в flush в порядке поступления.
+    При window <= 0 каждый текст сразу передаётся в flush.
+
+    С join буфер копит произвольные элементы: flush получает join(элементы),
+    а max_chars не учитывается.
+    """
+
+    def __init__(self, flush: Callable[[K, Any], Awaitable[Any]], window: float,
+                 max_items: int, max_chars: Optional[int] = None, separator: str = "\n\n",
+                 join: Optional[Callable[[list[T]], Any]] = None):
+        self._flush = flush
+        self.window = window
+        self.max_items = max(1, max_items)
+        self.max_chars = None if join is not None else max_chars
+        self.separator = separator
+        self._join = join if join is not None else separator.join
+        self._buffers: dict[K, list[T]] = {}
+        self._sizes: dict[K, int] = {}
+        self._timers: dict[K, asyncio.Task] = {}
+        self._locks: dict[K, asyncio.Lock] = {}
+        self._lock_users: dict[K, int] = {}
+        self.added = 0
+        self.flushed = 0
+
+    async def add(self, key: K, item: T):
+        self.added += 1
+        if self.window <= 0:
+            self.flushed += 1
+            await self._flush(key, self._join([item]))
+            return
+        size = len(item) if self.max_chars is not None else 0
+        buffer = self._buffers.get(key)
+        if buffer and (len(buffer) >= self.max_items or (
+                self.max_chars is not None and self._sizes[key] + len(self.separator) + size > self.max_chars)):
+            await self.flush(key)
+        self._buffers.setdefault(key, []).append(item)
+        self._sizes[key] = self._sizes.get(key, -len(self.separator)) + len(self.separator) + size
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: K):
+        await asyncio.sleep(self.window)
+        self._timers.pop(key, None)
+        try:
+            await self.flush(key)
+        except Exception as e:
+            logger.error(f"Ошибка сброса буфера {key}: {e}")
+
+    async def flush(self, key: K):
+        """Немедленно отправляет накопленное по ключу."""
+        timer = self._timers.pop(key, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                items = self._buffers.pop(key, None)
+                self._sizes.pop(key, None)
+                if not items:
+                    return
+                self.flushed += 1
+                await self._flush(key, self._join(items))
+        finally:
+            # Блокировку удаляем, когда её больше никто не ждёт, иначе словарь растёт с каждым ключом
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    async def flush_all(self):
+        """Сбрасывает все буферы (при остановке бота)."""
+        for key in list(self._buffers):
+            try:
+                await self.flush(key)
+            except Exception as e:
+                logger.error(f"Ошибка сброса буфера {key}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "buffered_keys": len(self._buffers),
+            "added": self.added,
+            "flushed": self.flushed,
+            "coalescing_ratio": round(self.added / self.flushed, 2) if self.flushed else None,
+        }
@@ -0,0 +1,24 @@
+import base64
+import json
+from typing import Any, Optional
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Непрозрачный курсор keyset-пагинации: ключ сортировки последней записи страницы.
+    Короткий, чтобы помещаться в next_offset инлайн-запроса (до 64 байт).
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """Ключ из курсора или None для первой страницы (пустой или испорченный курсор)."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return tuple(values) if isinstance(values, list) else None
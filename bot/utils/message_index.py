@@ -0,0 +1,74 @@
+import json
+from dataclasses import dataclass, asdict
+from typing import Optional
+from loguru import logger
+
+from bot.utils.ttl_cache import TTLCache
+
+
+@dataclass(slots=True)
+class MessageOwner:
+    """Кому принадлежит сообщение, пересланное в группу операторов"""
+    telegram_id: int
+    chat_pf_id: Optional[int] = None
+
+
+class MessageIndex:
+    """
+    Индекс message_id в группе -> владелец сообщения с TTL.
+
+    Записи хранятся в памяти процесса и, если передан redis_client, в Redis
+    (ключ на сообщение с тем же TTL), поэтому индекс переживает перезапуск бота
+    и общий для реплик. При недоступности Redis работает только память.
+    """
+
+    def __init__(self, chat_id: int, ttl: float, maxsize: int = 100000, redis_client=None,
+                 prefix: str = "group_msg"):
+        self.chat_id = chat_id
+        self.ttl = ttl
+        self.local: TTLCache[int, MessageOwner] = TTLCache(ttl, maxsize=maxsize)
+        self.redis = redis_client
+        self.prefix = prefix
+        self.redis_hits = 0
+        self.not_found = 0
+
+    def _key(self, message_id: int) -> str:
+        return f"{self.prefix}:{self.chat_id}:{message_id}"
+
+    async def set_many(self, message_ids: list[int], owner: MessageOwner):
+        for message_id in message_ids:
+            self.local.set(message_id, owner)
+        if self.redis is None or not message_ids:
+            return
+        value = json.dumps(asdict(owner))
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for message_id in message_ids:
+                    pipe.setex(self._key(message_id), int(self.ttl), value)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить индекс сообщений группы в Redis: {e}")
+
+    async def get(self, message_id: int) -> Optional[MessageOwner]:
+        owner = self.local.get(message_id)
+        if owner is not None or self.redis is None:
+            if owner is None:
+                self.not_found += 1
+            return owner
+        try:
+            cached = await self.redis.get(self._key(message_id))
+        except Exception as e:
+            logger.error(f"Индекс сообщений группы в Redis недоступен: {e}")
+            cached = None
+        if not cached:
+            self.not_found += 1
+            return None
+        self.redis_hits += 1
+        owner = MessageOwner(**json.loads(cached))
+        self.local.set(message_id, owner)
+        return owner
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        stats.update({"redis": self.redis is not None, "redis_hits": self.redis_hits, "not_found": self.not_found})
+        return stats
@@ -1,5 +1,6 @@
 from loguru import logger
 import re
+from bot.planfix_schema import PRICE_BALANCE, first
 
 
 def extract_price_from_data(data):
@@ -8,12 +9,7 @@ def extract_price_from_data(data):
     Возвращает None, если цена не найдена.
     """
     try:
-        tasks = data.get("tasks", [])
-        for task in tasks:
-            for field_data in task.get("customFieldData", []):
-                field_name = field_data.get("field", {}).get("name", "")
-                if field_name == "Цена, RUB":
-                    return field_data.get("stringValue") or str(field_data.get("value", ""))
+        return first(PRICE_BALANCE.decode_all(data), "price")
     except Exception as e:
         logger.error(f"Ошибка при извлечении цены: {e}")
     return None
@@ -24,17 +20,27 @@ def extract_balance_from_data(data):
     Возвращает None, если баланс не найден.
     """
     try:
-        tasks = data.get("tasks", [])
-        for task in tasks:
-            for field_data in task.get("customFieldData", []):
-                field_name = field_data.get("field", {}).get("name", "")
-                if field_name == "Приход":
-                    return field_data.get("stringValue") or str(field_data.get("value", ""))
+        return first(PRICE_BALANCE.decode_all(data), "balance")
     except Exception as e:
         logger.error(f"Ошибка при извлечении баланса: {e}")
     return None
 
 
+def extract_pricelist_keys(entries):
+    """
+    Собирает ключи прайс-листа (поле 3902 'Прайс-лист') из записей справочника 1442.
+    Пустые и нулевые ключи пропускаются.
+    """
+    keys = []
+    for entry in entries:
+        for field_data in entry.get("customFieldData", []):
+            if field_data.get("field", {}).get("id") == 3902:
+                key = (field_data.get("value") or {}).get("id")
+                if key:
+                    keys.append(key)
+    return keys
+
+
 def strip_html(text: str) -> str:
     clean = re.compile('<.*?>')
     return re.sub(clean, '', text)
\ No newline at end of file
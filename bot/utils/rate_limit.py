@@ -0,0 +1,179 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Optional
+from loguru import logger
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов «ведро токенов» внутри процесса.
+
+    Ведро вмещает capacity токенов и пополняется со скоростью rate токенов в секунду,
+    каждый запрос забирает один токен. Ожидающие обслуживаются по очереди.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PriorityTokenBucket:
+    """
+    Ведро токенов с приоритетами: освободившийся токен получает ожидающий
+    с наименьшим priority, при равных — пришедший раньше.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, priority: int = 0):
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():  # Ожидающий мог быть отменён
+                self._tokens -= 1
+                future.set_result(None)
+
+    def waiting(self) -> dict[int, int]:
+        """Число ожидающих по приоритетам."""
+        counts: dict[int, int] = {}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                counts[priority] = counts.get(priority, 0) + 1
+        return counts
+
+
+# Атомарно пополняет ведро по времени Redis и забирает токен.
+# Возвращает 0, если токен получен, иначе сколько секунд подождать.
+_REDIS_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+if tokens < 1 then
+    return tostring((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return '0'
+"""
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    Ведро токенов в Redis, общее для всех реплик бота.
+    Если Redis недоступен, работает как локальное ведро.
+    """
+
+    def __init__(self, redis_client, key: str, rate: float, capacity: int):
+        super().__init__(rate, capacity)
+        self.key = key
+        self._script = redis_client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self):
+        while True:
+            try:
+                wait = float(await self._script(keys=[self.key], args=[self.rate, self.capacity]))
+            except Exception as e:
+                logger.error(f"Ведро токенов в Redis недоступно, ограничиваем локально: {e}")
+                await super().acquire()
+                return
+            if wait <= 0:
+                return
+            # Небольшой разброс, чтобы реплики не просыпались одновременно
+            await asyncio.sleep(wait * (1 + random.random() * 0.1))
+
+
+class AIMDLimiter:
+    """
+    Адаптивный лимит одновременных запросов (AIMD).
+
+    Пока запросы укладываются в target_latency, лимит растёт примерно на единицу
+    за «окно» запросов. При перегрузке (429/5xx, таймауты, медленные ответы)
+    лимит уменьшается вдвое, но не чаще раза в cooldown секунд.
+    """
+
+    def __init__(self, min_limit: int, max_limit: int, target_latency: float, cooldown: Optional[float] = None):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.target_latency = target_latency
+        self.cooldown = target_latency if cooldown is None else cooldown
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._decreased_at = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        async with self._condition:
+            self.in_flight -= 1
+            if overloaded or (latency is not None and latency > self.target_latency):
+                now = time.monotonic()
+                if now - self._decreased_at >= self.cooldown:
+                    self._decreased_at = now
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    logger.warning(f"Planfix перегружен, лимит одновременных запросов снижен до {int(self.limit)}")
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {"limit": int(self.limit), "in_flight": self.in_flight}
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 10.0) -> float:
+    """Экспоненциальная задержка с полным джиттером для попытки attempt (с нуля)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
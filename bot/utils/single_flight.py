@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import json
+import uuid
+from typing import Any, Awaitable, Callable
+from loguru import logger
+
+# Снимает блокировку, только если она всё ещё принадлежит нашему токену:
+# между GET и DEL блокировка могла истечь и достаться другой реплике.
+_REDIS_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def make_key(endpoint: str, payload: Any = None) -> str:
+    """
+    Ключ запроса: эндпоинт + нормализованное тело (порядок ключей не важен).
+    """
+    normalized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+    return f"{endpoint}:{digest}"
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы внутри процесса.
+
+    Первый вызов с ключом запускает запрос, остальные ждут его же результат.
+    Запрос выполняется отдельной задачей, поэтому отмена одного из ожидающих
+    не отменяет запрос для остальных. Результат общий — не изменяйте его.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.stats = {"leaders": 0, "shared": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["shared"] += 1
+            logger.debug(f"Запрос {key} уже выполняется, ждём общий результат")
+        else:
+            self.stats["leaders"] += 1
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        return await fn()
+
+
+class RedisSingleFlight(SingleFlight):
+    """
+    Объединение одинаковых запросов между несколькими репликами бота через Redis.
+
+    Внутри процесса запросы объединяются как в SingleFlight. Между процессами
+    лидер берёт блокировку SET NX со своим токеном; реплики, заставшие блокировку,
+    ждут результат под ключом этого токена не дольше wait_timeout и после этого
+    выполняют запрос сами. Объединяются только запросы, пришедшие, пока лидер
+    выполняется: результат не кэшируется — он живёт handoff_ttl секунд, чтобы
+    ожидающие успели его забрать, и удаляется последним из них. Результат должен
+    сериализоваться в JSON.
+    """
+
+    def __init__(self, redis_client, prefix: str = "singleflight", lock_ttl: float = 30.0,
+                 handoff_ttl: float = 1.0, wait_timeout: float = 30.0, poll_interval: float = 0.05):
+        super().__init__()
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.handoff_ttl = max(handoff_ttl, poll_interval * 4)
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._release_lock = redis_client.register_script(_REDIS_RELEASE_LOCK_SCRIPT)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        lock_key = f"{self.prefix}:lock:{key}"
+        token = uuid.uuid4().hex
+
+        try:
+            acquired = await self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+            leader_token = token if acquired else await self.redis.get(lock_key)
+            if not acquired and leader_token is not None:
+                # Отмечаемся до публикации результата, чтобы лидер не удалил его раньше нас
+                await self.redis.incr(self._waiters_key(leader_token))
+                await self.redis.pexpire(self._waiters_key(leader_token), int(self.lock_ttl * 1000))
+        except Exception as e:
+            logger.error(f"Redis недоступен для объединения запросов, выполняем {key} локально: {e}")
+            return await fn()
+
+        if acquired:
+            try:
+                result = await fn()
+                try:
+                    await self.redis.set(self._result_key(token), json.dumps(result, ensure_ascii=False),
+                                         px=int(self.handoff_ttl * 1000))
+                except (TypeError, ValueError) as e:
+                    logger.warning(f"Результат {key} не сериализуется в JSON, не публикуем: {e}")
+                except Exception as e:
+                    logger.error(f"Не удалось опубликовать результат {key} в Redis: {e}")
+                return result
+            finally:
+                try:
+                    await self._release_lock(keys=[lock_key], args=[token])
+                except Exception as e:
+                    logger.error(f"Не удалось снять блокировку {lock_key}: {e}")
+
+        if leader_token is None:
+            return await fn()  # Лидер завершился между SET NX и GET
+
+        # Запрос уже выполняет другая реплика — ждём её результат
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        try:
+            while loop.time() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                leader_running = await self.redis.get(lock_key) == leader_token
+                cached = await self._take_result(leader_token)
+                if cached is not None:
+                    self.stats["shared"] += 1
+                    return json.loads(cached)
+                if not leader_running:
+                    break  # Лидер завершился без результата (ошибка) — пробуем сами
+        except Exception as e:
+            logger.error(f"Ошибка ожидания результата {key} в Redis: {e}")
+        return await fn()
+
+    def _result_key(self, token) -> str:
+        return f"{self.prefix}:result:{token}"
+
+    def _waiters_key(self, token) -> str:
+        return f"{self.prefix}:waiters:{token}"
+
+    async def _take_result(self, token) -> Any:
+        """Читает результат лидера; последний из ожидающих удаляет его."""
+        cached = await self.redis.get(self._result_key(token))
+        if cached is not None and await self.redis.decr(self._waiters_key(token)) <= 0:
+            await self.redis.delete(self._result_key(token), self._waiters_key(token))
+        return cached
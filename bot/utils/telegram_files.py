@@ -0,0 +1,59 @@
+import asyncio
+from typing import AsyncIterator, Optional
+from aiogram import Bot
+from loguru import logger
+
+from bot.config import pf_upload_concurrency
+from bot.planfix import upload_file_to_planfix
+
+CHUNK_SIZE = 64 * 1024
+
+
+async def open_telegram_file(bot: Bot, file_id: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Возвращает поток частей файла Telegram (не более chunk_size байт каждая).
+    Путь к файлу запрашивается сразу, чтобы ошибка getFile не прерывала уже начатую загрузку.
+    """
+    file = await bot.get_file(file_id)
+
+    async def stream() -> AsyncIterator[bytes]:
+        if bot.session.api.is_local:
+            # Локальный Bot API сервер отдаёт файл с диска
+            buffer = await bot.download_file(file.file_path, chunk_size=chunk_size)
+            yield buffer.getvalue()
+            return
+        url = bot.session.api.file_url(bot.token, file.file_path)
+        async for chunk in bot.session.stream_content(url=url, chunk_size=chunk_size, raise_for_status=True):
+            yield chunk
+
+    return stream()
+
+
+async def transfer_file_to_planfix(bot: Bot, file_id: str, filename: str) -> Optional[int]:
+    """
+    Передаёт файл из Telegram в Planfix потоком, не загружая его целиком в память.
+    Возвращает fileId в Planfix или None.
+    """
+    try:
+        stream = await open_telegram_file(bot, file_id)
+    except Exception as e:
+        logger.error(f"Ошибка при получении файла {file_id} из Telegram: {e}")
+        return None
+    return await upload_file_to_planfix(stream, filename=filename)
+
+
+async def transfer_files_to_planfix(bot: Bot, file_ids: list[str], filename_prefix: str = "photo",
+                                    concurrency: int = pf_upload_concurrency) -> list[Optional[int]]:
+    """
+    Передаёт файлы из Telegram в Planfix параллельно, не более concurrency одновременно.
+
+    Returns:
+        list[int | None]: fileId в Planfix для каждого файла в исходном порядке (None — ошибка).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def transfer(i: int, file_id: str) -> Optional[int]:
+        async with semaphore:
+            return await transfer_file_to_planfix(bot, file_id, filename=f"{filename_prefix}_{i+1}.jpg")
+
+    return list(await asyncio.gather(*(transfer(i, file_id) for i, file_id in enumerate(file_ids))))
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from loguru import logger
+
+from bot.utils.rate_limit import PriorityTokenBucket, TokenBucket
+
+# Приоритетные полосы: ответы пользователям обгоняют зеркалирование в группу
+USER_LANE = 0
+MIRROR_LANE = 1
+
+# Явно заданная полоса для отправок из текущей задачи (иначе определяется по чату)
+send_lane: ContextVar[Optional[int]] = ContextVar("send_lane", default=None)
+
+
+@contextmanager
+def lane(priority: int):
+    """Отправки внутри блока идут в полосе priority."""
+    token = send_lane.set(priority)
+    try:
+        yield
+    finally:
+        send_lane.reset(token)
+
+
+# Методы Send*, которые не создают сообщений в чате и не расходуют лимит
+_NOT_MESSAGES = ("SendChatAction",)
+
+
+def _is_send(method: TelegramMethod) -> bool:
+    name = type(method).__name__
+    return (name.startswith(("Send", "Forward", "Copy")) and name not in _NOT_MESSAGES
+            and getattr(method, "chat_id", None) is not None)
+
+
+def _cost(method: TelegramMethod) -> int:
+    """Сколько сообщений появится в чате (альбомы и пакетная пересылка — несколько)."""
+    items = getattr(method, "media", None) or getattr(method, "message_ids", None)
+    return len(items) if isinstance(items, list) and items else 1
+
+
+class TelegramSendScheduler(BaseRequestMiddleware):
+    """
+    Планировщик исходящих запросов к Bot API (middleware сессии бота).
+
+    Отправка сообщения берёт токен из ведра чата (личные чаты и группы — со своими
+    лимитами), затем из общего ведра бота в своей приоритетной полосе. На 429 RetryAfter
+    чат ставится на паузу на указанное Telegram время, и запрос повторяется.
+    """
+
+    def __init__(self, global_rate: float, global_burst: int, private_rate: float, private_burst: int,
+                 group_rate: float, group_burst: int, max_retries: int = 3, mirror_chat_ids: tuple = (),
+                 max_chats: int = 10000):
+        self.global_bucket = PriorityTokenBucket(global_rate, global_burst)
+        self.private_rate, self.private_burst = private_rate, private_burst
+        self.group_rate, self.group_burst = group_rate, group_burst
+        self.max_retries = max_retries
+        self.mirror_chat_ids = {str(chat_id) for chat_id in mirror_chat_ids}
+        self.max_chats = max_chats
+        self._chat_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._paused_until: dict[str, float] = {}
+        self.sent = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            is_group = chat_id.startswith("-") or chat_id.startswith("@")
+            bucket = TokenBucket(self.group_rate, self.group_burst) if is_group \
+                else TokenBucket(self.private_rate, self.private_burst)
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _lane(self, chat_id: str) -> int:
+        explicit = send_lane.get()
+        if explicit is not None:
+            return explicit
+        return MIRROR_LANE if chat_id in self.mirror_chat_ids else USER_LANE
+
+    async def _wait_slot(self, chat_id: str, cost: int, priority: int):
+        paused = self._paused_until.get(chat_id, 0) - time.monotonic()
+        if paused > 0:
+            await asyncio.sleep(paused)
+        bucket = self._chat_bucket(chat_id)
+        for _ in range(min(cost, bucket.capacity)):
+            await bucket.acquire()
+        for _ in range(min(cost, self.global_bucket.capacity)):
+            await self.global_bucket.acquire(priority)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        throttled = _is_send(method)
+        chat_id = str(getattr(method, "chat_id", ""))
+        attempt = 0
+        while True:
+            if throttled:
+                await self._wait_slot(chat_id, _cost(method), self._lane(chat_id))
+            try:
+                response = await make_request(bot, method)
+                if throttled:
+                    self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                if chat_id:
+                    now = time.monotonic()
+                    if len(self._paused_until) > self.max_chats:
+                        self._paused_until = {key: until for key, until in self._paused_until.items() if until > now}
+                    self._paused_until[chat_id] = now + e.retry_after
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                attempt += 1
+                logger.warning(f"Telegram RetryAfter {e.retry_after} с для {type(method).__name__} "
+                               f"(чат {chat_id or '-'}), попытка {attempt}")
+                if not throttled:
+                    # Отправки ждут паузу чата в _wait_slot
+                    await asyncio.sleep(e.retry_after)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+            "waiting_by_lane": self.global_bucket.waiting(),
+            "paused_chats": sum(until > now for until in self._paused_until.values()),
+        }
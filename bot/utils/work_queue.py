@@ -0,0 +1,125 @@
+import asyncio
+import zlib
+from typing import Any, Awaitable, Callable, Optional
+from loguru import logger
+
+# Что делать с задачей, если очередь воркера заполнена
+BLOCK = "block"  # Ждать места до put_timeout секунд, затем отбросить задачу
+DROP_NEW = "drop_new"  # Отбросить новую задачу
+DROP_OLD = "drop_old"  # Отбросить самую старую задачу в очереди
+INLINE = "inline"  # Выполнить задачу в вызывающем коде (переполнение выливается на вызывающего)
+
+POLICIES = (BLOCK, DROP_NEW, DROP_OLD, INLINE)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class KeyedWorkPool:
+    """
+    Пул фоновых воркеров с ограниченными очередями.
+
+    Задачи с одним ключом попадают к одному воркеру и выполняются по порядку,
+    задачи с разными ключами — параллельно. Каждая очередь вмещает maxsize задач;
+    при переполнении действует policy (см. POLICIES).
+    """
+
+    def __init__(self, name: str, workers: int, maxsize: int, policy: str = BLOCK, put_timeout: float = 1.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения {policy}, допустимы: {', '.join(POLICIES)}")
+        self.name = name
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.put_timeout = put_timeout
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.inlined = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.maxsize) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        logger.info(f"Пул {self.name}: запущено воркеров — {self.workers}, очередь — {self.maxsize}, политика — {self.policy}.")
+
+    async def _run(self, job: Job):
+        try:
+            await job()
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Пул {self.name}: ошибка фоновой задачи: {e}")
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            try:
+                await self._run(job)
+            finally:
+                queue.task_done()
+
+    async def submit(self, key: Any, job: Job) -> bool:
+        """Ставит задачу в очередь. Возвращает False, если задача отброшена."""
+        self.start()
+        self.submitted += 1
+        queue = self._queues[zlib.crc32(str(key).encode()) % self.workers]
+        try:
+            queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == INLINE:
+            self.inlined += 1
+            await self._run(job)
+            return True
+        if self.policy == DROP_OLD:
+            queue.get_nowait()
+            queue.task_done()
+            queue.put_nowait(job)
+            self.dropped += 1
+            logger.warning(f"Пул {self.name} переполнен: отброшена самая старая задача")
+            return True
+        if self.policy == BLOCK:
+            try:
+                await asyncio.wait_for(queue.put(job), timeout=self.put_timeout)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        self.dropped += 1
+        logger.warning(f"Пул {self.name} переполнен: задача отброшена")
+        return False
+
+    async def stop(self, drain_timeout: Optional[float] = 5.0):
+        """Дожидается выполнения очереди (не дольше drain_timeout) и останавливает воркеры."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Пул {self.name}: очередь не разобрана за {drain_timeout} с, "
+                           f"потеряно задач — {sum(queue.qsize() for queue in self._queues)}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "capacity": self.maxsize * self.workers,
+            "policy": self.policy,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "inlined": self.inlined,
+        }
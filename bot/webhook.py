@@ -9,8 +9,16 @@ from bs4 import BeautifulSoup  # Импортируем BeautifulSoup для у
 from typing import List, Optional
 from pathlib import Path
 
-from bot.config import bot  # Импортируем уже созданный объект bot
-from bot.stocks.dao import OrderDAO, OrderStatusHistoryDAO, CartDAO
+from bot.config import bot, telegram_scheduler, telegram_update_mode, telegram_webhook_path  # Импортируем уже созданный объект bot
+from bot.stocks.dao import OrderDAO, CartDAO
+from bot.stocks.stock_mirror import stock_mirror
+from bot.planfix_cache import price_list_cache
+from bot.planfix_client import planfix_client
+from bot.planfix_outbox import planfix_outbox
+from bot.forwarding import forward_pool, group_mirror
+from bot.users.dao import UserDAO
+from bot.stocks.dao import OutboxDAO
+from bot.telegram_updates import update_ingestor
 
 OPERATION_NAMES = {}
 
@@ -213,6 +221,101 @@ async def root():
     logger.info("Received GET request to root endpoint")
     return {"message": "FastAPI server is running"}
 
+@app.get("/api/v2/stock-mirror/status")
+async def get_stock_mirror_status():
+    """
+    Return staleness of the local Planfix stock mirror per filter.
+    """
+    return {"filters": stock_mirror.status()}
+
+@app.get("/api/v2/planfix/metrics")
+async def get_planfix_metrics():
+    """
+    Return Planfix client metrics: circuit breaker states, concurrency limit, coalescing.
+    """
+    return planfix_client.stats()
+
+@app.get("/api/v2/price-cache/stats")
+async def get_price_cache_stats():
+    """
+    Return hit/miss counters of the Planfix price list cache.
+    """
+    return price_list_cache.stats()
+
+@app.post("/api/v2/price-cache/reload")
+async def reload_price_cache():
+    """
+    Reload the whole Planfix price list directory into the cache.
+    """
+    try:
+        count = await price_list_cache.reload()
+    except Exception as e:
+        logger.error(f"Error reloading price list cache: {e}")
+        raise HTTPException(status_code=502, detail=f"Error reloading price list: {str(e)}")
+    return {"status": "success", "entries": count}
+
+@app.delete("/api/v2/price-cache/entries/{entry_key}")
+async def invalidate_price_cache_entry(entry_key: int):
+    """
+    Drop one price list entry from the cache.
+    """
+    return {"status": "success", "invalidated": price_list_cache.invalidate_entry(entry_key)}
+
+@app.get("/api/v2/outbox/stats")
+async def get_outbox_stats():
+    """
+    Return Planfix write queue depth per status and worker counters.
+    """
+    return await planfix_outbox.stats()
+
+@app.post("/api/v2/outbox/dead/requeue")
+async def requeue_outbox_dead(record_id: Optional[int] = Query(None, description="Dead letter ID, all if omitted")):
+    """
+    Put dead letters back into the Planfix write queue.
+    """
+    requeued = await OutboxDAO.requeue_dead(record_id)
+    planfix_outbox.wake()
+    return {"status": "success", "requeued": requeued}
+
+@app.get("/api/v2/forwarding/stats")
+async def get_forwarding_stats():
+    """
+    Return background chat forwarding queue and group mirror counters.
+    """
+    return {"queue": forward_pool.stats(), "group_mirror": group_mirror.stats()}
+
+@app.get("/api/v2/user-cache/stats")
+async def get_user_cache_stats():
+    """
+    Return hit/miss counters of the user profile cache.
+    """
+    return UserDAO.profiles.stats()
+
+@app.get("/api/v2/telegram/stats")
+async def get_telegram_stats():
+    """
+    Return Telegram outbound scheduler counters: sent, RetryAfter, waiting per lane.
+    """
+    return telegram_scheduler.stats()
+
+@app.get("/api/v2/telegram/updates/stats")
+async def get_telegram_updates_stats():
+    """
+    Return webhook update intake counters: received, duplicates, in progress.
+    """
+    return update_ingestor.stats()
+
+if telegram_update_mode == "webhook":
+    @app.post(telegram_webhook_path)
+    async def telegram_webhook(request: Request):
+        """
+        Receive a Telegram update; processing continues in the background.
+        """
+        if not update_ingestor.check_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+            raise HTTPException(status_code=401, detail="Invalid secret token")
+        await update_ingestor.feed(await request.json())
+        return {"ok": True}
+
 @app.get("/api/v2/orders")
 async def get_orders_v2(telegram_id: int = Query(..., description="Telegram ID of the user")):
     """
@@ -222,8 +325,7 @@ async def get_orders_v2(telegram_id: int = Query(..., description="Telegram ID o
         my_orders = await OrderDAO.find_all(telegram_id=telegram_id)
         orders_data = []
         for order in my_orders:
-            status_history = await OrderStatusHistoryDAO.find_all(order_id=order.id)
-            last_status = sorted(status_history, key=lambda x: x.timestamp, reverse=True)[0].status if status_history else order.status or "Неизвестно"
+            last_status = order.status or "Неизвестно"
             
             order_items = order.items
             grouped_items = {}
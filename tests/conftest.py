@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# bot.config требует настройки бота; для тестов подойдут любые значения
+for _name, _value in {
+    "BOT_TOKEN": "123456:TEST", "PLANFIX_TOKEN": "test", "PLANFIX_URL_REST": "http://planfix.test/rest",
+    "N8N_AIAGENT_WEBHOOK": "http://n8n.test", "TARGET_CHAT_ID": "1", "ADMIN_IDS": "[1]",
+    "API_BASE": "http://api.test", "DB_HOST": "localhost", "DB_PORT": "5432", "DB_NAME": "test",
+    "DB_USER": "test", "DB_PASS": "test",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+import bot.config  # noqa: E402,F401 — добавляет файловые логи, заменяем их выводом в консоль
+from loguru import logger  # noqa: E402
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+
+def pytest_configure(config):
+    # pytest -m db без БД — ошибка, а не молча пропущенные проверки
+    if config.getoption("markexpr") == "db" and not os.getenv("TEST_DATABASE_URL"):
+        raise pytest.UsageError("Для pytest -m db задайте TEST_DATABASE_URL (см. tests/test_dao.py)")
@@ -0,0 +1,78 @@
+import time
+
+from bot.utils.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+def make_breaker(**options) -> CircuitBreaker:
+    params = dict(failure_rate=0.5, window=4, min_calls=4, slow_call_latency=1.0, reset_timeout=0.05)
+    params.update(options)
+    return CircuitBreaker("test", **params)
+
+
+def test_opens_when_failure_rate_reached():
+    breaker = make_breaker()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == CLOSED  # Вызовов меньше min_calls
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.allow() is False
+    assert breaker.stats()["rejected_count"] == 1
+    assert breaker.stats()["opened_count"] == 1
+
+
+def test_stays_closed_below_failure_rate():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow() is True
+
+
+def test_slow_calls_count_as_failures():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_success(latency=2.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = make_breaker(min_calls=1, window=1)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    assert breaker.allow() is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is False  # Пробный вызов уже выполняется
+
+
+def test_successful_probe_closes():
+    breaker = make_breaker(min_calls=1, window=1)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() is True
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() is True
+
+
+def test_failed_probe_reopens():
+    breaker = make_breaker(min_calls=1, window=1)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() is True
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.allow() is False
+    assert breaker.opened_count == 2
+
+
+def test_release_frees_probe_slot():
+    breaker = make_breaker(min_calls=1, window=1)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() is True
+    breaker.release()
+    assert breaker.allow() is True
@@ -0,0 +1,102 @@
+import asyncio
+
+from bot.utils.coalescing_buffer import CoalescingBuffer
+
+
+def make_buffer(sent: list, **options) -> CoalescingBuffer:
+    async def flush(key, text):
+        sent.append((key, text))
+
+    params = dict(window=0.02, max_items=10, max_chars=1000, separator=" | ")
+    params.update(options)
+    return CoalescingBuffer(flush, **params)
+
+
+def test_coalesces_within_window():
+    async def scenario():
+        sent = []
+        buffer = make_buffer(sent)
+        await buffer.add(1, "a")
+        await buffer.add(2, "x")
+        await buffer.add(1, "b")
+        assert sent == []
+        await asyncio.sleep(0.2)
+        return sent, buffer.stats()
+
+    sent, stats = asyncio.run(scenario())
+    assert sorted(sent) == [(1, "a | b"), (2, "x")]
+    assert stats["added"] == 3 and stats["flushed"] == 2 and stats["buffered_keys"] == 0
+
+
+def test_max_items_flushes_early():
+    async def scenario():
+        sent = []
+        buffer = make_buffer(sent, window=10, max_items=2)
+        for text in "abc":
+            await buffer.add(1, text)
+        early = list(sent)
+        await buffer.flush_all()
+        return early, sent
+
+    early, sent = asyncio.run(scenario())
+    assert early == [(1, "a | b")]
+    assert sent == [(1, "a | b"), (1, "c")]
+
+
+def test_max_chars_flushes_early():
+    async def scenario():
+        sent = []
+        buffer = make_buffer(sent, window=10, max_chars=8)
+        await buffer.add(1, "abc")
+        await buffer.add(1, "de")  # "abc | de" — ровно 8 символов
+        await buffer.add(1, "f")
+        await buffer.flush_all()
+        return sent
+
+    assert asyncio.run(scenario()) == [(1, "abc | de"), (1, "f")]
+
+
+def test_no_window_sends_immediately():
+    async def scenario():
+        sent = []
+        buffer = make_buffer(sent, window=0)
+        await buffer.add(1, "a")
+        await buffer.add(1, "b")
+        return sent
+
+    assert asyncio.run(scenario()) == [(1, "a"), (1, "b")]
+
+
+def test_join_collects_items():
+    async def scenario():
+        sent = []
+        buffer = make_buffer(sent, window=10, join=lambda items: sorted(set(items)))
+        for item in (3, 1, 3, 2):
+            await buffer.add("photos", item)
+        await buffer.flush("photos")
+        await buffer.flush("photos")  # Пустой буфер ничего не отправляет
+        return sent
+
+    assert asyncio.run(scenario()) == [("photos", [1, 2, 3])]
+
+
+def test_locks_are_dropped_after_flush():
+    async def scenario():
+        sent = []
+
+        async def slow_flush(key, text):
+            await asyncio.sleep(0.01)
+            sent.append((key, text))
+
+        buffer = CoalescingBuffer(slow_flush, window=10, max_items=10, separator=" | ")
+        for key in range(100):
+            await buffer.add(key, "a")
+        await buffer.add(0, "b")
+        # Конкурентные сбросы одного ключа идут по одной блокировке и по очереди
+        await asyncio.gather(buffer.flush(0), buffer.add(0, "c"), buffer.flush(0))
+        await buffer.flush_all()
+        return sent, buffer._locks, buffer._lock_users
+
+    sent, locks, users = asyncio.run(scenario())
+    assert sent[0] == (0, "a | b") and (0, "c") in sent and len(sent) == 101
+    assert locks == {} and users == {}
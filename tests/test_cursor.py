@@ -0,0 +1,24 @@
+from bot.utils.cursor import encode_cursor, decode_cursor
+
+
+def test_roundtrip():
+    assert decode_cursor(encode_cursor(42)) == (42,)
+    assert decode_cursor(encode_cursor("Apple iPhone 12", 7)) == ("Apple iPhone 12", 7)
+
+
+def test_fits_inline_next_offset():
+    # next_offset инлайн-запроса ограничен 64 байтами
+    assert len(encode_cursor("Samsung Galaxy S23 Ultra", 2147483647).encode()) <= 64
+
+
+def test_first_page_and_broken_cursor():
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+    assert decode_cursor("не курсор") is None
+    assert decode_cursor(encode_cursor()[:-1] + "@") is None
+
+
+def test_non_list_payload():
+    import base64
+    cursor = base64.urlsafe_b64encode(b'{"id": 1}').rstrip(b"=").decode()
+    assert decode_cursor(cursor) is None
@@ -0,0 +1,113 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from bot import planfix_client as client_module
+from bot.planfix_client import PlanfixClient, PlanfixError
+
+
+class ScriptedPlanfix:
+    """Подменяет PlanfixClient._attempt: ответы по одному из очереди или функцией от тела запроса."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls: list[tuple[str, str, dict]] = []
+
+    async def __call__(self, method, path, *, json=None, data=None, timeout=None, raise_for_status=False,
+                       final=True, breaker=None):
+        self.calls.append((method, path, json))
+        result = self.respond(json)
+        if isinstance(result, Exception):
+            if breaker is not None:
+                breaker.record_failure()
+            raise result
+        if breaker is not None:
+            breaker.record_success(0.0)
+        return 200, None, result
+
+
+def make_client(monkeypatch, respond, **options) -> tuple[PlanfixClient, ScriptedPlanfix]:
+    monkeypatch.setattr(client_module, "backoff_delay", lambda attempt, **kwargs: 0)
+    client = PlanfixClient("http://planfix.test/rest", "token", max_retries=1, **options)
+    scripted = ScriptedPlanfix(respond)
+    monkeypatch.setattr(client, "_attempt", scripted)
+    return client, scripted
+
+
+def pages(total: int):
+    def respond(body):
+        offset, size = body["offset"], body["pageSize"]
+        return {"result": "success", "tasks": [{"id": i} for i in range(offset, min(offset + size, total))]}
+    return respond
+
+
+def collect(client: PlanfixClient, **options) -> list:
+    async def run():
+        return [item async for item in client.paginate("/task/list", {"filterId": 1}, "tasks", page_size=10,
+                                                       **options)]
+    return asyncio.run(run())
+
+
+def test_paginate_reads_all_pages(monkeypatch):
+    client, scripted = make_client(monkeypatch, pages(25), prefetch_pages=3)
+    assert [item["id"] for item in collect(client)] == list(range(25))
+    offsets = sorted(body["offset"] for _, _, body in scripted.calls)
+    assert offsets[:3] == [0, 10, 20]
+
+
+def test_paginate_raises_on_error_page(monkeypatch):
+    client, _ = make_client(monkeypatch, lambda body: {"result": "fail", "error": "bad filter"})
+    with pytest.raises(PlanfixError):
+        collect(client)
+
+
+def test_read_is_served_stale_while_planfix_is_down(monkeypatch):
+    state = {"down": False}
+
+    def respond(body):
+        if state["down"]:
+            return aiohttp.ClientConnectionError("connection refused")
+        return {"result": "success", "tasks": [{"id": 1}]}
+
+    client, _ = make_client(monkeypatch, respond)
+
+    async def read():
+        return await client.post("/task/list", json={"filterId": 1}, coalesce=True)
+
+    assert "stale" not in asyncio.run(read())
+    state["down"] = True
+    assert asyncio.run(read()) == {"result": "success", "tasks": [{"id": 1}], "stale": True}
+
+
+def test_paginate_rejects_stale_pages_unless_allowed(monkeypatch):
+    state = {"down": False}
+    respond_pages = pages(5)
+
+    def respond(body):
+        return aiohttp.ClientConnectionError("connection refused") if state["down"] else respond_pages(body)
+
+    client, _ = make_client(monkeypatch, respond)
+    assert len(collect(client)) == 5
+    state["down"] = True
+    with pytest.raises(PlanfixError):
+        collect(client)
+    assert len(collect(client, allow_stale=True)) == 5
+
+
+def test_write_without_guard_is_not_retried(monkeypatch):
+    client, scripted = make_client(monkeypatch, lambda body: asyncio.TimeoutError())
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(client.post("/task/", json={"name": "x"}))
+    assert len(scripted.calls) == 1
+
+
+def test_write_retry_uses_idempotency_guard(monkeypatch):
+    client, scripted = make_client(monkeypatch, lambda body: asyncio.TimeoutError())
+
+    async def guard():
+        return {"result": "success", "id": 7}
+
+    assert asyncio.run(client.post("/task/", json={"name": "x"}, idempotency_guard=guard)) == \
+        {"result": "success", "id": 7}
+    assert len(scripted.calls) == 1  # Повтор не понадобился: запись уже есть
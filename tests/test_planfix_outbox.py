@@ -0,0 +1,135 @@
+import asyncio
+from dataclasses import asdict
+from types import SimpleNamespace
+
+import pytest
+
+from bot import planfix_order as pf_order
+from bot import planfix_outbox
+from bot.planfix_outbox import ORDER, PlanfixOutboxWorkers
+
+
+class FakePlanfix:
+    """Planfix в памяти: задачи, созданные POST /task/…, находятся через /task/list по полю фильтра."""
+
+    def __init__(self, fail_lines: set = frozenset(), lose_responses: bool = False):
+        self.tasks: list[dict] = []
+        self.fail_lines = set(fail_lines)
+        self.lose_responses = lose_responses
+        self.posts: list[str] = []
+
+    @staticmethod
+    def _fields(payload: dict) -> dict:
+        return {item["field"]["id"]: item["value"] for item in payload.get("customFieldData", [])}
+
+    async def post(self, path, json=None, **kwargs):
+        if path == "/task/list":
+            condition = json["filters"][0]
+            found = [task for task in self.tasks if task["fields"].get(condition["field"]) == condition["value"]]
+            return {"result": "success", "tasks": [{"id": task["id"]} for task in found[:1]]}
+        self.posts.append(path)
+        fields = self._fields(json)
+        if fields.get(12114) in self.fail_lines:
+            return {"result": "fail", "error": "Planfix недоступен"}
+        task = {"id": 1000 + len(self.tasks), "fields": fields}
+        self.tasks.append(task)
+        if self.lose_responses:
+            raise asyncio.TimeoutError()
+        return {"result": "success", "id": task["id"]}
+
+
+class FakeOutboxDAO:
+    def __init__(self):
+        self.retried: list[dict] = []
+        self.buried: list[dict] = []
+        self.completed: list[int] = []
+
+    async def retry(self, record_id, error, delay, payload=None):
+        self.retried.append(payload)
+
+    async def bury(self, record_id, error, payload=None):
+        self.buried.append(payload)
+
+    async def complete(self, record_id):
+        self.completed.append(record_id)
+
+
+@pytest.fixture
+def planfix(monkeypatch):
+    fake = FakePlanfix()
+    monkeypatch.setattr(pf_order.planfix_client, "post", fake.post)
+    return fake
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    fake = FakeOutboxDAO()
+    notified = []
+
+    async def notify(payload, text):
+        notified.append(text)
+
+    async def update_order(filter_by, **values):
+        return 1
+
+    monkeypatch.setattr(planfix_outbox, "OutboxDAO", fake)
+    monkeypatch.setattr(planfix_outbox, "_notify_order", notify)
+    monkeypatch.setattr(planfix_outbox.OrderDAO, "update", update_order)
+    fake.notified = notified
+    return fake
+
+
+def order_payload(*operations) -> dict:
+    lines = [
+        pf_order.OrderLine(operation_id=operation, pf_id=10 + index, price=100, quantity=1,
+                           order_item_id=500 + index, touch_or_backlight=1, product_name=f"Позиция {index}")
+        for index, operation in enumerate(operations)
+    ]
+    return {"order_id": 7, "description": "Заказ #7", "telegram_id": 1, "lines": [asdict(line) for line in lines]}
+
+
+def process(payload: dict, attempts: int, kind: str = ORDER):
+    workers = PlanfixOutboxWorkers(workers=1, batch_size=1, poll_interval=1, max_attempts=5,
+                                   lease=60, retry_base=1, retry_cap=10)
+    record = SimpleNamespace(id=1, kind=kind, payload=payload, attempts=attempts)
+    asyncio.run(workers.process(record))
+
+
+def test_failed_line_is_retried_without_resending_sent_lines(planfix, outbox):
+    planfix.fail_lines = {501}
+    process(order_payload(4, 6), attempts=1)
+    saved = outbox.retried[0]
+    assert saved["order_pf_id"] == 1000 and saved["done_item_ids"] == [500]
+
+    planfix.fail_lines = set()
+    process(saved, attempts=2)
+    assert outbox.completed == [1]
+    assert planfix.posts == ["/task/", "/task/1000", "/task/1000", "/task/1000"]
+    assert "Позиции переданы: 2 из 2" in outbox.notified[0]
+
+
+def test_retry_finds_order_and_lines_created_by_lost_attempt(planfix, outbox):
+    # Первая попытка создала заказ в Planfix, но ответ не дошёл и order_pf_id не сохранён
+    planfix.lose_responses = True
+    process(order_payload(4, 6), attempts=1)
+    assert len(planfix.tasks) == 1 and outbox.retried
+    planfix.tasks.append({"id": 2000, "fields": {12114: 500}})  # Позиция тоже успела создаться
+
+    planfix.lose_responses = False
+    planfix.posts.clear()
+    process(order_payload(4, 6), attempts=2)
+    assert planfix.posts == ["/task/1000"]  # Создана только недостающая позиция
+    assert outbox.completed == [1]
+    assert "Позиции переданы: 2 из 2" in outbox.notified[0]
+
+
+def test_line_without_handler_is_skipped(planfix, outbox):
+    process(order_payload(4, 3), attempts=1)
+    assert outbox.completed == [1] and not outbox.retried
+    assert planfix.posts == ["/task/", "/task/1000"]
+    assert "Позиции переданы: 1 из 1" in outbox.notified[0]
+
+
+def test_unknown_kind_goes_to_dead_letters_at_once(outbox):
+    process({"x": 1}, attempts=1, kind="no_such_operation")
+    assert len(outbox.buried) == 1 and not outbox.retried
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from bot.utils.rate_limit import TokenBucket, PriorityTokenBucket, AIMDLimiter, backoff_delay
+
+
+def test_token_bucket_burst_then_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        for _ in range(2):
+            await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(scenario())
+    assert burst < total / 2
+    # Два токена сверх ёмкости пополняются со скоростью 50 в секунду
+    assert total >= 0.035
+
+
+def test_priority_token_bucket_serves_lower_priority_first():
+    async def scenario():
+        bucket = PriorityTokenBucket(rate=100, capacity=1)
+        await bucket.acquire()  # Ведро пусто, дальше все ждут
+        order = []
+
+        async def take(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(take("low", 5)), asyncio.create_task(take("normal", 1))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(take("high", 0)))
+        await asyncio.sleep(0)
+        assert bucket.waiting() == {5: 1, 1: 1, 0: 1}
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["high", "normal", "low"]
+
+
+def test_aimd_halves_on_overload_once_per_cooldown():
+    async def scenario():
+        limiter = AIMDLimiter(min_limit=2, max_limit=16, target_latency=1.0, cooldown=60)
+        for _ in range(2):
+            await limiter.acquire()
+        await limiter.release(overloaded=True)
+        await limiter.release(latency=5.0)  # Медленный ответ в пределах cooldown не снижает повторно
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.stats() == {"limit": 8, "in_flight": 0}
+
+
+def test_aimd_respects_min_limit_and_grows_back():
+    async def scenario():
+        limiter = AIMDLimiter(min_limit=2, max_limit=4, target_latency=1.0, cooldown=0)
+        for _ in range(3):
+            await limiter.acquire()
+            await limiter.release(overloaded=True)
+        shrunk = int(limiter.limit)
+        for _ in range(20):
+            await limiter.acquire()
+            await limiter.release(latency=0.1)
+        return shrunk, int(limiter.limit)
+
+    shrunk, grown = asyncio.run(scenario())
+    assert shrunk == 2
+    assert grown == 4
+
+
+def test_aimd_blocks_at_limit():
+    async def scenario():
+        limiter = AIMDLimiter(min_limit=1, max_limit=1, target_latency=1.0)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        await limiter.release(latency=0.1)
+        await asyncio.wait_for(waiter, 1)
+        return blocked
+
+    assert asyncio.run(scenario()) is True
+
+
+@pytest.mark.parametrize("attempt", [0, 1, 5, 20])
+def test_backoff_delay_bounds(attempt):
+    for _ in range(50):
+        delay = backoff_delay(attempt, base=0.5, cap=10.0)
+        assert 0 <= delay <= min(10.0, 0.5 * 2 ** attempt)
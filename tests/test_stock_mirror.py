@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from bot.planfix_client import PlanfixError, planfix_client
+from bot.stocks import stock_mirror as mirror_module
+from bot.stocks.stock_mirror import StockMirror
+
+FILTER_ID = "104400"
+
+
+class FakePlanfix:
+    """Фильтр Planfix в памяти; down — отвечать сохранёнными страницами, как клиент при недоступности."""
+
+    def __init__(self, task_ids):
+        self.task_ids = list(task_ids)
+        self.down = False
+        self.hide_from_id_list: set = set()
+        self.requests: list[str] = []
+
+    async def post(self, path, json=None, **kwargs):
+        delta = bool(json["filters"])
+        ids_only = json["fields"] == "id"
+        self.requests.append("id" if ids_only else "delta" if delta else "full")
+        ids = [task_id for task_id in self.task_ids if not (ids_only and task_id in self.hide_from_id_list)]
+        page = ids[json["offset"]:json["offset"] + json["pageSize"]]
+        body = {"result": "success", "tasks": [{"id": task_id, "customFieldData": []} for task_id in page]}
+        return {**body, "stale": True} if self.down else body
+
+
+class FakeMirrorTable:
+    def __init__(self):
+        self.rows: dict[int, dict] = {}
+        self.states: dict[str, dict] = {}
+
+    async def upsert_tasks(self, rows):
+        for row in rows:
+            self.rows[row["task_pf_id"]] = row
+
+    async def delete_missing(self, filter_id, keep_task_ids):
+        for task_id in set(self.rows) - set(keep_task_ids):
+            del self.rows[task_id]
+
+    async def save_state(self, name, **values):
+        self.states.setdefault(name, {}).update(values)
+
+
+@pytest.fixture
+def env(monkeypatch):
+    planfix = FakePlanfix([1, 2, 3])
+    table = FakeMirrorTable()
+    monkeypatch.setattr(planfix_client, "post", planfix.post)
+    monkeypatch.setattr(mirror_module.StockTaskDAO, "upsert_tasks", table.upsert_tasks)
+    monkeypatch.setattr(mirror_module.StockTaskDAO, "delete_missing", table.delete_missing)
+    monkeypatch.setattr(mirror_module.SyncStateDAO, "save_state", table.save_state)
+    mirror = StockMirror(sync_enabled=True, sync_interval=60, full_sync_interval=3600, id_sync_interval=300,
+                         max_staleness=600)
+    return mirror, planfix, table
+
+
+def age(mirror: StockMirror, seconds: float):
+    """Сдвигает время последних синхронизаций в прошлое."""
+    for marks in (mirror._last_sync, mirror._last_full_sync):
+        for filter_id in marks:
+            marks[filter_id] -= timedelta(seconds=seconds)
+
+
+def test_full_sync_makes_mirror_fresh(env):
+    mirror, planfix, table = env
+    assert not mirror.is_fresh(FILTER_ID)
+    asyncio.run(mirror.sync_filter(FILTER_ID, full=True))
+    assert sorted(table.rows) == [1, 2, 3]
+    assert mirror.is_fresh(FILTER_ID)
+
+
+def test_reconciliation_removes_tasks_that_left_the_filter(env):
+    mirror, planfix, table = env
+    asyncio.run(mirror.sync_filter(FILTER_ID, full=True))
+    planfix.task_ids = [1, 3]
+    asyncio.run(mirror.sync_filter(FILTER_ID, reconcile=True))
+    assert sorted(table.rows) == [1, 3]
+    assert planfix.requests == ["full", "delta", "id"]
+
+
+def test_delta_without_reconciliation_does_not_refresh_age(env):
+    mirror, planfix, table = env
+    asyncio.run(mirror.sync_filter(FILTER_ID, full=True))
+    age(mirror, 500)
+    planfix.task_ids = [1, 3]
+    asyncio.run(mirror.sync_filter(FILTER_ID, reconcile=False))
+    assert sorted(table.rows) == [1, 2, 3]  # Без сверки удалять нечего
+    assert planfix.requests == ["full", "delta"]
+    assert mirror.staleness(FILTER_ID) >= 500
+
+
+def test_mirror_ages_while_planfix_serves_stale_pages(env):
+    mirror, planfix, table = env
+    asyncio.run(mirror.sync_filter(FILTER_ID, full=True))
+    age(mirror, 700)
+    planfix.down = True
+    planfix.task_ids = [1]
+    with pytest.raises(PlanfixError):
+        asyncio.run(mirror.sync_filter(FILTER_ID, full=True))
+    with pytest.raises(PlanfixError):
+        asyncio.run(mirror.sync_filter(FILTER_ID, reconcile=True))
+    assert sorted(table.rows) == [1, 2, 3]
+    assert not mirror.is_fresh(FILTER_ID)
+    assert mirror.status()[FILTER_ID]["fresh"] is False
+
+
+def test_incomplete_id_list_is_not_used_for_deletion(env):
+    mirror, planfix, table = env
+    asyncio.run(mirror.sync_filter(FILTER_ID, full=True))
+    saved_at = mirror._last_sync[FILTER_ID]
+    planfix.hide_from_id_list = {2, 3}  # Список id оборвался, хотя задачи в фильтре есть
+    with pytest.raises(PlanfixError):
+        asyncio.run(mirror.sync_filter(FILTER_ID, reconcile=True))
+    assert sorted(table.rows) == [1, 2, 3]
+    assert mirror._last_sync[FILTER_ID] == saved_at
+
+
+def test_full_sync_must_be_recent_for_freshness(env):
+    mirror, planfix, table = env
+    asyncio.run(mirror.sync_filter(FILTER_ID, full=True))
+    mirror._last_full_sync[FILTER_ID] = datetime.utcnow() - timedelta(seconds=3600 + 601)
+    assert not mirror.is_fresh(FILTER_ID)
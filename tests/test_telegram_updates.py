@@ -0,0 +1,106 @@
+import asyncio
+
+from bot.config import bot
+from bot.telegram_updates import UpdateIngestor
+
+
+class FakeDispatcher:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.handled: list[int] = []
+        self.running = 0
+        self.max_running = 0
+
+    async def feed_update(self, bot, update):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            self.handled.append(update.update_id)
+        finally:
+            self.running -= 1
+
+
+class FakeRedis:
+    """Общий для реплик Redis: SET NX."""
+
+    def __init__(self, down: bool = False):
+        self.down = down
+        self.keys: set[str] = set()
+
+    async def set(self, key, value, nx=False, ex=None):
+        if self.down:
+            raise ConnectionError("redis down")
+        if nx and key in self.keys:
+            return None
+        self.keys.add(key)
+        return True
+
+
+def make_ingestor(dp, secret="s3cret", concurrency=4, redis_client=None) -> UpdateIngestor:
+    return UpdateIngestor(bot, dp, secret=secret, concurrency=concurrency, dedup_ttl=60, redis_client=redis_client)
+
+
+def test_check_secret():
+    ingestor = make_ingestor(FakeDispatcher())
+    assert ingestor.check_secret("s3cret")
+    assert not ingestor.check_secret("wrong")
+    assert not ingestor.check_secret(None)
+    # Без настроенного секрета webhook не принимает ничего
+    assert not make_ingestor(FakeDispatcher(), secret="").check_secret("")
+
+
+def test_duplicate_updates_are_dropped():
+    async def scenario():
+        dp = FakeDispatcher()
+        ingestor = make_ingestor(dp)
+        for update_id in (1, 2, 1, 3, 2):
+            await ingestor.feed({"update_id": update_id})
+        await ingestor.stop()
+        return dp, ingestor.stats()
+
+    dp, stats = asyncio.run(scenario())
+    assert sorted(dp.handled) == [1, 2, 3]
+    assert stats["received"] == 5 and stats["duplicates"] == 2 and stats["in_progress"] == 0
+
+
+def test_duplicates_are_dropped_across_replicas():
+    async def scenario():
+        redis = FakeRedis()
+        first, second = FakeDispatcher(), FakeDispatcher()
+        replicas = [make_ingestor(first, redis_client=redis), make_ingestor(second, redis_client=redis)]
+        for ingestor in replicas:
+            await ingestor.feed({"update_id": 7})
+        for ingestor in replicas:
+            await ingestor.stop()
+        return first, second, replicas[1].stats()
+
+    first, second, stats = asyncio.run(scenario())
+    assert first.handled == [7] and second.handled == []
+    assert stats["duplicates"] == 1
+
+
+def test_redis_outage_falls_back_to_local_dedup():
+    async def scenario():
+        dp = FakeDispatcher()
+        ingestor = make_ingestor(dp, redis_client=FakeRedis(down=True))
+        for update_id in (1, 1):
+            await ingestor.feed({"update_id": update_id})
+        await ingestor.stop()
+        return dp
+
+    assert asyncio.run(scenario()).handled == [1]
+
+
+def test_concurrency_is_limited():
+    async def scenario():
+        dp = FakeDispatcher(delay=0.02)
+        ingestor = make_ingestor(dp, concurrency=2)
+        for update_id in range(6):
+            await ingestor.feed({"update_id": update_id})
+        await ingestor.stop()
+        return dp
+
+    dp = asyncio.run(scenario())
+    assert sorted(dp.handled) == list(range(6))
+    assert dp.max_running == 2
@@ -0,0 +1,55 @@
+import time
+
+from bot.utils.ttl_cache import TTLCache
+
+
+def test_get_set_and_stats():
+    cache = TTLCache(60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_expiry():
+    cache = TTLCache(60)
+    cache.set("a", 1, ttl=0.01)
+    cache.set("b", 2)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.peek("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_peek_does_not_count():
+    cache = TTLCache(60)
+    cache.set("a", 1)
+    assert cache.peek("a") == 1
+    assert cache.peek("b") is None
+    assert cache.hits == cache.misses == 0
+
+
+def test_lru_eviction():
+    cache = TTLCache(60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" теперь давно не читался
+    cache.set("c", 3)
+    assert cache.peek("b") is None
+    assert cache.peek("a") == 1
+    assert cache.peek("c") == 3
+
+
+def test_invalidate():
+    cache = TTLCache(60)
+    cache.set(("model", 1), 1)
+    cache.set(("model", 2), 2)
+    cache.set(("brand", 1), 3)
+    assert cache.invalidate(("brand", 1)) is True
+    assert cache.invalidate(("brand", 1)) is False
+    assert cache.invalidate_where(lambda key: key[0] == "model") == 2
+    assert len(cache) == 0
+    cache.set("a", 1)
+    cache.clear()
+    assert cache.peek("a") is None
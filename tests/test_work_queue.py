@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from bot.utils.work_queue import KeyedWorkPool, BLOCK, DROP_NEW, DROP_OLD, INLINE
+
+
+def recorder(log: list, name, delay: float = 0.0):
+    async def job():
+        await asyncio.sleep(delay)
+        log.append(name)
+    return job
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        KeyedWorkPool("test", workers=1, maxsize=1, policy="drop_everything")
+
+
+def test_same_key_runs_in_order():
+    async def scenario():
+        pool = KeyedWorkPool("test", workers=4, maxsize=100)
+        log = []
+        for i in range(10):
+            # Ранние задачи дольше поздних: порядок держится только очередью воркера
+            assert await pool.submit("chat:1", recorder(log, i, delay=(10 - i) / 1000))
+        await pool.stop()
+        return log, pool.stats()
+
+    log, stats = asyncio.run(scenario())
+    assert log == list(range(10))
+    assert stats["completed"] == 10 and stats["workers"] == 0
+
+
+def test_different_keys_run_in_parallel():
+    async def scenario():
+        pool = KeyedWorkPool("test", workers=8, maxsize=10)
+        keys = list(range(8))
+        started = asyncio.get_running_loop().time()
+        log = []
+        for key in keys:
+            await pool.submit(key, recorder(log, key, delay=0.05))
+        await pool.stop()
+        return asyncio.get_running_loop().time() - started, len(log)
+
+    elapsed, done = asyncio.run(scenario())
+    assert done == 8
+    # Ключи раскладываются по воркерам хэшем, так что хотя бы часть задач шла параллельно
+    assert elapsed < 0.05 * 8
+
+
+def test_failed_job_is_counted_and_worker_survives():
+    async def scenario():
+        pool = KeyedWorkPool("test", workers=1, maxsize=10)
+        log = []
+
+        async def broken():
+            raise RuntimeError("boom")
+
+        await pool.submit("k", broken)
+        await pool.submit("k", recorder(log, "after"))
+        await pool.stop()
+        return log, pool.stats()
+
+    log, stats = asyncio.run(scenario())
+    assert log == ["after"]
+    assert stats["failed"] == 1 and stats["completed"] == 1
+
+
+async def _fill(pool: KeyedWorkPool, gate: asyncio.Event, log: list):
+    """Занимает единственного воркера и заполняет его очередь задачей "queued"."""
+    async def blocker():
+        await gate.wait()
+        log.append("blocker")
+
+    await pool.submit("k", blocker)
+    await asyncio.sleep(0)  # Воркер забрал blocker, очередь пуста
+    await pool.submit("k", recorder(log, "queued"))
+
+
+def test_drop_new():
+    async def scenario():
+        pool = KeyedWorkPool("test", workers=1, maxsize=1, policy=DROP_NEW)
+        gate, log = asyncio.Event(), []
+        await _fill(pool, gate, log)
+        accepted = await pool.submit("k", recorder(log, "new"))
+        gate.set()
+        await pool.stop()
+        return accepted, log, pool.stats()["dropped"]
+
+    assert asyncio.run(scenario()) == (False, ["blocker", "queued"], 1)
+
+
+def test_drop_old():
+    async def scenario():
+        pool = KeyedWorkPool("test", workers=1, maxsize=1, policy=DROP_OLD)
+        gate, log = asyncio.Event(), []
+        await _fill(pool, gate, log)
+        accepted = await pool.submit("k", recorder(log, "new"))
+        gate.set()
+        await pool.stop()
+        return accepted, log, pool.stats()["dropped"]
+
+    assert asyncio.run(scenario()) == (True, ["blocker", "new"], 1)
+
+
+def test_inline():
+    async def scenario():
+        pool = KeyedWorkPool("test", workers=1, maxsize=1, policy=INLINE)
+        gate, log = asyncio.Event(), []
+        await _fill(pool, gate, log)
+        accepted = await pool.submit("k", recorder(log, "new"))
+        gate.set()
+        await pool.stop()
+        return accepted, log, pool.stats()["inlined"]
+
+    assert asyncio.run(scenario()) == (True, ["new", "blocker", "queued"], 1)
+
+
+def test_block_waits_then_drops():
+    async def scenario():
+        pool = KeyedWorkPool("test", workers=1, maxsize=1, policy=BLOCK, put_timeout=0.02)
+        gate, log = asyncio.Event(), []
+        await _fill(pool, gate, log)
+        dropped = await pool.submit("k", recorder(log, "dropped"))
+        pool.put_timeout = 1.0
+        asyncio.get_running_loop().call_later(0.01, gate.set)
+        accepted = await pool.submit("k", recorder(log, "new"))
+        await pool.stop()
+        return dropped, accepted, log
+
+    assert asyncio.run(scenario()) == (False, True, ["blocker", "queued", "new"])